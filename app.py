@@ -1,6 +1,11 @@
 import os
+import io
+import csv
+import datetime
 import logging
-from flask import Flask, render_template, redirect, url_for, request, flash, session
+import click
+from logging_config import configure_logging, correlation_context, new_correlation_id
+from flask import Flask, render_template, redirect, url_for, request, flash, session, Response, abort, g, jsonify, send_file, send_from_directory
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
@@ -8,7 +13,7 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash, generate_password_hash
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 class Base(DeclarativeBase):
@@ -28,6 +33,10 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 db.init_app(app)
 
+# Keep session data server-side; the cookie carries only the session ID
+from session_store import DatabaseSessionInterface
+app.session_interface = DatabaseSessionInterface()
+
 # Initialize login manager
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -37,19 +46,95 @@ login_manager.login_message = 'Please log in to access this page.'
 # Import models and initialize database
 with app.app_context():
     from models import User, PodcastConfig, ConversionJob
+    from schema import upgrade_schema
     db.create_all()
+    upgrade_schema(db)
 
 # Import necessary components
 from spotify_client import SpotifyClient
 from youtube_client import YouTubeClient
-from converter import AudioToVideoConverter
-from scheduler import init_scheduler
+from converter import AudioToVideoConverter, RENDITION_PRESETS
+from scheduler import init_scheduler, schedule_podcast_check, unschedule_podcast_check
+from metrics import REGISTRY, JOBS_BY_STATUS
+from config import METRICS_TOKEN, PROFILE_TOKEN, PROFILE_DIRECTORY
+from youtube_quota import quota_summaries
+from visualizer import VISUALIZATION_MODES
+from job_stats import stage_summary, stage_rows, window_start, WINDOWS, DEFAULT_WINDOW
+from retention import archived_job_counts
+from profiling import ProfileSession, should_profile, list_profiles
+
+# Column order for the stage timing export
+STAGE_EXPORT_FIELDS = ['job_id', 'episode_id', 'status', 'stage', 'started_at',
+                       'completed_at', 'duration_seconds', 'bytes', 'succeeded']
+
+@app.before_request
+def start_request_correlation():
+    """Tag every log line of a request with the caller's request ID, or a new one."""
+    request_id = request.headers.get('X-Request-ID', '')[:64] or new_correlation_id()
+    g.log_context = correlation_context(correlation_id=request_id)
+    g.log_context.__enter__()
+    g.request_id = request_id
+
+@app.after_request
+def add_request_id_header(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def end_request_correlation(exc):
+    log_context = g.pop('log_context', None)
+    if log_context:
+        log_context.__exit__(None, None, None)
+
+@app.before_request
+def start_request_profile():
+    """Profile the request when it carries the profiling token, or when sampled."""
+    forced = bool(PROFILE_TOKEN) and request.headers.get('X-Profile') == PROFILE_TOKEN
+    if should_profile(forced):
+        g.profile = ProfileSession('request', request.endpoint or 'unmatched').start()
+
+@app.after_request
+def add_profile_header(response):
+    profile = g.pop('profile', None)
+    if profile:
+        profile_id = profile.stop()
+        if profile_id:
+            response.headers['X-Profile-ID'] = profile_id
+    return response
+
+@app.teardown_request
+def end_request_profile(exc):
+    # A request that raised never reaches after_request
+    profile = g.pop('profile', None)
+    if profile:
+        profile.stop()
 
 @login_manager.user_loader
 def load_user(user_id):
     from models import User
     return User.query.get(int(user_id))
 
+def get_user_config(config_id=None):
+    """Return one of the current user's shows.
+    
+    The show is picked by config_id (from the argument or the request), falling
+    back to the user's first show. Returns 404 for a show the user doesn't own.
+    """
+    from models import PodcastConfig
+    
+    config_id = config_id or request.values.get('config_id', type=int)
+    query = PodcastConfig.query.filter_by(user_id=current_user.id)
+    
+    if config_id:
+        return query.filter_by(id=config_id).first_or_404()
+    return query.order_by(PodcastConfig.id).first()
+
+def selected_window():
+    """Return the stage timing window requested in the query string, if valid."""
+    window = request.args.get('window', DEFAULT_WINDOW)
+    return window if window in WINDOWS else DEFAULT_WINDOW
+
 # Routes
 @app.route('/')
 def index():
@@ -71,6 +156,7 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and check_password_hash(user.password_hash, password):
+            session.regenerate()
             login_user(user)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('dashboard'))
@@ -107,6 +193,7 @@ def register():
             db.session.add(new_user)
             db.session.commit()
             
+            session.regenerate()
             login_user(new_user)
             return redirect(url_for('dashboard'))
     
@@ -116,6 +203,7 @@ def register():
 @login_required
 def logout():
     logout_user()
+    session.clear()
     return redirect(url_for('login'))
 
 @app.route('/dashboard')
@@ -123,60 +211,79 @@ def logout():
 def dashboard():
     from models import PodcastConfig, ConversionJob
     
-    # Get user's podcast configuration
-    config = PodcastConfig.query.filter_by(user_id=current_user.id).first()
+    # Get all of the user's shows
+    configs = PodcastConfig.query.filter_by(user_id=current_user.id).order_by(PodcastConfig.id).all()
+    
+    # Get recent conversion jobs across all shows
+    recent_jobs = ConversionJob.query.filter_by(user_id=current_user.id).options(
+        db.joinedload(ConversionJob.config)).order_by(ConversionJob.created_at.desc()).limit(10).all()
+    
+    # Per-stage timing percentiles
+    window = selected_window()
+    stage_stats = stage_summary(current_user.id, window)
+    
+    # Backfill progress per show
+    from backfill import backfill_progress
+    backfills = backfill_progress([config.id for config in configs])
     
-    # Get recent conversion jobs
-    recent_jobs = ConversionJob.query.filter_by(user_id=current_user.id).order_by(ConversionJob.created_at.desc()).limit(10).all()
+    # YouTube quota used today and forecast per show
+    quotas = quota_summaries(configs)
     
-    return render_template('dashboard.html', config=config, jobs=recent_jobs)
+    return render_template('dashboard.html', configs=configs, jobs=recent_jobs, backfills=backfills,
+                           quotas=quotas, stage_stats=stage_stats, window=window, windows=WINDOWS)
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
     from models import PodcastConfig
     
-    config = PodcastConfig.query.filter_by(user_id=current_user.id).first()
+    # ?new=1 (or a form without a config ID) adds another show
+    creating = request.values.get('new') == '1' or (request.method == 'POST' and not request.form.get('config_id'))
+    config = None if creating else get_user_config()
     
     if request.method == 'POST':
         if not config:
             config = PodcastConfig(user_id=current_user.id)
         
+        config.name = request.form.get('name')
+        
         # Update Spotify configuration
         config.spotify_client_id = request.form.get('spotify_client_id')
         config.spotify_client_secret = request.form.get('spotify_client_secret')
         config.spotify_podcast_id = request.form.get('spotify_podcast_id')
+        config.rss_feed_url = request.form.get('rss_feed_url', '').strip() or None
         
         # Update YouTube configuration
         config.youtube_api_key = request.form.get('youtube_api_key')
         config.youtube_client_id = request.form.get('youtube_client_id')
         config.youtube_client_secret = request.form.get('youtube_client_secret')
-        if 'youtube_refresh_token' in session:
-            config.youtube_refresh_token = session.get('youtube_refresh_token')
         config.youtube_channel_id = request.form.get('youtube_channel_id')
         
         # Update video settings
         config.check_interval = int(request.form.get('check_interval', 60))
+        config.queue_weight = max(int(request.form.get('queue_weight', 1)), 1)
         config.video_height = int(request.form.get('video_height', 720))
         config.video_width = int(request.form.get('video_width', 1280))
         config.video_bitrate = request.form.get('video_bitrate', '1M')
         config.logo_url = request.form.get('logo_url')
+        visualization = request.form.get('visualization', 'none')
+        config.visualization = visualization if visualization in VISUALIZATION_MODES else 'none'
+        config.normalize_audio = 'normalize_audio' in request.form
+        config.trim_silence = 'trim_silence' in request.form
+        config.renditions = ','.join(name for name in request.form.getlist('renditions') if name in RENDITION_PRESETS) or None
         
         db.session.add(config)
         db.session.commit()
         
-        # Clear the YouTube refresh token from the session if it was saved to the database
-        if 'youtube_refresh_token' in session:
-            del session['youtube_refresh_token']
-            
+        # Start checking a new show, or pick up a changed check interval, right away
+        schedule_podcast_check(config)
+        
         flash('Settings updated successfully.')
-        return redirect(url_for('settings'))
+        return redirect(url_for('settings', config_id=config.id))
     
-    # If we have a refresh token in the database, add it to the session for display
-    if config and config.youtube_refresh_token:
-        session['youtube_refresh_token'] = config.youtube_refresh_token
+    configs = PodcastConfig.query.filter_by(user_id=current_user.id).order_by(PodcastConfig.id).all()
     
-    return render_template('settings.html', config=config)
+    return render_template('settings.html', config=config, configs=configs)
 
 @app.route('/history')
 @login_required
@@ -187,27 +294,89 @@ def history():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    # Get user's conversion jobs with pagination
-    jobs = ConversionJob.query.filter_by(user_id=current_user.id).order_by(
+    # Get user's conversion jobs with pagination, loading stage timings in one query
+    jobs = ConversionJob.query.filter_by(user_id=current_user.id).options(
+        db.selectinload(ConversionJob.stages), db.selectinload(ConversionJob.renditions),
+        db.joinedload(ConversionJob.config)).order_by(
         ConversionJob.created_at.desc()).paginate(page=page, per_page=per_page)
     
-    return render_template('history.html', jobs=jobs)
+    # Per-stage timing percentiles
+    window = selected_window()
+    stage_stats = stage_summary(current_user.id, window)
+    
+    # Jobs past retention are only kept as daily totals
+    archived = {}
+    for (_, status), count in archived_job_counts(user_id=current_user.id).items():
+        archived[status] = archived.get(status, 0) + count
+    
+    return render_template('history.html', jobs=jobs, stage_stats=stage_stats,
+                           window=window, windows=WINDOWS, archived=archived)
+
+@app.route('/history/<int:job_id>/renditions/<name>')
+@login_required
+def download_rendition(job_id, name):
+    """Download one of a job's extra renditions."""
+    from models import ConversionJob, JobRendition
+    
+    rendition = JobRendition.query.join(ConversionJob).filter(
+        ConversionJob.id == job_id,
+        ConversionJob.user_id == current_user.id,
+        JobRendition.name == name
+    ).first_or_404()
+    
+    if not os.path.exists(rendition.path):
+        abort(404)
+    return send_file(rendition.path, mimetype='video/mp4', as_attachment=True,
+                     download_name=f"job-{job_id}-{name}.mp4")
+
+@app.route('/history/export')
+@login_required
+def history_export():
+    """Download per-stage timings for offline analysis as CSV or JSON."""
+    window = selected_window()
+    rows = [
+        {
+            'job_id': job.id,
+            'episode_id': job.episode_id,
+            'status': job.status,
+            'stage': stage.stage,
+            'started_at': stage.started_at.isoformat() if stage.started_at else None,
+            'completed_at': stage.completed_at.isoformat() if stage.completed_at else None,
+            'duration_seconds': stage.duration_seconds,
+            'bytes': stage.bytes,
+            'succeeded': stage.succeeded
+        }
+        for job, stage in stage_rows(current_user.id, window_start(window))
+    ]
+    
+    if request.args.get('format') == 'json':
+        return jsonify(rows)
+    
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=STAGE_EXPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=job_stages_{window}.csv'}
+    )
 
 @app.route('/test_spotify', methods=['POST'])
 @login_required
 def test_spotify():
-    from models import PodcastConfig
     from spotify_client import SpotifyClient
     
-    config = PodcastConfig.query.filter_by(user_id=current_user.id).first()
+    config = get_user_config()
     
     if not config or not config.spotify_podcast_id:
         flash('Please configure your Spotify podcast ID first.')
-        return redirect(url_for('settings'))
+        return redirect(url_for('settings', config_id=config.id if config else None))
     
     if not config.spotify_client_id or not config.spotify_client_secret:
         flash('Please provide your Spotify API credentials.')
-        return redirect(url_for('settings'))
+        return redirect(url_for('settings', config_id=config.id))
     
     try:
         # Use the credentials from the database
@@ -220,15 +389,14 @@ def test_spotify():
     except Exception as e:
         flash(f'Error connecting to Spotify: {str(e)}')
     
-    return redirect(url_for('settings'))
+    return redirect(url_for('settings', config_id=config.id))
 
 @app.route('/test_youtube', methods=['POST'])
 @login_required
 def test_youtube():
     from youtube_client import YouTubeClient
-    from models import PodcastConfig
     
-    config = PodcastConfig.query.filter_by(user_id=current_user.id).first()
+    config = get_user_config()
     
     if not config:
         flash('Please configure your settings first.')
@@ -245,7 +413,7 @@ def test_youtube():
         
         # If we don't have a refresh token, redirect to authorization
         if not youtube_client.refresh_token and youtube_client.client_id and youtube_client.client_secret:
-            return redirect(url_for('youtube_auth'))
+            return redirect(url_for('youtube_auth', config_id=config.id))
         
         # If we have a refresh token, try to use it
         if youtube_client.youtube:
@@ -259,24 +427,23 @@ def test_youtube():
             flash(f'Successfully connected to YouTube. Channel name: {channel_info.get("title", "Unknown")}')
         else:
             flash('YouTube API client not initialized. Please complete authorization.')
-            return redirect(url_for('youtube_auth'))
+            return redirect(url_for('youtube_auth', config_id=config.id))
     except Exception as e:
         flash(f'Error connecting to YouTube: {str(e)}')
     
-    return redirect(url_for('settings'))
+    return redirect(url_for('settings', config_id=config.id))
 
 @app.route('/youtube/auth')
 @login_required
 def youtube_auth():
     """Start the YouTube OAuth flow."""
     from youtube_client import YouTubeClient
-    from models import PodcastConfig
     
-    config = PodcastConfig.query.filter_by(user_id=current_user.id).first()
+    config = get_user_config()
     
     if not config or not config.youtube_client_id or not config.youtube_client_secret:
         flash('Please provide your YouTube API client ID and client secret first.')
-        return redirect(url_for('settings'))
+        return redirect(url_for('settings', config_id=config.id if config else None))
     
     try:
         # Use the credentials from the database
@@ -287,24 +454,25 @@ def youtube_auth():
         
         # Generate the authorization URL
         redirect_uri = url_for('youtube_callback', _external=True)
-        auth_url = youtube_client.generate_authorization_url(redirect_uri)
+        auth_url = youtube_client.generate_authorization_url(redirect_uri, config.id)
         
         # Redirect to Google's OAuth page
         return redirect(auth_url)
     except Exception as e:
         flash(f'Error initiating YouTube authorization: {str(e)}')
-        return redirect(url_for('settings'))
+        return redirect(url_for('settings', config_id=config.id))
 
 @app.route('/youtube/callback')
 @login_required
 def youtube_callback():
     """Handle the YouTube OAuth callback."""
     from youtube_client import YouTubeClient
-    from models import PodcastConfig
     
-    config = PodcastConfig.query.filter_by(user_id=current_user.id).first()
+    # The callback URL is fixed, so the pending authorization says which show it's for
+    pending = session.get('youtube_auth') or {}
+    config = get_user_config(pending.get('config_id'))
     
-    if not config:
+    if not pending or not config:
         flash('Configuration not found.')
         return redirect(url_for('settings'))
     
@@ -322,10 +490,7 @@ def youtube_callback():
         result = youtube_client.handle_authorization_response(authorization_response)
         
         if result['success']:
-            # Store the refresh token in the session for the form to display
-            session['youtube_refresh_token'] = result['refresh_token']
-            
-            # Also save it to the database
+            # Save the refresh token to the show's settings
             config.youtube_refresh_token = result['refresh_token']
             db.session.commit()
             
@@ -335,15 +500,14 @@ def youtube_callback():
     except Exception as e:
         flash(f'Error completing YouTube authorization: {str(e)}')
     
-    return redirect(url_for('settings'))
+    return redirect(url_for('settings', config_id=config.id))
 
 @app.route('/manual_check', methods=['POST'])
 @login_required
 def manual_check():
-    from models import PodcastConfig
     from scheduler import check_and_process_new_episodes
     
-    config = PodcastConfig.query.filter_by(user_id=current_user.id).first()
+    config = get_user_config()
     
     if not config:
         flash('Please configure your settings first.')
@@ -353,15 +517,196 @@ def manual_check():
         # Run the check function
         result = check_and_process_new_episodes(config.id)
         if result:
-            flash(f'Found and processed {result} new episode(s).')
+            flash(f'Found {result} new episode(s). They have been queued for processing.')
         else:
             flash('No new episodes found.')
     except Exception as e:
-        logger.error(f"Error during manual check: {str(e)}")
+        logger.error("Error during manual check: %s", e)
         flash(f'Error checking for new episodes: {str(e)}')
     
     return redirect(url_for('dashboard'))
 
+@app.route('/settings/delete', methods=['POST'])
+@login_required
+def delete_settings():
+    """Delete one of the user's shows and stop checking it."""
+    from models import PodcastConfig, ProcessedEpisode, ConversionJob, JobDailySummary
+    
+    config_id = request.form.get('config_id', type=int)
+    if not config_id:
+        abort(400)
+    get_user_config(config_id)
+    
+    try:
+        # Jobs waiting or running can't be uploaded anywhere once the show is gone
+        ConversionJob.query.filter(
+            ConversionJob.config_id == config_id,
+            ConversionJob.status.in_(('pending', 'processing'))
+        ).update({'status': 'failed', 'error_message': 'Show deleted',
+                  'completed_at': datetime.datetime.utcnow()}, synchronize_session=False)
+        
+        # Keep the show's finished jobs in the history, unlinked from it
+        ConversionJob.query.filter(
+            ConversionJob.config_id == config_id,
+            ConversionJob.status.in_(('completed', 'failed'))
+        ).update({'config_id': None, 'show_deleted': True}, synchronize_session=False)
+        JobDailySummary.query.filter_by(config_id=config_id).update({'config_id': None}, synchronize_session=False)
+        ProcessedEpisode.query.filter_by(config_id=config_id).delete(synchronize_session=False)
+        PodcastConfig.query.filter_by(id=config_id).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error deleting config %s: %s", config_id, e)
+        flash(f'Error deleting show: {str(e)}')
+        return redirect(url_for('settings', config_id=config_id))
+    
+    unschedule_podcast_check(config_id)
+    
+    flash('Show deleted.')
+    return redirect(url_for('settings'))
+
+@app.route('/backfill', methods=['POST'])
+@login_required
+def backfill():
+    """Enqueue a show's whole back-catalogue."""
+    from backfill import start_backfill
+    
+    config = get_user_config()
+    
+    if not config:
+        flash('Please configure your settings first.')
+        return redirect(url_for('settings'))
+    
+    try:
+        count = start_backfill(config.id)
+        if count:
+            flash(f'Queued {count} episode(s) for backfill.')
+        else:
+            flash('No unprocessed episodes found to backfill.')
+    except Exception as e:
+        logger.error("Error starting backfill: %s", e)
+        flash(f'Error starting backfill: {str(e)}')
+    
+    return redirect(url_for('dashboard'))
+
+@app.route('/backfill/status')
+@login_required
+def backfill_status():
+    """Return backfill progress and ETA for one show as JSON."""
+    from backfill import backfill_progress
+    
+    config = get_user_config()
+    
+    if not config:
+        abort(404)
+    
+    progress = backfill_progress([config.id]).get(config.id)
+    if progress and progress['eta']:
+        progress['eta'] = progress['eta'].isoformat()
+    
+    return jsonify({'config_id': config.id, 'backfill': progress})
+
+@app.cli.command('backfill')
+@click.argument('config_id', type=int)
+@click.option('--daily-uploads', type=int, default=None, help='Backfill jobs allowed to become due per day.')
+def backfill_command(config_id, daily_uploads):
+    """Enqueue every unprocessed episode of a show."""
+    from backfill import start_backfill
+    
+    count = start_backfill(config_id, daily_uploads)
+    click.echo(f'Queued {count} episode(s) for backfill.')
+
+@app.cli.command('benchmark-visualization')
+@click.argument('audio_path')
+@click.argument('image_path')
+@click.option('--mode', type=click.Choice(['waveform', 'spectrum']), default='waveform')
+@click.option('--width', type=int, default=1280)
+@click.option('--height', type=int, default=720)
+@click.option('--seconds', type=int, default=None, help='Only render the first N seconds of the audio.')
+def benchmark_visualization_command(audio_path, image_path, mode, width, height, seconds):
+    """Report how fast a visualization renders, as a multiple of realtime."""
+    from visualizer import benchmark
+    
+    result = benchmark(audio_path, image_path, mode, width=width, height=height, seconds=seconds)
+    click.echo(f"Engine: {result['engine']} at {result['fps']} fps")
+    if 'analysis_seconds' in result:
+        click.echo(f"Analysis: {result['analysis_seconds']:.2f}s")
+    click.echo(f"Rendered {result['media_seconds'] or 0:.1f}s of audio in {result['elapsed_seconds']:.2f}s")
+    if result['realtime_multiple']:
+        click.echo(f"Speed: {result['realtime_multiple']:.1f}x realtime")
+
+@app.cli.command('profile-job')
+@click.argument('job_id', type=int)
+@click.option('--retry', is_flag=True, help='Also queue a failed job to run again.')
+def profile_job_command(job_id, retry):
+    """Profile a job the next time it runs."""
+    from models import ConversionJob
+    from config import PRIORITY_RETRY
+    
+    job = db.session.get(ConversionJob, job_id)
+    if not job:
+        raise click.ClickException(f"Job {job_id} not found.")
+    
+    job.profile = True
+    if retry:
+        if job.status != 'failed':
+            raise click.ClickException(f"Only failed jobs can be retried; job {job_id} is {job.status}.")
+        job.status = 'pending'
+        job.priority = PRIORITY_RETRY
+        job.started_at = None
+        job.completed_at = None
+        job.error_message = None
+    db.session.commit()
+    
+    if job.status == 'pending':
+        click.echo(f"Job {job_id} will be profiled when it runs; see {PROFILE_DIRECTORY}.")
+    else:
+        click.echo(f"Job {job_id} is {job.status}; it will be profiled if it runs again.")
+
+def collect_job_status_counts():
+    """Refresh the jobs-by-status gauge from the database."""
+    from models import ConversionJob
+    
+    counts = dict(
+        db.session.query(ConversionJob.status, db.func.count(ConversionJob.id))
+        .group_by(ConversionJob.status)
+        .all()
+    )
+    for status in ('pending', 'processing', 'completed', 'failed'):
+        JOBS_BY_STATUS.set(counts.pop(status, 0), status=status)
+    for status, count in counts.items():
+        JOBS_BY_STATUS.set(count, status=status)
+
+REGISTRY.add_collector(collect_job_status_counts)
+
+@app.route('/metrics')
+def metrics():
+    """Expose pipeline metrics in the Prometheus text format."""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def require_profile_token():
+    if not PROFILE_TOKEN:
+        abort(404)
+    if request.headers.get('Authorization') != f"Bearer {PROFILE_TOKEN}":
+        abort(401)
+
+@app.route('/profiles')
+def profiles():
+    """List stored profiles, newest first."""
+    require_profile_token()
+    return jsonify(list_profiles())
+
+@app.route('/profiles/<filename>')
+def download_profile(filename):
+    """Download a profile's summary (.json), cProfile stats (.prof) or sampled stacks (.folded)."""
+    require_profile_token()
+    if not filename.endswith(('.json', '.prof', '.folded')):
+        abort(404)
+    return send_from_directory(PROFILE_DIRECTORY, filename, as_attachment=True)
+
 # Initialize scheduler
 with app.app_context():
     init_scheduler(app)
@@ -0,0 +1,158 @@
+import re
+import json
+import logging
+import subprocess
+from config import (
+    FFMPEG_PATH,
+    LOUDNESS_TARGET_I,
+    LOUDNESS_TARGET_TP,
+    LOUDNESS_TARGET_LRA,
+    SILENCE_THRESHOLD_DB,
+    SILENCE_MIN_SECONDS
+)
+from metrics import AUDIO_MEASUREMENT_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Silence kept at each end of a trimmed episode so it doesn't start or stop abruptly
+TRIM_PADDING_SECONDS = 0.25
+
+# Sample rate of the processed audio (loudnorm works at 192 kHz internally)
+OUTPUT_SAMPLE_RATE = 48000
+
+SILENCE_START_PATTERN = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+SILENCE_END_PATTERN = re.compile(r"silence_end: (-?\d+(?:\.\d+)?)")
+LOUDNORM_JSON_PATTERN = re.compile(r"\{[^{}]*\"input_i\"[^{}]*\}", re.S)
+
+def loudness_target():
+    """Return the loudnorm target as a string, used to key cached measurements."""
+    return f"I={LOUDNESS_TARGET_I}:TP={LOUDNESS_TARGET_TP}:LRA={LOUDNESS_TARGET_LRA}"
+
+def parse_silences(stderr):
+    """Return (start, end) pairs reported by silencedetect; end is None for silence running to the end."""
+    events = []
+    for line in stderr.splitlines():
+        start = SILENCE_START_PATTERN.search(line)
+        if start:
+            events.append([float(start.group(1)), None])
+            continue
+        end = SILENCE_END_PATTERN.search(line)
+        if end and events and events[-1][1] is None:
+            events[-1][1] = float(end.group(1))
+    return [tuple(event) for event in events]
+
+def trim_points(silences, duration):
+    """Return (trim_start, trim_end) that cut leading and trailing silence, keeping a little padding."""
+    trim_start = 0.0
+    trim_end = duration
+
+    if silences and silences[0][0] <= 0.05 and silences[0][1] is not None:
+        trim_start = max(silences[0][1] - TRIM_PADDING_SECONDS, 0.0)
+
+    if silences:
+        start, end = silences[-1]
+        if start > trim_start and (end is None or (duration and end >= duration - 0.05)):
+            trim_end = start + TRIM_PADDING_SECONDS
+
+    if not duration or trim_end is None or trim_end <= trim_start:
+        return 0.0, None
+    return trim_start, (trim_end if trim_end < duration else None)
+
+def measure_audio(audio_path, ffmpeg_path=None):
+    """Measure loudness and find leading/trailing silence in one decode of the audio."""
+    from converter import parse_ffmpeg_media_seconds, stderr_tail
+
+    audio_filter = (
+        f"silencedetect=n={SILENCE_THRESHOLD_DB}dB:d={SILENCE_MIN_SECONDS},"
+        f"loudnorm={loudness_target()}:print_format=json"
+    )
+    command = [
+        ffmpeg_path or FFMPEG_PATH,
+        "-hide_banner",
+        "-i", audio_path,
+        "-vn",
+        "-af", audio_filter,
+        "-f", "null",
+        "-"
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, errors='replace')
+    if result.returncode != 0:
+        raise Exception(f"Audio analysis failed: {stderr_tail(result.stderr)}")
+
+    match = LOUDNORM_JSON_PATTERN.search(result.stderr)
+    if not match:
+        raise Exception("Audio analysis produced no loudness measurement")
+    loudness = json.loads(match.group(0))
+
+    duration = parse_ffmpeg_media_seconds(result.stderr)
+    trim_start, trim_end = trim_points(parse_silences(result.stderr), duration)
+
+    return {
+        'input_i': float(loudness['input_i']),
+        'input_tp': float(loudness['input_tp']),
+        'input_lra': float(loudness['input_lra']),
+        'input_thresh': float(loudness['input_thresh']),
+        'target_offset': float(loudness['target_offset']),
+        'duration': duration,
+        'trim_start': trim_start,
+        'trim_end': trim_end
+    }
+
+def get_measurements(audio_path, ffmpeg_path=None):
+    """Return the audio's measurements, reusing ones stored for identical audio.
+
+    Measurements are keyed by a hash of the audio bytes and the loudness
+    target, so retries and re-encodes of an episode skip the analysis pass.
+    Outside an app context the audio is simply measured.
+    """
+    from title_cards import file_digest
+
+    digest = file_digest(audio_path)
+    target = loudness_target()
+
+    try:
+        from app import db
+        from models import AudioMeasurement
+
+        cached = AudioMeasurement.query.filter_by(audio_sha256=digest, target=target).first()
+    except Exception as e:
+        logger.debug("Audio measurement cache unavailable: %s", e)
+        return measure_audio(audio_path, ffmpeg_path)
+
+    if cached:
+        AUDIO_MEASUREMENT_LOOKUPS.inc(result='hit')
+        return cached.as_dict()
+    AUDIO_MEASUREMENT_LOOKUPS.inc(result='miss')
+
+    measurements = measure_audio(audio_path, ffmpeg_path)
+    try:
+        db.session.add(AudioMeasurement(audio_sha256=digest, target=target, **measurements))
+        db.session.commit()
+    except Exception as e:
+        # Another worker stored the same audio first; the measurements are identical
+        db.session.rollback()
+        logger.debug("Could not store audio measurements: %s", e)
+    return measurements
+
+def audio_filter(measurements, normalize=True, trim=True):
+    """Build the filter that applies cached measurements: trim, then linear loudness normalization."""
+    filters = []
+    if trim and (measurements['trim_start'] or measurements['trim_end']):
+        trim_filter = f"atrim=start={measurements['trim_start']:.3f}"
+        if measurements['trim_end']:
+            trim_filter += f":end={measurements['trim_end']:.3f}"
+        filters.extend([trim_filter, "asetpts=PTS-STARTPTS"])
+
+    if normalize:
+        filters.append(
+            f"loudnorm={loudness_target()}"
+            f":measured_I={measurements['input_i']}"
+            f":measured_TP={measurements['input_tp']}"
+            f":measured_LRA={measurements['input_lra']}"
+            f":measured_thresh={measurements['input_thresh']}"
+            f":offset={measurements['target_offset']}"
+            ":linear=true"
+        )
+        filters.append(f"aresample={OUTPUT_SAMPLE_RATE}")
+
+    return ','.join(filters)
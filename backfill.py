@@ -0,0 +1,189 @@
+import logging
+import datetime
+from spotify_client import SpotifyClient
+from feed_client import load_feed_index
+from config import PRIORITY_BACKFILL, BACKFILL_PAGE_SIZE, BACKFILL_DAILY_UPLOADS
+
+logger = logging.getLogger(__name__)
+
+def start_backfill(config_id, daily_uploads=None):
+    """Enqueue every episode of a show that hasn't been processed yet.
+
+    Episodes are enqueued oldest first at backfill priority, and their
+    not_before times are spread so that at most `daily_uploads` backfill jobs
+    per show become due each day. This keeps backfills inside the YouTube
+    upload quota. Returns the number of jobs enqueued.
+    """
+    from app import db
+    from models import PodcastConfig, ProcessedEpisode, ConversionJob
+
+    daily_uploads = max(daily_uploads or BACKFILL_DAILY_UPLOADS, 1)
+
+    config = PodcastConfig.query.get(config_id)
+    if not config or not config.spotify_podcast_id:
+        raise ValueError(f"Invalid podcast configuration for ID {config_id}")
+    if not config.spotify_client_id or not config.spotify_client_secret:
+        raise ValueError("Spotify API credentials not configured")
+
+    spotify_client = SpotifyClient(
+        client_id=config.spotify_client_id,
+        client_secret=config.spotify_client_secret
+    )
+
+    # Load the already-processed IDs once instead of querying per episode
+    processed_ids = {
+        episode_id for (episode_id,) in
+        db.session.query(ProcessedEpisode.episode_id).filter_by(config_id=config.id)
+    }
+
+    episodes = [
+        episode for episode in spotify_client.iter_podcast_episodes(config.spotify_podcast_id, BACKFILL_PAGE_SIZE)
+        if episode['id'] not in processed_ids
+    ]
+    # Spotify lists newest first; publish the back-catalogue in release order
+    episodes.reverse()
+
+    # Full-length audio comes from the show's feed where an item matches
+    feed_index = load_feed_index(config)
+
+    # Continue after any backfill that is already scheduled for this show: from its
+    # last day, or from now if every scheduled job is already due
+    pending = ConversionJob.query.filter_by(config_id=config.id, source='backfill', status='pending')
+    start = datetime.datetime.utcnow()
+    last_due = pending.with_entities(db.func.max(ConversionJob.not_before)).scalar()
+    if last_due and last_due > start:
+        start = last_due
+        already_pending = pending.filter(ConversionJob.not_before == last_due).count()
+    else:
+        already_pending = pending.count()
+
+    jobs = []
+    processed = []
+    seen = set()
+
+    for episode in episodes:
+        if episode['id'] in seen:
+            continue
+        seen.add(episode['id'])
+
+        slot = already_pending + len(jobs)
+        item = feed_index.match(episode) if feed_index else None
+        jobs.append(ConversionJob(
+            user_id=config.user_id,
+            config_id=config.id,
+            episode_id=episode['id'],
+            status='pending',
+            source='backfill',
+            priority=PRIORITY_BACKFILL,
+            not_before=start + datetime.timedelta(days=slot // daily_uploads),
+            episode_title=episode['name'],
+            audio_url=item.enclosure_url if item else episode.get('audio_preview_url', ''),
+            duration_seconds=episode['duration_ms'] / 1000 if episode.get('duration_ms') else None
+        ))
+        processed.append(ProcessedEpisode(
+            config_id=config.id,
+            episode_id=episode['id'],
+            episode_title=episode['name'],
+            episode_url=episode.get('external_urls', {}).get('spotify', '')
+        ))
+
+    # One bulk insert for the whole catalogue
+    db.session.add_all(jobs)
+    db.session.add_all(processed)
+    db.session.commit()
+
+    logger.info("Enqueued %s backfill jobs for config %s", len(jobs), config.id)
+    return len(jobs)
+
+def backfill_progress(config_ids):
+    """Return backfill progress and ETA for each of the given shows.
+
+    The ETA is the later of when the last job becomes due and how long the
+    jobs that are already due will take at the show's average job duration.
+    """
+    from app import db
+    from models import ConversionJob
+
+    if not config_ids:
+        return {}
+
+    counts = (
+        db.session.query(ConversionJob.config_id, ConversionJob.status, db.func.count(ConversionJob.id))
+        .filter(ConversionJob.config_id.in_(config_ids), ConversionJob.source == 'backfill')
+        .group_by(ConversionJob.config_id, ConversionJob.status)
+        .all()
+    )
+
+    # Finished jobs past retention only survive as daily summaries
+    from retention import archived_job_counts
+    counts += [
+        (config_id, status, count)
+        for (config_id, status), count in archived_job_counts(config_ids=config_ids, source='backfill').items()
+    ]
+
+    progress = {}
+    for config_id, status, count in counts:
+        entry = progress.setdefault(config_id, {'total': 0, 'pending': 0, 'processing': 0, 'completed': 0, 'failed': 0})
+        entry[status] = entry.get(status, 0) + count
+        entry['total'] += count
+
+    now = datetime.datetime.utcnow()
+    pending_due = {
+        config_id: (last_due, due_now)
+        for config_id, last_due, due_now in (
+            db.session.query(
+                ConversionJob.config_id,
+                db.func.max(ConversionJob.not_before),
+                db.func.sum(db.case((ConversionJob.not_before <= now, 1), else_=0))
+            )
+            .filter(ConversionJob.config_id.in_(config_ids), ConversionJob.source == 'backfill',
+                    ConversionJob.status == 'pending')
+            .group_by(ConversionJob.config_id)
+        )
+    }
+
+    # The last 50 completed backfill jobs of each show give its average job duration
+    recent = (
+        db.session.query(
+            ConversionJob.config_id,
+            ConversionJob.started_at,
+            ConversionJob.completed_at,
+            db.func.row_number().over(
+                partition_by=ConversionJob.config_id,
+                order_by=ConversionJob.completed_at.desc()
+            ).label('rank')
+        )
+        .filter(
+            ConversionJob.config_id.in_(config_ids),
+            ConversionJob.source == 'backfill',
+            ConversionJob.status == 'completed',
+            ConversionJob.started_at.isnot(None),
+            ConversionJob.completed_at.isnot(None)
+        )
+        .subquery()
+    )
+    durations = {}
+    for config_id, started, completed in (
+        db.session.query(recent.c.config_id, recent.c.started_at, recent.c.completed_at).filter(recent.c.rank <= 50)
+    ):
+        durations.setdefault(config_id, []).append((completed - started).total_seconds())
+
+    for config_id, entry in progress.items():
+        remaining = entry['pending'] + entry['processing']
+        entry['done'] = entry['total'] - remaining
+        entry['percent'] = int(100 * entry['done'] / entry['total']) if entry['total'] else 100
+        entry['eta'] = None
+
+        if not remaining:
+            continue
+
+        last_due, due_now = pending_due.get(config_id, (None, 0))
+        finished = durations.get(config_id)
+        average = sum(finished) / len(finished) if finished else 0
+
+        eta = now + datetime.timedelta(seconds=average * ((due_now or 0) + entry['processing']))
+        if last_due and last_due + datetime.timedelta(seconds=average) > eta:
+            eta = last_due + datetime.timedelta(seconds=average)
+        entry['eta'] = eta
+
+    return progress
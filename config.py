@@ -1,29 +1,149 @@
 import os
 
-# Spotify API configuration
+# Spotify API configuration (the URLs can point at local stand-ins, see fake_services.py)
 SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET')
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+SPOTIFY_TOKEN_URL = os.environ.get('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+
+# Podcast RSS/Atom feeds, which provide the full-length audio Spotify's API doesn't
+FEED_REQUEST_TIMEOUT = int(os.environ.get('FEED_REQUEST_TIMEOUT', 30))  # In seconds
+FEED_MATCH_DURATION_TOLERANCE = float(os.environ.get('FEED_MATCH_DURATION_TOLERANCE', 0.05))  # Share of the episode length
+FEED_MATCH_GRACE_HOURS = int(os.environ.get('FEED_MATCH_GRACE_HOURS', 24))  # Wait this long for a new episode to reach the feed
 
 # YouTube API configuration
 YOUTUBE_API_KEY = os.environ.get('YOUTUBE_API_KEY')
 YOUTUBE_CLIENT_ID = os.environ.get('YOUTUBE_CLIENT_ID')
 YOUTUBE_CLIENT_SECRET = os.environ.get('YOUTUBE_CLIENT_SECRET')
 YOUTUBE_REFRESH_TOKEN = os.environ.get('YOUTUBE_REFRESH_TOKEN')
+YOUTUBE_TOKEN_URI = os.environ.get('YOUTUBE_TOKEN_URI', 'https://oauth2.googleapis.com/token')
+YOUTUBE_DISCOVERY_URL = os.environ.get('YOUTUBE_DISCOVERY_URL')  # Unset uses the discovery document bundled with the client
+YOUTUBE_DAILY_QUOTA = int(os.environ.get('YOUTUBE_DAILY_QUOTA', 10000))  # Units per API project per day
+YOUTUBE_UPLOAD_RETRIES = int(os.environ.get('YOUTUBE_UPLOAD_RETRIES', 5))  # Per upload chunk; resumed where the failed chunk began
+
+# Spotify and YouTube calls: transient failures (429, 5xx, network) are retried with jittered exponential
+# backoff, honoring Retry-After, and each service has a circuit breaker that pauses work needing it
+API_REQUEST_TIMEOUT = int(os.environ.get('API_REQUEST_TIMEOUT', 30))  # In seconds
+API_RETRIES = int(os.environ.get('API_RETRIES', 3))  # Retries per API call
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 1.0))  # In seconds; doubles per retry
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 30.0))  # Longer Retry-After waits open the breaker instead
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))  # Consecutive failures that open a breaker
+BREAKER_RESET_SECONDS = int(os.environ.get('BREAKER_RESET_SECONDS', 60))  # Before an open breaker lets a trial call through
+
+# Logging
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_LEVELS = os.environ.get('LOG_LEVELS', 'apscheduler=WARNING,urllib3=WARNING,googleapiclient.discovery_cache=ERROR')
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', 10))  # Keep 1 in N high-volume log lines
 
 # Temporary file storage
 TEMP_DIRECTORY = os.environ.get('TEMP_DIRECTORY', '/tmp/podcast_converter')
 
+# Temporary storage limits
+TEMP_QUOTA_BYTES = int(os.environ.get('TEMP_QUOTA_BYTES', 10 * 1024 ** 3))  # 10 GB across all jobs
+TEMP_MIN_FREE_BYTES = int(os.environ.get('TEMP_MIN_FREE_BYTES', 1024 ** 3))  # Always leave 1 GB free on disk
+TEMP_ORPHAN_MAX_AGE = int(os.environ.get('TEMP_ORPHAN_MAX_AGE', 6 * 60 * 60))  # In seconds
+TEMP_SWEEP_INTERVAL = int(os.environ.get('TEMP_SWEEP_INTERVAL', 30))  # In minutes
+TEMP_DEFER_BASE_DELAY = int(os.environ.get('TEMP_DEFER_BASE_DELAY', 60))  # In seconds; doubles per deferral
+TEMP_DEFER_MAX_DELAY = int(os.environ.get('TEMP_DEFER_MAX_DELAY', 60 * 60))  # In seconds
+
+# RAM-backed scratch space for small jobs (set the budget to 0 to disable)
+RAM_SCRATCH_DIRECTORY = os.environ.get('RAM_SCRATCH_DIRECTORY', '/dev/shm/podcast_converter')
+RAM_SCRATCH_THRESHOLD_BYTES = int(os.environ.get('RAM_SCRATCH_THRESHOLD_BYTES', 64 * 1024 ** 2))  # Largest job kept in RAM
+RAM_SCRATCH_BUDGET_BYTES = int(os.environ.get('RAM_SCRATCH_BUDGET_BYTES', 512 * 1024 ** 2))  # Total RAM for all jobs
+
 # FFmpeg settings
 FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+FFPROBE_PATH = os.environ.get('FFPROBE_PATH', 'ffprobe')
+
+# Title cards and thumbnails, rendered once per episode and cached by content hash
+RENDER_CACHE_DIRECTORY = os.environ.get('RENDER_CACHE_DIRECTORY', '/tmp/podcast_converter_renders')
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+TITLE_FONT_FILE = os.environ.get('TITLE_FONT_FILE')  # Defaults to FFmpeg's fontconfig default
+
+# Extra aspect ratios rendered alongside a show's main video, kept for download with each job
+RENDITION_DIRECTORY = os.environ.get('RENDITION_DIRECTORY', '/tmp/podcast_converter_renditions')
+
+# Encoded videos, cached by content hash so identical episodes (e.g. cross-posts) and retries skip the encode
+OUTPUT_CACHE_DIRECTORY = os.environ.get('OUTPUT_CACHE_DIRECTORY', '/tmp/podcast_converter_outputs')
+OUTPUT_CACHE_MAX_BYTES = int(os.environ.get('OUTPUT_CACHE_MAX_BYTES', 5 * 1024 ** 3))  # Set to 0 to disable
+
+# Waveform/spectrum visualization (NumPy is used when installed)
+VISUALIZATION_FRAME_RATE = int(os.environ.get('VISUALIZATION_FRAME_RATE', 10))
+
+# Segmented encoding: long episodes are encoded as parallel segments and joined
+ENCODE_PARALLELISM = int(os.environ.get('ENCODE_PARALLELISM', os.cpu_count() or 1))  # Concurrent FFmpeg processes per job
+ENCODE_SEGMENT_SECONDS = int(os.environ.get('ENCODE_SEGMENT_SECONDS', 10 * 60))
+ENCODE_SEGMENT_MIN_SECONDS = int(os.environ.get('ENCODE_SEGMENT_MIN_SECONDS', 30 * 60))  # Shorter episodes use one encode
+
+# Encode-while-uploading: FFmpeg writes fragmented MP4 that is uploaded chunk by chunk as it's written.
+# Replaces segmented encoding when enabled; shows with a visualization always encode first.
+STREAMING_UPLOAD = os.environ.get('STREAMING_UPLOAD', '0') in ('1', 'true', 'yes')
+STREAMING_UPLOAD_CHUNK_BYTES = int(os.environ.get('STREAMING_UPLOAD_CHUNK_BYTES', 8 * 1024 ** 2))  # A multiple of 256 KiB
+
+# Loudness normalization (EBU R128) and silence trimming, enabled per show
+LOUDNESS_TARGET_I = float(os.environ.get('LOUDNESS_TARGET_I', -16))  # Integrated loudness in LUFS
+LOUDNESS_TARGET_TP = float(os.environ.get('LOUDNESS_TARGET_TP', -1.5))  # True peak in dBTP
+LOUDNESS_TARGET_LRA = float(os.environ.get('LOUDNESS_TARGET_LRA', 11))  # Loudness range in LU
+SILENCE_THRESHOLD_DB = float(os.environ.get('SILENCE_THRESHOLD_DB', -50))  # Quieter than this counts as silence
+SILENCE_MIN_SECONDS = float(os.environ.get('SILENCE_MIN_SECONDS', 1.0))  # Shorter gaps are never trimmed
+
+# Metrics endpoint (if set, scrapers must send "Authorization: Bearer <token>")
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Server-side sessions: the cookie holds only an opaque session ID
+SESSION_TOUCH_INTERVAL = int(os.environ.get('SESSION_TOUCH_INTERVAL', 60 * 60))  # Seconds between expiry refreshes of an unchanged session
+SESSION_PURGE_INTERVAL = int(os.environ.get('SESSION_PURGE_INTERVAL', 60))  # In minutes
+
+# Profiling, off unless triggered: jobs marked with "flask profile-job", requests sent with
+# "X-Profile: <PROFILE_TOKEN>", or a random share of jobs, dispatch ticks and requests
+PROFILE_DIRECTORY = os.environ.get('PROFILE_DIRECTORY', '/tmp/podcast_converter_profiles')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # Also the bearer token for /profiles; unset disables both
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # Share of work profiled at random
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')  # 'cprofile' or 'sampling' (stack samples, lower overhead)
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.01))  # Seconds between stack samples
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))  # Newest profiles kept
+
+# Retention: finished jobs past JOB_RETENTION_DAYS are archived to compressed files and rolled into daily summaries
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 90))  # 0 keeps jobs forever; never less than the longest stats window
+JOB_ARCHIVE_DIRECTORY = os.environ.get('JOB_ARCHIVE_DIRECTORY', '/tmp/podcast_converter_archive')
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 24 * 60))  # In minutes
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))  # Jobs archived per transaction
+RETENTION_BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', 1.0))  # Seconds between batches
+ERROR_MESSAGE_MAX_CHARS = int(os.environ.get('ERROR_MESSAGE_MAX_CHARS', 4000))  # Longer job errors keep their start and end
 
 # Default video settings
 DEFAULT_VIDEO_WIDTH = 1280
 DEFAULT_VIDEO_HEIGHT = 720
 DEFAULT_VIDEO_BITRATE = '1M'
 
+# Discovery engine: shows are polled concurrently on one event loop (aiohttp is used when installed)
+DISCOVERY_MAX_CONNECTIONS = int(os.environ.get('DISCOVERY_MAX_CONNECTIONS', 32))  # Open connections across all hosts
+DISCOVERY_PER_HOST_LIMIT = int(os.environ.get('DISCOVERY_PER_HOST_LIMIT', 8))  # Concurrent requests to any one host
+DISCOVERY_CONCURRENCY = int(os.environ.get('DISCOVERY_CONCURRENCY', 500))  # Show checks in flight at once
+DISCOVERY_REQUEST_TIMEOUT = int(os.environ.get('DISCOVERY_REQUEST_TIMEOUT', 30))  # In seconds
+
 # Default check interval (in minutes)
 DEFAULT_CHECK_INTERVAL = 60
 
+# Job priorities (higher runs first)
+PRIORITY_RELEASE = 100
+PRIORITY_RETRY = 50
+PRIORITY_BACKFILL = 10
+
+# Job queue settings
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 2))  # Worker threads per process
+USER_CONCURRENCY_CAP = int(os.environ.get('USER_CONCURRENCY_CAP', 1))  # Jobs a user may run at once (0 = no cap)
+QUEUE_POLL_INTERVAL = int(os.environ.get('QUEUE_POLL_INTERVAL', 30))  # In seconds
+QUEUE_STALE_AFTER = int(os.environ.get('QUEUE_STALE_AFTER', 6 * 60 * 60))  # Seconds before a processing job is presumed dead
+# Sum of the cost model's estimated encode seconds of the jobs running in a process (not a CPU
+# measurement); ENCODE_CPU_BUDGET is the setting's former name
+ENCODE_SECONDS_BUDGET = int(os.environ.get('ENCODE_SECONDS_BUDGET', os.environ.get('ENCODE_CPU_BUDGET', 2 * 60 * 60)))
+
+# Backfill settings
+BACKFILL_PAGE_SIZE = 50  # Spotify's maximum page size for show episodes
+BACKFILL_DAILY_UPLOADS = int(os.environ.get('BACKFILL_DAILY_UPLOADS', 5))  # Per show, leaving quota for new releases
+
 # Create temp directory if it doesn't exist
 if not os.path.exists(TEMP_DIRECTORY):
     os.makedirs(TEMP_DIRECTORY)
@@ -1,23 +1,329 @@
 import os
+import json
+import shutil
 import logging
 import subprocess
 import tempfile
 import requests
+import re
+import time
 import uuid
+import threading
 from datetime import datetime
-from config import FFMPEG_PATH, TEMP_DIRECTORY
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    FFMPEG_PATH,
+    FFPROBE_PATH,
+    TEMP_DIRECTORY,
+    ENCODE_PARALLELISM,
+    ENCODE_SEGMENT_SECONDS,
+    ENCODE_SEGMENT_MIN_SECONDS
+)
+from title_cards import get_title_card_renderer
+from visualizer import encode_visualization
+from audio_processing import audio_filter, get_measurements
+from metrics import DOWNLOAD_BYTES, DOWNLOAD_DURATION, ENCODE_DURATION, ENCODE_SPEED
 
 logger = logging.getLogger(__name__)
 
+# Audio bitrate used for the encoded video, and assumed for the source when estimating duration
+AUDIO_BITRATE = "192k"
+ASSUMED_SOURCE_AUDIO_BPS = 128000
+
+# Reservation increment when the server doesn't send a Content-Length
+DOWNLOAD_RESERVE_STEP = 8 * 1024 * 1024
+
+# Multiplier applied to job size estimates when choosing RAM or disk scratch
+JOB_SIZE_SAFETY_FACTOR = 1.5
+
+# Number of trailing FFmpeg stderr lines kept in logs and error messages
+FFMPEG_STDERR_TAIL_LINES = 20
+
+# Frame rate of segmented encodes; segment boundaries fall on whole frames
+SEGMENT_FRAME_RATE = 25
+
+# Largest difference in seconds allowed between a segmented encode and its source
+SEGMENT_DURATION_TOLERANCE = 0.5
+
+# Extra renditions a show can publish alongside its main video: name -> (width, height)
+RENDITION_PRESETS = {
+    'square': (1080, 1080),
+    'vertical': (1080, 1920)
+}
+
+# Bytes read from FFmpeg's output pipe at a time when streaming an encode
+STREAM_READ_BYTES = 256 * 1024
+
+# Progress timestamps FFmpeg prints to stderr, e.g. "time=00:01:23.45"
+FFMPEG_TIME_PATTERN = re.compile(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+def parse_bitrate(bitrate):
+    """Convert an FFmpeg bitrate string such as '1M' or '500k' to bits per second."""
+    value = str(bitrate).strip()
+    multipliers = {'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+    suffix = value[-1:].lower()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(float(value))
+
+def parse_ffmpeg_media_seconds(stderr):
+    """Return the last progress timestamp FFmpeg reported, in seconds, or None."""
+    matches = FFMPEG_TIME_PATTERN.findall(stderr)
+    if not matches:
+        return None
+    hours, minutes, seconds = matches[-1]
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def stderr_tail(stderr, lines=FFMPEG_STDERR_TAIL_LINES):
+    """Return the last few lines of FFmpeg's stderr, where the actual error is reported."""
+    return '\n'.join(stderr.strip().splitlines()[-lines:])
+
+def estimate_video_bytes(audio_bytes, bitrate="1M"):
+    """Estimate the size of the MP4 produced from an audio file of the given size."""
+    duration = audio_bytes * 8 / ASSUMED_SOURCE_AUDIO_BPS
+    total_bps = parse_bitrate(bitrate) + parse_bitrate(AUDIO_BITRATE)
+    return int(duration * total_bps / 8)
+
+def estimate_workspace_bytes(audio_bytes, bitrate="1M"):
+    """Estimate the temp space a job needs for its audio and encoded video."""
+    video_bytes = estimate_video_bytes(audio_bytes, bitrate)
+    
+    # Leave headroom for the artwork and for estimates that come in low
+    return int((audio_bytes + video_bytes) * JOB_SIZE_SAFETY_FACTOR) + DOWNLOAD_RESERVE_STEP
+
+def probe_duration(path, ffprobe_path=None):
+    """Return the duration of a media file in seconds using ffprobe, or None if it can't be read."""
+    command = [
+        ffprobe_path or FFPROBE_PATH,
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+        if result.returncode != 0:
+            logger.warning("ffprobe failed for %s: %s", path, stderr_tail(result.stderr))
+            return None
+        return float(result.stdout.strip())
+    except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+        logger.warning("Could not probe duration of %s: %s", path, e)
+        return None
+
+def probe_stream_durations(path, ffprobe_path=None):
+    """Return {'video': seconds, 'audio': seconds} for the first stream of each type in a file."""
+    command = [
+        ffprobe_path or FFPROBE_PATH,
+        "-v", "error",
+        "-show_entries", "stream=codec_type,duration",
+        "-of", "json",
+        path
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise Exception(f"ffprobe failed for {path}: {stderr_tail(result.stderr)}")
+    
+    durations = {}
+    for stream in json.loads(result.stdout).get('streams', []):
+        if stream.get('codec_type') in ('video', 'audio') and stream.get('duration'):
+            durations.setdefault(stream['codec_type'], float(stream['duration']))
+    return durations
+
+def rendition_sizes(renditions, exclude=None):
+    """Parse a show's comma-separated rendition names into (name, width, height) tuples.
+    
+    Unknown names are ignored, as is any rendition the same size as exclude
+    (the main video), which would only duplicate it.
+    """
+    sizes = []
+    for name in (renditions or '').split(','):
+        name = name.strip()
+        if name in RENDITION_PRESETS and RENDITION_PRESETS[name] != exclude and \
+                name not in [existing for existing, _, _ in sizes]:
+            sizes.append((name, *RENDITION_PRESETS[name]))
+    return sizes
+
+def segment_boundaries(duration, segment_seconds):
+    """Split a duration into (offset, length) pairs of at most segment_seconds.
+    
+    A short final segment is merged into the one before it so no encode is
+    dominated by FFmpeg start-up cost.
+    """
+    segment_seconds = max(int(segment_seconds), 1)
+    boundaries = []
+    offset = 0
+    while offset < duration:
+        length = min(segment_seconds, duration - offset)
+        boundaries.append((offset, length))
+        offset += segment_seconds
+    
+    if len(boundaries) > 1 and boundaries[-1][1] < segment_seconds / 4:
+        last_offset, last_length = boundaries.pop()
+        offset, length = boundaries.pop()
+        boundaries.append((offset, length + last_length))
+    return boundaries
+
+class StreamingEncode:
+    """An FFmpeg encode whose fragmented MP4 output can be read while it's being written.
+    
+    FFmpeg writes to a pipe, which guarantees it never seeks back to patch
+    bytes already handed out, and a pump thread appends what it writes to
+    output_path. Readers wait for bytes with wait_for() and read(). If
+    FFmpeg exits non-zero, or the finished file fails validation, every
+    waiting and later reader gets the error, so the last bytes of a failed
+    encode are never released. on_success, if given, is called with the
+    encode from the pump thread once the output is complete and valid,
+    while readers may still be uploading it.
+    """
+    
+    def __init__(self, command, output_path, validate=None, on_success=None):
+        self.output_path = output_path
+        self.bytes_written = 0
+        self.done = False
+        self.error = None
+        self.media_seconds = None
+        self.started_at = datetime.utcnow()
+        self.elapsed = None
+        self._start = time.monotonic()
+        self._validate = validate
+        self._on_success = on_success
+        self._condition = threading.Condition()
+        self._stderr = tempfile.TemporaryFile(dir=os.path.dirname(output_path))
+        
+        logger.debug("FFmpeg command: %s", command)
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self._stderr)
+        self._thread = threading.Thread(target=self._pump, name='streaming-encode', daemon=True)
+        self._thread.start()
+    
+    def _pump(self):
+        error = None
+        try:
+            with open(self.output_path, 'wb') as output:
+                for chunk in iter(lambda: self.process.stdout.read(STREAM_READ_BYTES), b''):
+                    output.write(chunk)
+                    output.flush()
+                    with self._condition:
+                        self.bytes_written += len(chunk)
+                        self._condition.notify_all()
+            
+            returncode = self.process.wait()
+            self._stderr.seek(0)
+            stderr = self._stderr.read().decode(errors='replace')
+            if returncode != 0:
+                error_output = stderr_tail(stderr)
+                logger.error("FFmpeg exited with code %s: %s", returncode, error_output)
+                raise Exception(f"FFmpeg conversion failed: {error_output}")
+            
+            self.media_seconds = parse_ffmpeg_media_seconds(stderr)
+            if self._validate:
+                self._validate(self.output_path)
+        except Exception as e:
+            error = e
+        finally:
+            self.process.stdout.close()
+            self._stderr.close()
+            elapsed = time.monotonic() - self._start
+            ENCODE_DURATION.observe(elapsed, status='failed' if error else 'completed')
+            if not error and self.media_seconds and elapsed > 0:
+                ENCODE_SPEED.observe(self.media_seconds / elapsed)
+            with self._condition:
+                self.elapsed = elapsed
+                self.error = error
+                self.done = True
+                self._condition.notify_all()
+        
+        if not error and self._on_success:
+            try:
+                self._on_success(self)
+            except Exception as e:
+                logger.warning("Error after streaming encode of %s finished: %s", self.output_path, e)
+    
+    def wait_for(self, nbytes):
+        """Block until more than nbytes have been written or the encode has finished; raise if it failed."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.done or self.bytes_written > nbytes)
+            if self.error:
+                raise self.error
+    
+    def read(self, begin, length):
+        """Return up to length bytes from offset begin, waiting for them to be written."""
+        self.wait_for(begin + length - 1)
+        with open(self.output_path, 'rb') as f:
+            f.seek(begin)
+            return f.read(max(min(length, self.bytes_written - begin), 0))
+    
+    def wait(self):
+        """Wait for the encode to finish and return the media seconds encoded; raise if it failed."""
+        self._thread.join()
+        if self.error:
+            raise self.error
+        return self.media_seconds
+    
+    def abort(self):
+        """Stop the encode (e.g. after the upload failed) and wait for FFmpeg to exit."""
+        if self.process.poll() is None:
+            self.process.kill()
+        self._thread.join()
+
 class AudioToVideoConverter:
-    def __init__(self, ffmpeg_path=None, temp_dir=None):
+    def __init__(self, ffmpeg_path=None, temp_dir=None, workspace=None):
         self.ffmpeg_path = ffmpeg_path or FFMPEG_PATH
-        self.temp_dir = temp_dir or TEMP_DIRECTORY
+        self.workspace = workspace
+        self.temp_dir = workspace.path if workspace else (temp_dir or TEMP_DIRECTORY)
         
         # Create temp directory if it doesn't exist
         if not os.path.exists(self.temp_dir):
             os.makedirs(self.temp_dir)
     
+    def _reserve(self, nbytes):
+        """Reserve temp space when running inside a job workspace."""
+        if self.workspace:
+            self.workspace.reserve(nbytes)
+    
+    def _download_file(self, url, path, kind):
+        """Download a URL to disk, recording transfer metrics."""
+        with DOWNLOAD_DURATION.time(kind=kind):
+            written = self._stream_to_file(url, path)
+        DOWNLOAD_BYTES.inc(written, kind=kind)
+        return written
+    
+    def _stream_to_file(self, url, path):
+        """Stream a URL to disk, reserving workspace space before writing."""
+        response = requests.get(url, stream=True)
+        response.raise_for_status()
+        
+        content_length = int(response.headers.get('Content-Length') or 0)
+        if content_length:
+            self._reserve(content_length)
+        
+        written = 0
+        reserved = content_length
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                written += len(chunk)
+                if written > reserved:
+                    # Size unknown or larger than advertised, reserve another step
+                    self._reserve(DOWNLOAD_RESERVE_STEP)
+                    reserved += DOWNLOAD_RESERVE_STEP
+                f.write(chunk)
+        
+        return written
+    
+    def estimate_job_bytes(self, audio_url, bitrate="1M"):
+        """Estimate the temp space a job needs from the audio's Content-Length, or None if unknown."""
+        try:
+            response = requests.head(audio_url, allow_redirects=True, timeout=10)
+            response.raise_for_status()
+            audio_bytes = int(response.headers.get('Content-Length') or 0)
+        except Exception as e:
+            logger.warning("Could not determine audio size for %s: %s", audio_url, e)
+            return None
+        
+        if not audio_bytes:
+            return None
+        
+        return estimate_workspace_bytes(audio_bytes, bitrate)
+    
     def download_audio(self, audio_url):
         """Download an audio file from a URL."""
         try:
@@ -26,18 +332,13 @@ class AudioToVideoConverter:
             audio_path = os.path.join(self.temp_dir, audio_filename)
             
             # Download the file
-            logger.info(f"Downloading audio from {audio_url}")
-            response = requests.get(audio_url, stream=True)
-            response.raise_for_status()
+            logger.info("Downloading audio from %s", audio_url)
+            self._download_file(audio_url, audio_path, 'audio')
             
-            with open(audio_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            logger.info(f"Audio downloaded to {audio_path}")
+            logger.info("Audio downloaded to %s", audio_path)
             return audio_path
         except Exception as e:
-            logger.error(f"Error downloading audio: {str(e)}")
+            logger.error("Error downloading audio: %s", e)
             raise
     
     def download_image(self, image_url):
@@ -48,75 +349,415 @@ class AudioToVideoConverter:
             image_path = os.path.join(self.temp_dir, image_filename)
             
             # Download the file
-            logger.info(f"Downloading image from {image_url}")
-            response = requests.get(image_url, stream=True)
-            response.raise_for_status()
+            logger.info("Downloading image from %s", image_url)
+            self._download_file(image_url, image_path, 'image')
             
-            with open(image_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            logger.info(f"Image downloaded to {image_path}")
+            logger.info("Image downloaded to %s", image_path)
             return image_path
         except Exception as e:
-            logger.error(f"Error downloading image: {str(e)}")
+            logger.error("Error downloading image: %s", e)
+            raise
+    
+    def _video_filter(self, width, height):
+        """Build the filter that fits the still image to the frame."""
+        return f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,format=yuv420p"
+    
+    def render_title_card(self, image_path, title, width, height, position='bottom'):
+        """Return a still with the title composed onto the artwork, or the bare artwork if rendering fails."""
+        try:
+            return get_title_card_renderer().render(image_path, title, width, height, position)
+        except Exception as e:
+            logger.warning("Using artwork without a title card: %s", e)
+            return image_path
+    
+    def render_thumbnail(self, image_path, title):
+        """Return a YouTube thumbnail for the episode, or None if it can't be rendered."""
+        try:
+            return get_title_card_renderer().render_thumbnail(image_path, title)
+        except Exception as e:
+            logger.warning("Could not render thumbnail: %s", e)
+            return None
+    
+    def process_audio(self, audio_path, normalize=False, trim=False):
+        """Normalize loudness and/or trim silence, returning the path of the processed audio.
+        
+        The audio is analysed once (measurements are cached per episode, so
+        retries skip it) and then normalized and trimmed in a single pass
+        that also encodes the AAC track, so the video encode copies the audio
+        instead of encoding it again. Returns audio_path unchanged when
+        neither is requested.
+        """
+        if not normalize and not trim:
+            return audio_path
+        
+        try:
+            measurements = get_measurements(audio_path, self.ffmpeg_path)
+            filters = audio_filter(measurements, normalize=normalize, trim=trim)
+            
+            # The processed track is AAC at the output bitrate, so it's no larger than the video's audio
+            duration = measurements['duration'] or 0
+            self._reserve(int(duration * parse_bitrate(AUDIO_BITRATE) / 8))
+            
+            processed_path = os.path.join(self.temp_dir, f"{uuid.uuid4()}.m4a")
+            command = [
+                self.ffmpeg_path,
+                "-hide_banner",
+                "-i", audio_path,
+                "-vn",
+                "-c:a", "aac",
+                "-b:a", AUDIO_BITRATE,
+                "-y",
+                processed_path
+            ]
+            if filters:
+                command[5:5] = ["-af", filters]
+            
+            logger.info("Processing audio (normalize=%s, trim=%s): %s", normalize, trim, processed_path)
+            self._run_ffmpeg(command)
+            return processed_path
+        except Exception as e:
+            logger.error("Error processing audio: %s", e)
             raise
     
-    def convert_audio_to_video(self, audio_path, image_path, output_path=None, width=1280, height=720, bitrate="1M", title=None):
-        """Convert audio file to video using a static image."""
+    def _audio_codec_args(self, copy_audio):
+        """Return the FFmpeg arguments for the video's audio track."""
+        if copy_audio:
+            return ["-c:a", "copy"]
+        return ["-c:a", "aac", "-b:a", AUDIO_BITRATE]
+    
+    def _run_ffmpeg(self, command):
+        """Run an FFmpeg command and return its stderr, raising with the stderr tail on failure."""
+        logger.debug("FFmpeg command: %s", command)
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        stdout, stderr = process.communicate()
+        stderr = stderr.decode(errors='replace')
+        
+        if process.returncode != 0:
+            error_output = stderr_tail(stderr)
+            logger.error("FFmpeg exited with code %s: %s", process.returncode, error_output)
+            raise Exception(f"FFmpeg conversion failed: {error_output}")
+        return stderr
+    
+    def convert_audio_to_video(self, audio_path, image_path, output_path=None, width=1280, height=720, bitrate="1M", title=None, visualization=None, copy_audio=False):
+        """Convert audio file to video using a static image.
+        
+        The title is composed onto the artwork once as a title card, so the
+        encoder only scales a still image. Episodes of at least
+        ENCODE_SEGMENT_MIN_SECONDS are encoded in parallel segments when more
+        than one encoder process is allowed. A visualization ('waveform' or
+        'spectrum') draws animated bars from the audio over the still. Set
+        copy_audio when the audio is already AAC from process_audio().
+        """
         try:
             # Generate output path if not provided
             if not output_path:
                 output_filename = f"{uuid.uuid4()}.mp4"
                 output_path = os.path.join(self.temp_dir, output_filename)
             
-            # Prepare the FFmpeg command
+            # Make sure the encoded video will fit before starting FFmpeg
+            self._reserve(estimate_video_bytes(os.path.getsize(audio_path), bitrate))
+            
+            # Visualization bars fill the bottom of the frame, so the title moves to the top
+            visualized = bool(visualization and visualization != 'none')
+            if title:
+                image_path = self.render_title_card(image_path, title, width, height,
+                                                    position='top' if visualized else 'bottom')
+            
+            duration = probe_duration(audio_path) if ENCODE_PARALLELISM > 1 and not visualized else None
+            segmented = bool(duration and duration >= ENCODE_SEGMENT_MIN_SECONDS)
+            
+            logger.info("Converting audio to video: %s", output_path)
+            start = time.monotonic()
+            try:
+                if visualized:
+                    media_seconds = encode_visualization(
+                        audio_path, image_path, output_path, width, height, bitrate, visualization,
+                        audio_bitrate=None if copy_audio else AUDIO_BITRATE, ffmpeg_path=self.ffmpeg_path)
+                elif segmented:
+                    media_seconds = self._encode_segmented(
+                        audio_path, image_path, output_path, width, height, bitrate, duration, copy_audio)
+                else:
+                    media_seconds = self._encode_single(
+                        audio_path, image_path, output_path, width, height, bitrate, copy_audio)
+            except Exception:
+                ENCODE_DURATION.observe(time.monotonic() - start, status='failed')
+                raise
+            elapsed = time.monotonic() - start
+            
+            ENCODE_DURATION.observe(elapsed, status='completed')
+            if media_seconds and elapsed > 0:
+                ENCODE_SPEED.observe(media_seconds / elapsed)
+            
+            logger.info("Video created at %s", output_path)
+            return output_path
+        except Exception as e:
+            logger.error("Error converting audio to video: %s", e)
+            raise
+    
+    def start_streaming_encode(self, audio_path, image_path, width=1280, height=720, bitrate="1M", title=None,
+                               copy_audio=False, on_success=None):
+        """Start encoding to fragmented MP4 and return a StreamingEncode that can be uploaded as it's written.
+        
+        The still and codecs are those of a single encode. Each fragment is
+        flushed as soon as it's complete, and the finished file is checked
+        against the source duration before it's marked done. on_success is
+        passed to the StreamingEncode.
+        """
+        try:
+            output_path = os.path.join(self.temp_dir, f"{uuid.uuid4()}.mp4")
+            self._reserve(estimate_video_bytes(os.path.getsize(audio_path), bitrate))
+            
+            if title:
+                image_path = self.render_title_card(image_path, title, width, height)
+            
             command = [
                 self.ffmpeg_path,
+                "-hide_banner",
                 "-loop", "1",
                 "-i", image_path,
                 "-i", audio_path,
                 "-c:v", "libx264",
                 "-tune", "stillimage",
-                "-c:a", "aac",
-                "-b:a", "192k",
+                *self._audio_codec_args(copy_audio),
                 "-b:v", bitrate,
-                "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,format=yuv420p"
+                "-vf", self._video_filter(width, height),
+                "-shortest",
+                # Fragments start at keyframes after an empty moov, so nothing written is revisited
+                "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+                "-f", "mp4",
+                "pipe:1"
             ]
             
-            # Add title text if provided
-            if title:
-                # Simple title at the top of the video
-                command.extend([
-                    "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,drawtext=text='{title}':fontsize=32:fontcolor=white:x=(w-text_w)/2:y=h-40,format=yuv420p"
-                ])
+            # -shortest can let the looped still run past the audio; cap the output at the audio's length
+            duration = probe_duration(audio_path)
+            validate = None
+            if duration:
+                command[-5:-5] = ["-t", f"{duration:.3f}"]
+                validate = lambda path: self._validate_output(path, duration)
             
-            # Set the shortest input to determine the output duration
-            command.extend([
-                "-shortest",
-                "-y",  # Overwrite output file if it exists
-                output_path
-            ])
+            logger.info("Streaming encode of audio to video: %s", output_path)
+            return StreamingEncode(command, output_path, validate=validate, on_success=on_success)
+        except Exception as e:
+            logger.error("Error starting streaming encode: %s", e)
+            raise
+    
+    def convert_audio_to_renditions(self, audio_path, image_path, renditions, bitrate="1M", title=None, copy_audio=False):
+        """Encode several frame sizes of the same episode in one FFmpeg process; returns {name: path}.
+        
+        renditions is a list of (name, width, height). The audio is decoded
+        and encoded once and shared by every output through the tee muxer.
+        The still is decoded once and split when the renditions share it;
+        with a title each size gets its own card, since the text is laid out
+        for the frame. Set copy_audio when the audio is already AAC from
+        process_audio().
+        """
+        try:
+            self._reserve(estimate_video_bytes(os.path.getsize(audio_path), bitrate) * len(renditions))
             
-            # Run the FFmpeg command
-            logger.info(f"Converting audio to video: {' '.join(command)}")
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout, stderr = process.communicate()
+            # One still per rendition; the same path when there's no title card
+            stills = [
+                self.render_title_card(image_path, title, width, height) if title else image_path
+                for _, width, height in renditions
+            ]
+            inputs = list(dict.fromkeys(stills))
             
-            if process.returncode != 0:
-                logger.error(f"FFmpeg error: {stderr.decode()}")
-                raise Exception(f"FFmpeg conversion failed: {stderr.decode()}")
+            command = [self.ffmpeg_path, "-hide_banner"]
+            for still in inputs:
+                command += ["-loop", "1", "-i", still]
+            command += ["-i", audio_path]
+            audio_input = len(inputs)
             
-            logger.info(f"Video created at {output_path}")
-            return output_path
+            # Split each distinct still once, then fit each copy to its rendition's frame
+            uses = {still: [index for index, used in enumerate(stills) if used == still] for still in inputs}
+            filters = []
+            sources = {}
+            for input_index, still in enumerate(inputs):
+                labels = [f"s{index}" for index in uses[still]]
+                if len(labels) > 1:
+                    filters.append(f"[{input_index}:v]split={len(labels)}" + ''.join(f"[{label}]" for label in labels))
+                    sources.update({index: f"[s{index}]" for index in uses[still]})
+                else:
+                    sources[uses[still][0]] = f"[{input_index}:v]"
+            for index, (_, width, height) in enumerate(renditions):
+                filters.append(f"{sources[index]}{self._video_filter(width, height)}[v{index}]")
+            
+            command += ["-filter_complex", ';'.join(filters)]
+            for index in range(len(renditions)):
+                command += ["-map", f"[v{index}]"]
+            command += [
+                "-map", f"{audio_input}:a",
+                "-c:v", "libx264",
+                "-tune", "stillimage",
+                "-b:v", bitrate,
+                *self._audio_codec_args(copy_audio),
+                "-shortest"
+            ]
+            
+            # -shortest can let the looped still run past the audio; cap the output at the audio's length
+            duration = probe_duration(audio_path)
+            if duration:
+                command += ["-t", f"{duration:.3f}"]
+            
+            paths = {}
+            outputs = []
+            for index, (name, width, height) in enumerate(renditions):
+                paths[name] = os.path.join(self.temp_dir, f"{uuid.uuid4()}-{name}.mp4")
+                outputs.append(f"[f=mp4:movflags=+faststart:select=\\'v:{index},a\\']{paths[name]}")
+            command += ["-f", "tee", '|'.join(outputs)]
+            
+            logger.info("Converting audio to %s renditions: %s", len(renditions),
+                        ', '.join(f"{name} {width}x{height}" for name, width, height in renditions))
+            start = time.monotonic()
+            try:
+                stderr = self._run_ffmpeg(command)
+            except Exception:
+                ENCODE_DURATION.observe(time.monotonic() - start, status='failed')
+                raise
+            elapsed = time.monotonic() - start
+            
+            ENCODE_DURATION.observe(elapsed, status='completed')
+            media_seconds = parse_ffmpeg_media_seconds(stderr)
+            if media_seconds and elapsed > 0:
+                ENCODE_SPEED.observe(media_seconds / elapsed)
+            return paths
         except Exception as e:
-            logger.error(f"Error converting audio to video: {str(e)}")
+            logger.error("Error converting audio to renditions: %s", e)
             raise
     
+    def _encode_single(self, audio_path, image_path, output_path, width, height, bitrate, copy_audio=False):
+        """Encode the whole episode in one FFmpeg process; returns the media seconds encoded."""
+        command = [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-loop", "1",
+            "-i", image_path,
+            "-i", audio_path,
+            "-c:v", "libx264",
+            "-tune", "stillimage",
+            *self._audio_codec_args(copy_audio),
+            "-b:v", bitrate,
+            "-vf", self._video_filter(width, height),
+            # Set the shortest input to determine the output duration
+            "-shortest",
+            "-y",  # Overwrite output file if it exists
+            output_path
+        ]
+        
+        stderr = self._run_ffmpeg(command)
+        return parse_ffmpeg_media_seconds(stderr)
+    
+    def _encode_segmented(self, audio_path, image_path, output_path, width, height, bitrate, duration, copy_audio=False):
+        """Encode the video in time segments concurrently and join them without re-encoding.
+        
+        Audio is encoded once for the whole episode while the video segments
+        are encoded, so there are no AAC priming gaps at segment boundaries.
+        The video segments are joined with the concat demuxer and muxed with
+        the audio, then the result is checked against the source duration.
+        Already-encoded audio (copy_audio) is muxed as is. Returns the media
+        seconds encoded.
+        """
+        segment_dir = os.path.join(self.temp_dir, f"segments-{uuid.uuid4().hex[:8]}")
+        os.makedirs(segment_dir)
+        
+        try:
+            # The segments take about as much space again as the finished video
+            self._reserve(estimate_video_bytes(os.path.getsize(audio_path), bitrate))
+            
+            boundaries = segment_boundaries(duration, ENCODE_SEGMENT_SECONDS)
+            threads_per_encode = max((os.cpu_count() or 1) // ENCODE_PARALLELISM, 1)
+            video_filter = self._video_filter(width, height)
+            
+            segment_paths = []
+            commands = []
+            for index, (offset, length) in enumerate(boundaries):
+                segment_path = os.path.join(segment_dir, f"segment-{index:04d}.mp4")
+                segment_paths.append(segment_path)
+                commands.append([
+                    self.ffmpeg_path,
+                    "-hide_banner",
+                    "-loop", "1",
+                    "-framerate", str(SEGMENT_FRAME_RATE),
+                    "-t", f"{length:.3f}",
+                    "-i", image_path,
+                    "-c:v", "libx264",
+                    "-tune", "stillimage",
+                    "-b:v", bitrate,
+                    "-vf", video_filter,
+                    "-threads", str(threads_per_encode),
+                    "-an",
+                    "-y",
+                    segment_path
+                ])
+            
+            if copy_audio:
+                audio_track = audio_path
+            else:
+                audio_track = os.path.join(segment_dir, "audio.m4a")
+                commands.append([
+                    self.ffmpeg_path,
+                    "-hide_banner",
+                    "-i", audio_path,
+                    "-vn",
+                    "-c:a", "aac",
+                    "-b:a", AUDIO_BITRATE,
+                    "-y",
+                    audio_track
+                ])
+            
+            logger.info("Encoding %s segments of up to %ss with %s parallel encoders",
+                        len(boundaries), ENCODE_SEGMENT_SECONDS, ENCODE_PARALLELISM)
+            with ThreadPoolExecutor(max_workers=ENCODE_PARALLELISM) as pool:
+                # Wait for every encode so no FFmpeg process outlives the workspace
+                futures = [pool.submit(self._run_ffmpeg, command) for command in commands]
+                errors = [future.exception() for future in futures if future.exception()]
+            if errors:
+                raise errors[0]
+            
+            # Join the segments losslessly and add the audio track
+            concat_list = os.path.join(segment_dir, "segments.txt")
+            with open(concat_list, 'w') as f:
+                for segment_path in segment_paths:
+                    f.write(f"file '{segment_path}'\n")
+            
+            self._run_ffmpeg([
+                self.ffmpeg_path,
+                "-hide_banner",
+                "-f", "concat",
+                "-safe", "0",
+                "-i", concat_list,
+                "-i", audio_track,
+                "-map", "0:v",
+                "-map", "1:a",
+                "-c", "copy",
+                "-movflags", "+faststart",
+                "-y",
+                output_path
+            ])
+            
+            self._validate_output(output_path, duration)
+            return duration
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+    
+    def _validate_output(self, output_path, source_duration):
+        """Check that a joined or streamed video is as long as its source and its audio and video line up."""
+        durations = probe_stream_durations(output_path)
+        video = durations.get('video')
+        audio = durations.get('audio')
+        
+        if video is None or audio is None:
+            raise Exception(f"Encoded video is missing a stream: {durations}")
+        
+        for name, value in (('video', video), ('audio', audio)):
+            if abs(value - source_duration) > SEGMENT_DURATION_TOLERANCE:
+                raise Exception(f"Encoded {name} is {value:.2f}s long but the source is {source_duration:.2f}s")
+        if abs(video - audio) > SEGMENT_DURATION_TOLERANCE:
+            raise Exception(f"Encoded audio and video are out of sync: {audio:.2f}s vs {video:.2f}s")
+    
     def process_podcast_episode(self, audio_url, image_url, title=None, width=1280, height=720, bitrate="1M"):
         """Process a podcast episode: download audio, download image, convert to video."""
         try:
@@ -143,7 +784,7 @@ class AudioToVideoConverter:
                 'video_path': video_path
             }
         except Exception as e:
-            logger.error(f"Error processing podcast episode: {str(e)}")
+            logger.error("Error processing podcast episode: %s", e)
             raise
         
     def cleanup_files(self, *file_paths):
@@ -152,6 +793,6 @@ class AudioToVideoConverter:
             if path and os.path.exists(path):
                 try:
                     os.remove(path)
-                    logger.info(f"Removed temporary file: {path}")
+                    logger.info("Removed temporary file: %s", path)
                 except Exception as e:
-                    logger.warning(f"Failed to remove temporary file {path}: {str(e)}")
+                    logger.warning("Failed to remove temporary file %s: %s", path, e)
@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+from converter import ASSUMED_SOURCE_AUDIO_BPS, estimate_video_bytes, estimate_workspace_bytes
+
+logger = logging.getLogger(__name__)
+
+# Throughput assumed until enough jobs have run to measure it
+DEFAULT_ENCODE_SPEED = 20.0  # Media seconds encoded per wall-clock second
+DEFAULT_TRANSFER_BPS = 2 * 1024 ** 2  # Bytes per second for downloads and uploads
+
+# Length assumed for episodes whose duration isn't known yet
+DEFAULT_EPISODE_SECONDS = 60 * 60
+
+# Number of recent stages averaged for each throughput, and how long the averages are reused
+HISTORY_STAGES = 50
+REFRESH_INTERVAL = 5 * 60
+
+class JobCost:
+    """Estimated resources and run time of one job."""
+
+    def __init__(self, duration_seconds, audio_bytes, video_bytes, workspace_bytes,
+                 download_seconds, encode_seconds, upload_seconds):
+        self.duration_seconds = duration_seconds
+        self.audio_bytes = audio_bytes
+        self.video_bytes = video_bytes
+        self.workspace_bytes = workspace_bytes
+        self.download_seconds = download_seconds
+        self.encode_seconds = encode_seconds
+        self.upload_seconds = upload_seconds
+
+    @property
+    def total_seconds(self):
+        return self.download_seconds + self.encode_seconds + self.upload_seconds
+
+class CostModel:
+    """Estimates how long a job will take from its episode length and recent throughput.
+
+    Encode speed is media seconds per second of encode stage, and transfer
+    rates are bytes per second of download and upload stage, each averaged
+    over the last HISTORY_STAGES successful stages.
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._throughput = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def throughput(self):
+        """Return measured (or default) encode speed and transfer rates."""
+        with self._lock:
+            if self._throughput is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+                try:
+                    self._throughput = self._load()
+                except Exception as e:
+                    logger.warning("Could not load job throughput history: %s", e)
+                    self._throughput = self._throughput or self._defaults()
+                self._loaded_at = time.monotonic()
+            return dict(self._throughput)
+
+    def _defaults(self):
+        return {
+            'encode_speed': DEFAULT_ENCODE_SPEED,
+            'download_bps': DEFAULT_TRANSFER_BPS,
+            'upload_bps': DEFAULT_TRANSFER_BPS
+        }
+
+    def _load(self):
+        from app import db
+        from models import ConversionJob, JobStage
+
+        throughput = self._defaults()
+
+        encodes = (
+            db.session.query(ConversionJob.duration_seconds, JobStage.duration_seconds)
+            .join(JobStage, JobStage.job_id == ConversionJob.id)
+            .filter(
+                JobStage.stage == 'encode',
+                JobStage.succeeded.is_(True),
+                JobStage.duration_seconds > 0,
+                ConversionJob.duration_seconds > 0
+            )
+            .order_by(JobStage.started_at.desc())
+            .limit(HISTORY_STAGES)
+            .all()
+        )
+        if encodes:
+            throughput['encode_speed'] = sum(media for media, _ in encodes) / sum(wall for _, wall in encodes)
+
+        for stage in ('download', 'upload'):
+            transfers = (
+                db.session.query(JobStage.bytes, JobStage.duration_seconds)
+                .filter(
+                    JobStage.stage == stage,
+                    JobStage.succeeded.is_(True),
+                    JobStage.duration_seconds > 0,
+                    JobStage.bytes > 0
+                )
+                .order_by(JobStage.started_at.desc())
+                .limit(HISTORY_STAGES)
+                .all()
+            )
+            if transfers:
+                throughput[f'{stage}_bps'] = sum(nbytes for nbytes, _ in transfers) / sum(wall for _, wall in transfers)
+
+        return throughput
+
+    def estimate(self, duration_seconds, bitrate="1M"):
+        """Return the JobCost of converting an episode of the given length."""
+        throughput = self.throughput()
+        duration = duration_seconds or DEFAULT_EPISODE_SECONDS
+
+        audio_bytes = int(duration * ASSUMED_SOURCE_AUDIO_BPS / 8)
+        video_bytes = estimate_video_bytes(audio_bytes, bitrate or "1M")
+
+        return JobCost(
+            duration_seconds=duration,
+            audio_bytes=audio_bytes,
+            video_bytes=video_bytes,
+            workspace_bytes=estimate_workspace_bytes(audio_bytes, bitrate or "1M"),
+            download_seconds=audio_bytes / throughput['download_bps'],
+            encode_seconds=duration / throughput['encode_speed'],
+            upload_seconds=video_bytes / throughput['upload_bps']
+        )
+
+_cost_model = None
+
+def get_cost_model():
+    """Return the process-wide cost model."""
+    global _cost_model
+
+    if _cost_model is None:
+        _cost_model = CostModel()
+    return _cost_model
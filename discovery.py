@@ -0,0 +1,401 @@
+import json
+import time
+import base64
+import asyncio
+import logging
+import threading
+import functools
+import contextlib
+import contextvars
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    SPOTIFY_API_URL,
+    SPOTIFY_TOKEN_URL,
+    DISCOVERY_MAX_CONNECTIONS,
+    DISCOVERY_PER_HOST_LIMIT,
+    DISCOVERY_CONCURRENCY,
+    DISCOVERY_REQUEST_TIMEOUT
+)
+from logging_config import correlation_context
+from feed_client import load_feed_index_async
+from resilience import get_breaker, call_with_retries_async, parse_retry_after, CircuitOpenError, TRANSIENT_STATUSES
+from metrics import (
+    SPOTIFY_REQUEST_DURATION,
+    SPOTIFY_REQUEST_ERRORS,
+    SCHEDULER_TICK_DURATION,
+    DISCOVERY_CHECKS_IN_FLIGHT
+)
+
+try:
+    import aiohttp
+except ImportError:  # A dependency, but without it requests still runs on a bounded thread pool
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# Threads for database work, kept off the event loop
+DISCOVERY_DB_WORKERS = 4
+
+def _endpoint_label(endpoint):
+    """Strip IDs from an API path, e.g. 'shows/abc/episodes' becomes 'shows/episodes'."""
+    return '/'.join(endpoint.split('/')[0::2])
+
+class DiscoveryHTTPError(Exception):
+    """Raised for a failed request; status is None when no response was received."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def transient(self):
+        return self.status is None or self.status in TRANSIENT_STATUSES
+
+class AiohttpTransport:
+    """HTTP over one aiohttp session with a bounded connection pool."""
+
+    def __init__(self, max_connections, timeout):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections),
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        )
+
+    async def request(self, method, url, headers=None, params=None, data=None):
+        try:
+            async with self.session.request(method, url, headers=headers, params=params, data=data) as response:
+                return response.status, response.headers, await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DiscoveryHTTPError(f"{method} {url} failed: {e}") from e
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, headers=None, chunk_size=65536):
+        """Yield (status, headers, chunks), where chunks asynchronously iterates over the body."""
+        try:
+            async with self.session.request(method, url, headers=headers) as response:
+                yield response.status, response.headers, response.content.iter_chunked(chunk_size)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DiscoveryHTTPError(f"{method} {url} failed: {e}") from e
+
+    async def close(self):
+        await self.session.close()
+
+class ThreadedTransport:
+    """HTTP with requests on a thread pool the size of the connection pool, for when aiohttp isn't installed."""
+
+    def __init__(self, max_connections, timeout):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='discovery-http')
+
+    async def request(self, method, url, headers=None, params=None, data=None):
+        call = functools.partial(self.session.request, method, url, headers=headers, params=params,
+                                 data=data, timeout=self.timeout)
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(self.executor, call)
+        except requests.exceptions.RequestException as e:
+            raise DiscoveryHTTPError(f"{method} {url} failed: {e}") from e
+        return response.status_code, response.headers, response.content
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, headers=None, chunk_size=65536):
+        """Yield (status, headers, chunks), where chunks asynchronously iterates over the body."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self.session.request, method, url, headers=headers, stream=True, timeout=self.timeout)
+        try:
+            response = await loop.run_in_executor(self.executor, call)
+        except requests.exceptions.RequestException as e:
+            raise DiscoveryHTTPError(f"{method} {url} failed: {e}") from e
+
+        body = response.iter_content(chunk_size)
+
+        async def chunks():
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, body, None)
+                if chunk is None:
+                    return
+                yield chunk
+
+        try:
+            yield response.status_code, response.headers, chunks()
+        except requests.exceptions.RequestException as e:
+            raise DiscoveryHTTPError(f"{method} {url} failed: {e}") from e
+        finally:
+            response.close()
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+class HostLimiter:
+    """Caps concurrent requests to each host."""
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._semaphores = {}
+
+    def limit(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._semaphores[host]
+
+class AsyncSpotifyClient:
+    """Spotify Web API client, run on the discovery engine's loop.
+
+    One client exists per set of app credentials, so shows that share
+    credentials also share an access token and a circuit breaker. The sync
+    SpotifyClient calls into the same clients through the engine.
+    """
+
+    def __init__(self, transport, limiter, client_id, client_secret):
+        self.transport = transport
+        self.limiter = limiter
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.access_token = None
+        self.token_expiry = 0
+        self._token_lock = asyncio.Lock()
+        self._breaker = get_breaker('spotify', client_id)
+
+    async def _request(self, method, url, endpoint_label, **kwargs):
+        """Send a request through the Spotify circuit breaker, retrying transient failures."""
+        async def attempt():
+            async with self.limiter.limit(url):
+                start = time.monotonic()
+                try:
+                    status, headers, body = await self.transport.request(method, url, **kwargs)
+                except DiscoveryHTTPError:
+                    SPOTIFY_REQUEST_ERRORS.inc(endpoint=endpoint_label, status='network')
+                    raise
+                finally:
+                    SPOTIFY_REQUEST_DURATION.observe(time.monotonic() - start, endpoint=endpoint_label)
+
+            if status >= 400:
+                SPOTIFY_REQUEST_ERRORS.inc(endpoint=endpoint_label, status=str(status))
+                raise DiscoveryHTTPError(f"{status} error from Spotify for {url}", status,
+                                         parse_retry_after(headers.get('Retry-After')))
+            return json.loads(body)
+
+        return await call_with_retries_async(self._breaker, attempt)
+
+    async def _get_access_token(self):
+        """Return a valid access token, fetching one if needed (once, however many shows ask)."""
+        async with self._token_lock:
+            if self.access_token and time.time() < self.token_expiry:
+                return self.access_token
+
+            b64_auth = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+            token_data = await self._request(
+                'POST', SPOTIFY_TOKEN_URL, 'token',
+                headers={
+                    "Authorization": f"Basic {b64_auth}",
+                    "Content-Type": "application/x-www-form-urlencoded"
+                },
+                data={"grant_type": "client_credentials"}
+            )
+            self.access_token = token_data["access_token"]
+            self.token_expiry = time.time() + token_data["expires_in"] - 60  # Expire 1 minute early to be safe
+            return self.access_token
+
+    async def _make_api_request(self, endpoint, params=None):
+        url = f"{SPOTIFY_API_URL}/{endpoint}"
+        endpoint_label = _endpoint_label(endpoint)
+
+        token = await self._get_access_token()
+        try:
+            return await self._request('GET', url, endpoint_label,
+                                       headers={"Authorization": f"Bearer {token}"}, params=params)
+        except DiscoveryHTTPError as e:
+            if e.status != 401:
+                raise
+
+        # Token revoked or expired early; get a new one and retry once
+        if self.access_token == token:
+            self.access_token = None
+        token = await self._get_access_token()
+        return await self._request('GET', url, endpoint_label,
+                                   headers={"Authorization": f"Bearer {token}"}, params=params)
+
+    async def get_podcast_info(self, podcast_id):
+        """Get information about a podcast."""
+        return await self._make_api_request(f"shows/{podcast_id}")
+
+    async def get_podcast_episodes(self, podcast_id, limit=10, offset=0):
+        """Get a page of a podcast's episodes, newest first."""
+        return await self._make_api_request(f"shows/{podcast_id}/episodes",
+                                            {"limit": limit, "offset": offset, "market": "US"})
+
+    async def get_episode_info(self, episode_id):
+        """Get detailed information about an episode."""
+        return await self._make_api_request(f"episodes/{episode_id}")
+
+class DiscoveryEngine:
+    """Checks shows for new episodes concurrently on one asyncio event loop.
+
+    Checks are submitted from any thread and run on the engine's loop
+    thread. There, Spotify and feed requests share a bounded connection pool
+    (DISCOVERY_MAX_CONNECTIONS) and at most DISCOVERY_PER_HOST_LIMIT
+    requests go to any one host at a time. At most DISCOVERY_CONCURRENCY
+    checks are in flight; the rest wait their turn. Database reads and
+    writes run on a few worker threads, so the loop never blocks on them.
+    A show already being checked isn't checked twice at once. New episodes
+    are recorded as jobs and handed to the job queue.
+    """
+
+    def __init__(self, app, max_connections=None, per_host=None, concurrency=None, timeout=None):
+        self.app = app
+        self.max_connections = max_connections or DISCOVERY_MAX_CONNECTIONS
+        self.per_host = per_host or DISCOVERY_PER_HOST_LIMIT
+        self.concurrency = concurrency or DISCOVERY_CONCURRENCY
+        self.timeout = timeout or DISCOVERY_REQUEST_TIMEOUT
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._clients = {}
+        self._db_executor = ThreadPoolExecutor(max_workers=DISCOVERY_DB_WORKERS, thread_name_prefix='discovery-db')
+
+    def start(self):
+        """Start the event loop thread."""
+        self._thread = threading.Thread(target=self._run, name='discovery-engine', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logger.info("Discovery engine started (%s transport, %s connections, %s per host)",
+                    'aiohttp' if aiohttp is not None else 'threaded', self.max_connections, self.per_host)
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        transport_class = AiohttpTransport if aiohttp is not None else ThreadedTransport
+
+        async def setup():
+            self._transport = transport_class(self.max_connections, self.timeout)
+            self._limiter = HostLimiter(self.per_host)
+            self._checks = asyncio.Semaphore(self.concurrency)
+
+        self._loop.run_until_complete(setup())
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.run_until_complete(self._transport.close())
+            self._loop.close()
+
+    def stop(self):
+        """Stop the event loop; checks still running are abandoned."""
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._db_executor.shutdown(wait=False)
+
+    def submit(self, config_id):
+        """Queue a check of one show and return a concurrent.futures.Future of its new episode count."""
+        with self._lock:
+            future = self._pending.get(config_id)
+            if future is not None:
+                return future
+            future = asyncio.run_coroutine_threadsafe(self._check(config_id), self._loop)
+            self._pending[config_id] = future
+        future.add_done_callback(lambda _: self._finished(config_id, future))
+        return future
+
+    def _finished(self, config_id, future):
+        with self._lock:
+            if self._pending.get(config_id) is future:
+                del self._pending[config_id]
+
+    def check(self, config_id, timeout=None):
+        """Check one show and wait for the number of new episodes found."""
+        return self.submit(config_id).result(timeout)
+
+    def _spotify_client(self, client_id, client_secret):
+        # Only called on the loop thread
+        key = (client_id, client_secret)
+        if key not in self._clients:
+            self._clients[key] = AsyncSpotifyClient(self._transport, self._limiter, client_id, client_secret)
+        return self._clients[key]
+
+    def call_spotify(self, client_id, client_secret, request):
+        """Run request(client) on the loop with the credentials' AsyncSpotifyClient and wait for its result.
+
+        For callers on other threads; calling it from the loop itself would deadlock.
+        """
+        async def call():
+            return await request(self._spotify_client(client_id, client_secret))
+
+        return asyncio.run_coroutine_threadsafe(call(), self._loop).result()
+
+    async def _in_db(self, func, *args):
+        """Run a database function on a worker thread inside an app context."""
+        def call():
+            with self.app.app_context():
+                return func(*args)
+
+        context = contextvars.copy_context()
+        return await self._loop.run_in_executor(self._db_executor, context.run, call)
+
+    async def _check(self, config_id):
+        from scheduler import begin_discovery, has_new_episodes, record_new_episodes
+
+        start = time.monotonic()
+        status = 'completed'
+        with correlation_context(config_id=config_id):
+            try:
+                async with self._checks:
+                    DISCOVERY_CHECKS_IN_FLIGHT.inc()
+                    try:
+                        target = await self._in_db(begin_discovery, config_id)
+                        if not target:
+                            return 0
+
+                        client = self._spotify_client(target['spotify_client_id'], target['spotify_client_secret'])
+                        episodes_data = await client.get_podcast_episodes(target['spotify_podcast_id'])
+
+                        # The feed holds the full-length audio; it's only polled when there is a new episode to look up
+                        feed_index = None
+                        feed_url = target['rss_feed_url']
+                        if feed_url and await self._in_db(has_new_episodes, config_id, episodes_data):
+                            async with self._limiter.limit(feed_url):
+                                feed_index = await load_feed_index_async(config_id, feed_url, self._transport)
+                    finally:
+                        DISCOVERY_CHECKS_IN_FLIGHT.dec()
+
+                return await self._in_db(record_new_episodes, config_id, episodes_data, feed_index)
+            except CircuitOpenError as e:
+                # The show is checked again at its next interval
+                status = 'skipped'
+                logger.warning("Skipped checking for new episodes: %s", e)
+                return 0
+            except Exception as e:
+                status = 'failed'
+                logger.error("Error checking for new episodes: %s", e)
+                raise
+            finally:
+                SCHEDULER_TICK_DURATION.observe(time.monotonic() - start, status=status)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def init_discovery_engine(app):
+    """Create and start the process-wide discovery engine."""
+    global _engine
+
+    with _engine_lock:
+        if _engine is None:
+            _engine = DiscoveryEngine(app).start()
+        return _engine
+
+def get_discovery_engine():
+    """Return the process-wide discovery engine, starting it on first use."""
+    if _engine is None:
+        from app import app
+        return init_discovery_engine(app)
+    return _engine
@@ -0,0 +1,423 @@
+import os
+import re
+import json
+import time
+import uuid
+import random
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Paths served by the stand-ins; point the clients at them with these settings:
+#   SPOTIFY_API_URL        {base}/spotify/v1
+#   SPOTIFY_TOKEN_URL      {base}/spotify/token
+#   YOUTUBE_TOKEN_URI      {base}/oauth2/token
+#   YOUTUBE_DISCOVERY_URL  {base}/youtube/discovery
+#   rss_feed_url           {base}/feeds/<show id>.xml
+EPISODE_AUDIO_PATH = '/media/episode.mp3'
+ARTWORK_PATH = '/media/artwork.jpg'
+
+# Requests that are never slowed down or failed, so clients can always start up
+UNFAULTED_PATHS = ('/youtube/discovery', '/spotify/token', '/oauth2/token')
+
+class FakeCatalog:
+    """Shows and their episodes, released at a steady rate from the moment the catalog is created.
+
+    Releases are spread round-robin across shows so the whole catalog
+    publishes `releases_per_hour` episodes an hour. Each show also starts with
+    `backlog` episodes already released.
+    """
+
+    def __init__(self, shows, releases_per_hour, backlog=1, episode_seconds=30):
+        self.show_ids = [f"loadtestshow{index:04d}" for index in range(shows)]
+        self.releases_per_hour = releases_per_hour
+        self.backlog = backlog
+        self.episode_seconds = episode_seconds
+        self.started_at = time.time()
+
+    def _interval(self):
+        return 3600.0 / self.releases_per_hour if self.releases_per_hour else None
+
+    def release_time(self, episode_id):
+        """Return the wall-clock time an episode was (or will be) released."""
+        match = re.match(r'(loadtestshow\d{4})ep(\d+)$', episode_id)
+        if not match or match.group(1) not in self.show_ids:
+            return None
+        number = int(match.group(2))
+        if number < self.backlog:
+            return self.started_at
+        interval = self._interval()
+        if interval is None:
+            return None
+        show_index = self.show_ids.index(match.group(1))
+        slot = (number - self.backlog) * len(self.show_ids) + show_index
+        return self.started_at + (slot + 1) * interval
+
+    def released_count(self, show_id, now=None):
+        """Return how many of a show's episodes have been released by `now`."""
+        elapsed = (now or time.time()) - self.started_at
+        interval = self._interval()
+        if interval is None or elapsed <= 0:
+            return self.backlog
+        show_index = self.show_ids.index(show_id)
+        slots = int(elapsed / interval)
+        released = (slots - show_index + len(self.show_ids) - 1) // len(self.show_ids)
+        return self.backlog + max(released, 0)
+
+    def total_released(self, now=None):
+        return sum(self.released_count(show_id, now) for show_id in self.show_ids)
+
+    def feed(self, show_id, base_url):
+        """Return a show's RSS feed, newest item first, and an ETag that changes with each release."""
+        released = self.released_count(show_id)
+        items = []
+        for number in range(released - 1, -1, -1):
+            episode = self.episode(show_id, number, base_url)
+            published = time.strftime('%a, %d %b %Y %H:%M:%S +0000',
+                                      time.gmtime(self.release_time(episode['id']) or self.started_at))
+            items.append(
+                f"<item><title>{episode['name']}</title><guid>{episode['id']}</guid>"
+                f"<pubDate>{published}</pubDate><itunes:duration>{int(self.episode_seconds)}</itunes:duration>"
+                f"<enclosure url=\"{base_url}{EPISODE_AUDIO_PATH}?episode={episode['id']}&amp;full=1\" "
+                f"type=\"audio/mpeg\"/></item>"
+            )
+        document = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd"><channel>'
+            f"<title>Load test {show_id}</title>{''.join(items)}</channel></rss>"
+        )
+        return document.encode(), f'"{show_id}-{released}"'
+
+    def episode(self, show_id, number, base_url):
+        episode_id = f"{show_id}ep{number:05d}"
+        released = datetime_string(self.release_time(episode_id) or self.started_at)
+        return {
+            'id': episode_id,
+            'name': f"Episode {number} of {show_id}",
+            'description': "Generated for load testing.",
+            'duration_ms': int(self.episode_seconds * 1000),
+            'release_date': released[:10],
+            'audio_preview_url': f"{base_url}{EPISODE_AUDIO_PATH}?episode={episode_id}",
+            'external_urls': {'spotify': f"{base_url}/episode/{episode_id}"}
+        }
+
+def datetime_string(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+class FakeServices:
+    """Local HTTP stand-ins for the Spotify Web API, the YouTube Data API and the audio host.
+
+    Every request can be delayed by `latency` seconds and failed with a 503
+    (with a one-second Retry-After) at `failure_rate`, except for discovery
+    and token requests. Uploads use
+    the same resumable protocol as YouTube, in as many chunks as the client
+    sends. Counts of requests, injected failures and completed uploads are
+    kept in `stats`.
+    """
+
+    def __init__(self, catalog, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, seed=None):
+        self.catalog = catalog
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'injected_failures': 0, 'uploads': 0, 'upload_bytes': 0, 'thumbnails': 0,
+                      'feeds_served': 0, 'feeds_not_modified': 0}
+        self.uploads = {}
+        self._lock = threading.Lock()
+        self._media_dir = None
+        self._thread = None
+
+        services = self
+
+        class Handler(FakeServiceHandler):
+            pass
+
+        Handler.services = services
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """Return the settings that point the app's clients at these stand-ins."""
+        return {
+            'SPOTIFY_API_URL': f"{self.base_url}/spotify/v1",
+            'SPOTIFY_TOKEN_URL': f"{self.base_url}/spotify/token",
+            'YOUTUBE_TOKEN_URI': f"{self.base_url}/oauth2/token",
+            'YOUTUBE_DISCOVERY_URL': f"{self.base_url}/youtube/discovery"
+        }
+
+    def start(self):
+        """Generate the episode audio and artwork, then serve in a background thread."""
+        self._media_dir = tempfile.mkdtemp(prefix='fake-services-')
+        self._generate_media()
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-services', daemon=True)
+        self._thread.start()
+        logger.info("Fake Spotify/YouTube services listening on %s", self.base_url)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._media_dir:
+            shutil.rmtree(self._media_dir, ignore_errors=True)
+
+    def media_path(self, name):
+        return os.path.join(self._media_dir, name)
+
+    def _generate_media(self):
+        # Imported here so a caller can bind the server and export environment() before config loads
+        from config import FFMPEG_PATH
+
+        commands = [
+            [FFMPEG_PATH, "-hide_banner", "-v", "error", "-f", "lavfi",
+             "-i", f"sine=frequency=440:duration={self.catalog.episode_seconds}",
+             "-b:a", "128k", "-y", self.media_path('episode.mp3')],
+            [FFMPEG_PATH, "-hide_banner", "-v", "error", "-f", "lavfi",
+             "-i", "color=c=navy:s=640x640", "-frames:v", "1", "-y", self.media_path('artwork.jpg')]
+        ]
+        for command in commands:
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise Exception(f"Could not generate test media: {result.stderr.strip()}")
+
+    def discovery_document(self):
+        """Return YouTube's bundled discovery document, rewritten to point at this server."""
+        from googleapiclient.discovery_cache import get_static_doc
+
+        document = json.loads(get_static_doc('youtube', 'v3'))
+        document['rootUrl'] = f"{self.base_url}/"
+        document['mtlsRootUrl'] = f"{self.base_url}/"
+        document['baseUrl'] = f"{self.base_url}/"
+        return document
+
+    def should_fail(self, path):
+        """Count a request, apply the configured latency and decide whether to fail it."""
+        with self._lock:
+            self.stats['requests'] += 1
+            if path.startswith(UNFAULTED_PATHS):
+                return False
+            fail = self.failure_rate > 0 and self.random.random() < self.failure_rate
+            if fail:
+                self.stats['injected_failures'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return fail
+
+    def start_upload(self, kind, metadata):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {'kind': kind, 'metadata': metadata, 'received': 0}
+        return upload_id
+
+    def receive_chunk(self, upload_id, start, end, total, length):
+        """Record a chunk; return (received, complete) or None for an unknown upload."""
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return None
+            if start == upload['received'] and length:
+                upload['received'] = end + 1
+            complete = total is not None and upload['received'] >= total
+            if complete:
+                del self.uploads[upload_id]
+                if upload['kind'] == 'video':
+                    self.stats['uploads'] += 1
+                    self.stats['upload_bytes'] += upload['received']
+                else:
+                    self.stats['thumbnails'] += 1
+            return upload, complete
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """Routes requests to the Spotify, YouTube and media stand-ins."""
+
+    services = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug("fake service: " + format, *args)
+
+    # Responses
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {'error': {'code': status, 'message': message}})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _authorized(self):
+        return self.headers.get('Authorization', '').startswith('Bearer ')
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        body = self._read_body() if self.command in ('POST', 'PUT') else b''
+
+        if self.services.should_fail(url.path):
+            self._send(503, {'error': {'code': 503, 'message': 'Injected failure'}}, headers={'Retry-After': '1'})
+            return
+
+        if url.path.startswith('/spotify/'):
+            self._spotify(url.path[len('/spotify'):], query)
+        elif url.path == '/oauth2/token':
+            self._send(200, {'access_token': uuid.uuid4().hex, 'expires_in': 3600, 'token_type': 'Bearer'})
+        elif url.path == '/youtube/discovery':
+            self._send(200, self.services.discovery_document())
+        elif url.path.startswith('/youtube/') or url.path.startswith('/upload/'):
+            self._youtube(url.path, query, body)
+        elif url.path.startswith('/feeds/'):
+            self._feed(url.path[len('/feeds/'):].rsplit('.', 1)[0])
+        elif url.path in (EPISODE_AUDIO_PATH, ARTWORK_PATH):
+            self._media(url.path)
+        else:
+            self._error(404, 'Not found')
+
+    do_GET = do_HEAD = do_POST = do_PUT = _handle
+
+    # Spotify
+
+    def _spotify(self, path, query):
+        catalog = self.services.catalog
+        base_url = self.services.base_url
+
+        if path == '/token':
+            self._send(200, {'access_token': uuid.uuid4().hex, 'token_type': 'Bearer', 'expires_in': 3600})
+            return
+        if not self._authorized():
+            self._error(401, 'No token provided')
+            return
+
+        match = re.match(r'/v1/shows/([^/]+)(/episodes)?$', path)
+        if match and match.group(1) in catalog.show_ids:
+            show_id = match.group(1)
+            released = catalog.released_count(show_id)
+            if not match.group(2):
+                self._send(200, {'id': show_id, 'name': f"Load test {show_id}", 'total_episodes': released})
+                return
+
+            limit = min(int(query.get('limit', ['20'])[0]), 50)
+            offset = int(query.get('offset', ['0'])[0])
+            # Newest first, like Spotify
+            numbers = list(range(released - 1 - offset, max(released - 1 - offset - limit, -1), -1))
+            next_url = None
+            if offset + limit < released:
+                next_url = f"{base_url}/spotify/v1/shows/{show_id}/episodes?offset={offset + limit}&limit={limit}"
+            self._send(200, {
+                'items': [catalog.episode(show_id, number, base_url) for number in numbers],
+                'limit': limit,
+                'offset': offset,
+                'total': released,
+                'next': next_url
+            })
+            return
+
+        match = re.match(r'/v1/episodes/(loadtestshow\d{4})ep(\d+)$', path)
+        if match and match.group(1) in catalog.show_ids:
+            self._send(200, catalog.episode(match.group(1), int(match.group(2)), base_url))
+            return
+
+        self._error(404, 'Non existing id')
+
+    # YouTube
+
+    def _youtube(self, path, query, body):
+        if not self._authorized() and 'key' not in query:
+            self._error(401, 'Login required')
+            return
+
+        if path == '/youtube/v3/channels':
+            self._send(200, {'items': [{
+                'id': 'UCloadtest',
+                'snippet': {'title': 'Load test channel', 'description': ''},
+                'statistics': {'subscriberCount': '0', 'videoCount': str(self.services.stats['uploads'])}
+            }]})
+        elif path in ('/upload/youtube/v3/videos', '/upload/youtube/v3/thumbnails/set'):
+            if query.get('uploadType', [''])[0] != 'resumable':
+                self._error(400, 'Only resumable uploads are supported')
+                return
+            kind = 'video' if path.endswith('/videos') else 'thumbnail'
+            metadata = json.loads(body) if body else {}
+            metadata['videoId'] = query.get('videoId', [None])[0]
+            upload_id = self.services.start_upload(kind, metadata)
+            self._send(200, b'', headers={'Location': f"{self.services.base_url}/upload/sessions/{upload_id}"})
+        elif path.startswith('/upload/sessions/') and self.command == 'PUT':
+            self._upload_chunk(path.rsplit('/', 1)[1], body)
+        else:
+            self._error(404, 'Not found')
+
+    def _upload_chunk(self, upload_id, body):
+        # Content-Range is "bytes a-b/total", or "bytes */total" to ask how much has arrived
+        content_range = self.headers.get('Content-Range', '')
+        match = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)', content_range)
+        if match and match.group(1) is not None:
+            start, end = int(match.group(1)), int(match.group(2))
+        else:
+            start, end = 0, len(body) - 1
+        total = int(match.group(3)) if match and match.group(3) != '*' else None
+        if not content_range:
+            total = len(body)
+
+        result = self.services.receive_chunk(upload_id, start, end, total, len(body))
+        if result is None:
+            self._error(404, 'Upload session not found')
+            return
+
+        upload, complete = result
+        if not complete:
+            headers = {'Range': f"bytes=0-{upload['received'] - 1}"} if upload['received'] else {}
+            self._send(308, b'', headers=headers)
+        elif upload['kind'] == 'video':
+            self._send(200, {
+                'id': upload_id[:11],
+                'snippet': upload['metadata'].get('snippet', {}),
+                'status': upload['metadata'].get('status', {})
+            })
+        else:
+            self._send(200, {'kind': 'youtube#thumbnailSetResponse', 'items': []})
+
+    # Feeds
+
+    def _feed(self, show_id):
+        if show_id not in self.services.catalog.show_ids:
+            self._error(404, 'Not found')
+            return
+        document, etag = self.services.catalog.feed(show_id, self.services.base_url)
+        with self.services._lock:
+            if self.headers.get('If-None-Match') == etag:
+                self.services.stats['feeds_not_modified'] += 1
+            else:
+                self.services.stats['feeds_served'] += 1
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, b'', headers={'ETag': etag})
+        else:
+            self._send(200, document, content_type='application/rss+xml', headers={'ETag': etag})
+
+    # Media
+
+    def _media(self, path):
+        name = os.path.basename(path)
+        content_type = 'audio/mpeg' if name.endswith('.mp3') else 'image/jpeg'
+        with open(self.services.media_path(name), 'rb') as f:
+            self._send(200, f.read(), content_type=content_type)
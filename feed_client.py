@@ -0,0 +1,314 @@
+import re
+import asyncio
+import logging
+import datetime
+import threading
+import unicodedata
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+import requests
+from config import FEED_REQUEST_TIMEOUT, FEED_MATCH_DURATION_TOLERANCE, FEED_MATCH_GRACE_HOURS
+from metrics import FEED_POLLS, FEED_ITEMS_PARSED
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'YoutubePodcastPublisher feed poller'
+
+# Bytes read from a feed response before handing them to the parser
+FEED_CHUNK_BYTES = 64 * 1024
+
+class FeedError(Exception):
+    """Raised when a feed request gets an error response."""
+    pass
+
+class FeedItem:
+    """One episode from a feed: the fields needed to match it to Spotify and fetch its audio."""
+
+    __slots__ = ('title', 'guid', 'published', 'duration_seconds', 'enclosure_url', 'enclosure_bytes')
+
+    def __init__(self, title=None, guid=None, published=None, duration_seconds=None,
+                 enclosure_url=None, enclosure_bytes=None):
+        self.title = title
+        self.guid = guid
+        self.published = published
+        self.duration_seconds = duration_seconds
+        self.enclosure_url = enclosure_url
+        self.enclosure_bytes = enclosure_bytes
+
+def normalize_title(title):
+    """Reduce a title to lowercase letters and digits so cosmetic differences don't block a match."""
+    text = unicodedata.normalize('NFKD', title or '').casefold()
+    return re.sub(r'[\W_]+', '', text)
+
+def parse_duration(value):
+    """Parse an itunes:duration value ("3600", "59:59" or "1:02:03") to seconds."""
+    if not value:
+        return None
+    try:
+        seconds = 0.0
+        for part in value.strip().split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+def parse_date(value):
+    """Parse an RFC 822 (RSS) or ISO 8601 (Atom) date to a date, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return parsedate_to_datetime(value).date()
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+# Namespaces whose elements describe the item itself; extensions such as <itunes:title> are ignored
+ITEM_NAMESPACES = ('', 'http://www.w3.org/2005/Atom')
+
+def _split_tag(tag):
+    """Split '{namespace}name' into (namespace, name)."""
+    if tag.startswith('{'):
+        namespace, name = tag[1:].split('}', 1)
+        return namespace, name
+    return '', tag
+
+class FeedParser:
+    """Incremental RSS/Atom parser: feed it the document as it arrives and collect FeedItems.
+
+    Each item is removed from the tree once it has been read, so memory use
+    stays flat however many episodes the feed lists.
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._stack = []
+
+    def feed(self, data):
+        """Parse the next chunk of the document and return the items it completed."""
+        self._parser.feed(data)
+        return list(self._read_items())
+
+    def close(self):
+        """Finish the document, raising ET.ParseError if it was incomplete, and return any last items."""
+        self._parser.close()
+        return list(self._read_items())
+
+    def _read_items(self):
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                self._stack.append(element)
+                continue
+
+            self._stack.pop()
+            if _split_tag(element.tag)[1] not in ('item', 'entry'):
+                continue
+
+            item = FeedItem()
+            for child in element:
+                namespace, name = _split_tag(child.tag)
+                text = (child.text or '').strip()
+                if name == 'duration':
+                    item.duration_seconds = parse_duration(text)
+                elif namespace not in ITEM_NAMESPACES:
+                    continue
+                elif name == 'title':
+                    item.title = text
+                elif name in ('guid', 'id'):
+                    item.guid = text
+                elif name in ('pubDate', 'published') or (name == 'updated' and not item.published):
+                    item.published = parse_date(text)
+                elif name == 'enclosure':
+                    item.enclosure_url = child.get('url')
+                    item.enclosure_bytes = int(child.get('length')) if (child.get('length') or '').isdigit() else None
+                elif name == 'link' and child.get('rel') == 'enclosure':
+                    item.enclosure_url = child.get('href')
+                    item.enclosure_bytes = int(child.get('length')) if (child.get('length') or '').isdigit() else None
+
+            # Drop the parsed item from its parent so the tree doesn't grow with the feed
+            if self._stack:
+                self._stack[-1].remove(element)
+            element.clear()
+
+            if item.enclosure_url:
+                yield item
+
+def iter_feed_items(stream):
+    """Yield a FeedItem for each RSS <item> or Atom <entry> in a file-like feed, parsing incrementally."""
+    parser = FeedParser()
+    while True:
+        chunk = stream.read(FEED_CHUNK_BYTES)
+        if not chunk:
+            break
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+def in_feed_grace_period(episode, now=None):
+    """Return True if a Spotify episode is recent enough that its feed item may still be on the way."""
+    released = parse_date(episode.get('release_date'))
+    if not released:
+        return False
+    released_at = datetime.datetime.combine(released, datetime.time())
+    return (now or datetime.datetime.utcnow()) < released_at + datetime.timedelta(hours=FEED_MATCH_GRACE_HOURS)
+
+class FeedIndex:
+    """Feed items indexed for matching Spotify episodes to their full-length audio."""
+
+    def __init__(self, items):
+        self.items = items
+        self._by_title = {}
+        self._by_date = {}
+        for item in items:
+            key = normalize_title(item.title)
+            if key:
+                self._by_title.setdefault(key, item)
+            if item.published:
+                self._by_date.setdefault(item.published, []).append(item)
+
+    def match(self, episode):
+        """Return the feed item for a Spotify episode, or None.
+
+        Titles are compared after normalization. Failing that, an item
+        published on the episode's release date with a duration within
+        FEED_MATCH_DURATION_TOLERANCE of Spotify's is accepted, provided it is
+        the only such item.
+        """
+        item = self._by_title.get(normalize_title(episode.get('name')))
+        if item:
+            return item
+
+        released = parse_date(episode.get('release_date'))
+        duration = (episode.get('duration_ms') or 0) / 1000
+        if not released or not duration:
+            return None
+        candidates = [
+            item for item in self._by_date.get(released, [])
+            if item.duration_seconds and abs(item.duration_seconds - duration) <= duration * FEED_MATCH_DURATION_TOLERANCE
+        ]
+        return candidates[0] if len(candidates) == 1 else None
+
+class FeedClient:
+    """Polls podcast RSS/Atom feeds with conditional GETs.
+
+    The ETag and Last-Modified of each feed's last response are kept with its
+    parsed items, so an unchanged feed costs one 304 and no parsing. The
+    cache lives in the process; the first poll after a restart fetches the
+    whole feed.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or FEED_REQUEST_TIMEOUT
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _conditional_request(self, url):
+        """Return the feed's cached entry, if any, and the headers to request it with."""
+        with self._lock:
+            cached = self._cache.get(url)
+
+        headers = {'User-Agent': USER_AGENT}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        return cached, headers
+
+    def _store(self, url, items, etag, last_modified):
+        FEED_POLLS.inc(result='modified')
+        FEED_ITEMS_PARSED.inc(len(items))
+        index = FeedIndex(items)
+        with self._lock:
+            self._cache[url] = {'etag': etag, 'last_modified': last_modified, 'index': index}
+        logger.info("Parsed %s items from feed %s", len(items), url)
+        return index
+
+    def fetch(self, url):
+        """Return a FeedIndex of the feed's current items."""
+        cached, headers = self._conditional_request(url)
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 304 and cached:
+                    FEED_POLLS.inc(result='not_modified')
+                    return cached['index']
+                response.raise_for_status()
+
+                # Parse straight off the socket, letting urllib3 undo any gzip encoding
+                response.raw.decode_content = True
+                items = list(iter_feed_items(response.raw))
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+        except (requests.exceptions.RequestException, ET.ParseError) as e:
+            FEED_POLLS.inc(result='error')
+            logger.error("Error fetching feed %s: %s", url, e)
+            raise
+
+        return self._store(url, items, etag, last_modified)
+
+    async def fetch_async(self, url, transport):
+        """Like fetch, over the discovery engine's transport, so its event loop never waits on a feed.
+
+        The response is parsed chunk by chunk as it arrives, on a worker
+        thread, so a large feed is never held in memory whole.
+        """
+        cached, headers = self._conditional_request(url)
+
+        try:
+            async with transport.stream('GET', url, headers=headers, chunk_size=FEED_CHUNK_BYTES) as (status, response_headers, chunks):
+                if status == 304 and cached:
+                    FEED_POLLS.inc(result='not_modified')
+                    return cached['index']
+                if status >= 400:
+                    raise FeedError(f"{status} error fetching feed {url}")
+
+                parser = FeedParser()
+                items = []
+                async for chunk in chunks:
+                    items.extend(await asyncio.to_thread(parser.feed, chunk))
+                items.extend(parser.close())
+                etag = response_headers.get('ETag')
+                last_modified = response_headers.get('Last-Modified')
+        except Exception as e:
+            FEED_POLLS.inc(result='error')
+            logger.error("Error fetching feed %s: %s", url, e)
+            raise
+
+        return self._store(url, items, etag, last_modified)
+
+_feed_client = None
+
+def get_feed_client():
+    """Return the process-wide feed client, whose cache spans polls."""
+    global _feed_client
+
+    if _feed_client is None:
+        _feed_client = FeedClient()
+    return _feed_client
+
+def load_feed_index(config):
+    """Return the FeedIndex for a show's feed, or None if it has no feed or the feed can't be read.
+
+    Feed problems never stop discovery; episodes just fall back to Spotify's
+    audio_preview_url.
+    """
+    if not config.rss_feed_url:
+        return None
+    try:
+        return get_feed_client().fetch(config.rss_feed_url)
+    except Exception as e:
+        logger.warning("Feed for config %s unavailable, using Spotify preview audio: %s", config.id, e)
+        return None
+
+async def load_feed_index_async(config_id, feed_url, transport):
+    """Like load_feed_index, fetching the feed over an async transport."""
+    if not feed_url:
+        return None
+    try:
+        return await get_feed_client().fetch_async(feed_url, transport)
+    except Exception as e:
+        logger.warning("Feed for config %s unavailable, using Spotify preview audio: %s", config_id, e)
+        return None
@@ -0,0 +1,331 @@
+import logging
+import datetime
+import threading
+from config import (
+    WORKER_CONCURRENCY,
+    USER_CONCURRENCY_CAP,
+    QUEUE_POLL_INTERVAL,
+    QUEUE_STALE_AFTER,
+    ENCODE_SECONDS_BUDGET,
+    PRIORITY_RETRY,
+    YOUTUBE_API_KEY,
+    YOUTUBE_CLIENT_ID
+)
+from cost_model import get_cost_model
+from youtube_quota import QuotaLedger, UPLOAD_COST, project_key
+from profiling import profiled, should_profile
+from resilience import get_breaker
+from metrics import JOBS_FINISHED
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """Dispatches pending conversion jobs to a pool of worker threads.
+
+    Jobs live in the ConversionJob table, so any number of processes can share
+    one queue; a job is claimed with a conditional UPDATE so only one worker
+    ever runs it. Selection is:
+
+    1. Strict priority: new releases before retries before backfill.
+    2. Within a priority, weighted fair sharing across shows. Each show's
+       next job is costed by the cost model, and the show whose virtual
+       time plus cost / queue_weight is lowest goes next; dispatching
+       advances its virtual time by that amount. Short jobs therefore run
+       ahead of long ones, while a show with a long episode or 50 queued
+       episodes still takes its turn. Jobs within a show keep their order.
+    3. Admission control: users already running USER_CONCURRENCY_CAP jobs,
+       jobs that won't fit in free temp space, jobs that would push this
+       process's estimated in-flight encode seconds past ENCODE_SECONDS_BUDGET, and jobs
+       whose YouTube project can't afford another upload or has its circuit
+       breaker open are skipped.
+       Jobs that need more temp space than the disk could ever give them
+       are failed.
+    """
+
+    def __init__(self, app, workers=None, user_cap=None, poll_interval=None, encode_budget=None):
+        self.app = app
+        self.workers = WORKER_CONCURRENCY if workers is None else workers
+        self.user_cap = USER_CONCURRENCY_CAP if user_cap is None else user_cap
+        self.poll_interval = QUEUE_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.encode_budget = ENCODE_SECONDS_BUDGET if encode_budget is None else encode_budget
+        self._virtual_time = {}
+        self._in_flight = {}
+        self._dispatch_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        """Start the worker threads."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %s job queue workers", self.workers)
+
+    def stop(self):
+        """Ask the worker threads to exit once their current job finishes."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+
+    def wake(self):
+        """Tell idle workers that new jobs may be available."""
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _worker(self):
+        from scheduler import process_episode_job
+
+        while not self._stopping:
+            try:
+                job_id = self.dispatch()
+            except Exception as e:
+                logger.error("Error dispatching job: %s", e)
+                job_id = None
+
+            if job_id is None:
+                # Nothing runnable; sleep until woken or until delayed jobs may be due
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+
+            try:
+                process_episode_job(job_id)
+            finally:
+                self.finish(job_id)
+
+            # A finished job frees a user slot, so another worker may now have work
+            self.wake()
+
+    def dispatch(self):
+        """Claim the next job to run and return its ID, or None if nothing is runnable."""
+        with profiled('tick', 'dispatch', should_profile()), self._dispatch_lock, self.app.app_context():
+            from app import db
+
+            try:
+                snapshot = self._snapshot()
+                for candidate in self._candidates():
+                    if not self._admit(candidate, snapshot):
+                        continue
+                    if self._claim(candidate['id'], candidate['cost']):
+                        self._charge(candidate)
+                        return candidate['id']
+                return None
+            finally:
+                db.session.remove()
+
+    def finish(self, job_id):
+        """Release the budgets held by a dispatched job."""
+        with self._dispatch_lock:
+            self._in_flight.pop(job_id, None)
+
+    def _candidates(self):
+        """Return each show's next due job, in the order they should be tried."""
+        from app import db
+        from models import ConversionJob, PodcastConfig
+
+        now = datetime.datetime.utcnow()
+
+        # Only the head of each show's queue can be dispatched next
+        ranked = (
+            db.session.query(
+                ConversionJob.id,
+                ConversionJob.config_id,
+                ConversionJob.user_id,
+                ConversionJob.priority,
+                ConversionJob.duration_seconds,
+                db.func.row_number().over(
+                    partition_by=ConversionJob.config_id,
+                    order_by=(ConversionJob.priority.desc(), ConversionJob.created_at, ConversionJob.id)
+                ).label('position')
+            )
+            .filter(
+                ConversionJob.status == 'pending',
+                db.or_(ConversionJob.not_before.is_(None), ConversionJob.not_before <= now)
+            )
+            .subquery()
+        )
+        heads = (
+            db.session.query(
+                ranked.c.id,
+                ranked.c.config_id,
+                ranked.c.user_id,
+                ranked.c.priority,
+                ranked.c.duration_seconds,
+                PodcastConfig.queue_weight,
+                PodcastConfig.video_bitrate,
+                PodcastConfig.youtube_client_id,
+                PodcastConfig.youtube_api_key
+            )
+            .outerjoin(PodcastConfig, PodcastConfig.id == ranked.c.config_id)
+            .filter(ranked.c.position == 1)
+            .all()
+        )
+        if not heads:
+            return []
+
+        # Jobs stuck in processing past the stale cutoff belong to dead workers and don't count
+        running = dict(
+            db.session.query(ConversionJob.user_id, db.func.count(ConversionJob.id))
+            .filter(
+                ConversionJob.status == 'processing',
+                ConversionJob.started_at >= now - datetime.timedelta(seconds=QUEUE_STALE_AFTER)
+            )
+            .group_by(ConversionJob.user_id)
+            .all()
+        )
+
+        # Shows joining the queue start at the current minimum so they can't jump ahead indefinitely
+        floor = min(self._virtual_time.values(), default=0.0)
+        cost_model = get_cost_model()
+        candidates = []
+        for job_id, config_id, user_id, priority, duration, weight, bitrate, client_id, api_key in heads:
+            if self.user_cap and running.get(user_id, 0) >= self.user_cap:
+                continue
+
+            weight = max(weight or 1, 1)
+            cost = cost_model.estimate(duration, bitrate)
+            candidates.append({
+                'id': job_id,
+                'config_id': config_id,
+                'priority': priority or 0,
+                'cost': cost,
+                # The project the job's YouTubeClient will upload with, environment fallbacks included
+                'project': project_key(client_id or YOUTUBE_CLIENT_ID, api_key or YOUTUBE_API_KEY),
+                'finish_time': self._virtual_time.setdefault(config_id, floor) + cost.total_seconds / weight
+            })
+
+        candidates.sort(key=lambda c: (-c['priority'], c['finish_time'], c['id']))
+        return candidates
+
+    def _snapshot(self):
+        """Take the budgets every candidate in one dispatch is checked against.
+
+        Temp space comes from the workspace reservations, without walking
+        the temp trees. Each YouTube project's remaining quota is looked up
+        once, when the first candidate for it is checked.
+        """
+        from workspace import get_workspace_manager
+
+        workspace_manager = get_workspace_manager()
+        return {
+            'capacity_bytes': workspace_manager.capacity_bytes(),
+            'free_bytes': workspace_manager.available_bytes(),
+            'quota_remaining': {}
+        }
+
+    def _admit(self, candidate, snapshot):
+        """Return True if the job fits in the current disk, encode and YouTube quota budgets."""
+        cost = candidate['cost']
+        project = candidate['project']
+
+        # Every job ends in a YouTube upload; while its project's uploads are failing, it stays queued
+        if get_breaker('youtube', project).is_open():
+            logger.debug("Not admitting job %s: YouTube breaker open for its project", candidate['id'])
+            return False
+
+        # A job that could never fit would otherwise be skipped on every dispatch forever
+        capacity = snapshot['capacity_bytes']
+        if cost.workspace_bytes > capacity:
+            self._reject(candidate['id'], f"Needs about {cost.workspace_bytes} bytes of temp space, "
+                                          f"more than the {capacity} bytes available to all jobs")
+            return False
+
+        free_bytes = snapshot['free_bytes']
+        if cost.workspace_bytes > free_bytes:
+            logger.debug("Not admitting job %s: needs %s bytes of temp space, %s free",
+                         candidate['id'], cost.workspace_bytes, free_bytes)
+            return False
+
+        # A job bigger than the whole budget may still run on its own
+        encoding = sum(job['encode_seconds'] for job in self._in_flight.values())
+        if encoding and encoding + cost.encode_seconds > self.encode_budget:
+            logger.debug("Not admitting job %s: %.0fs of encoding already in flight", candidate['id'], encoding)
+            return False
+
+        if project:
+            remaining = snapshot['quota_remaining'].get(project)
+            if remaining is None:
+                remaining = snapshot['quota_remaining'][project] = QuotaLedger(project).remaining()
+            uploading = sum(1 for job in self._in_flight.values() if job['project'] == project)
+            if remaining < UPLOAD_COST * (uploading + 1):
+                logger.debug("Not admitting job %s: no YouTube quota left for another upload", candidate['id'])
+                return False
+
+        return True
+
+    def _claim(self, job_id, cost):
+        """Atomically move a job from pending to processing; False if another worker got it."""
+        from app import db
+        from models import ConversionJob
+
+        result = db.session.execute(
+            db.update(ConversionJob)
+            .where(ConversionJob.id == job_id, ConversionJob.status == 'pending')
+            .values(status='processing', started_at=datetime.datetime.utcnow(), estimated_seconds=cost.total_seconds)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _reject(self, job_id, reason):
+        """Fail a pending job that can never be admitted."""
+        from app import db
+        from models import ConversionJob
+
+        result = db.session.execute(
+            db.update(ConversionJob)
+            .where(ConversionJob.id == job_id, ConversionJob.status == 'pending')
+            .values(status='failed', error_message=reason, completed_at=datetime.datetime.utcnow())
+        )
+        db.session.commit()
+        if result.rowcount:
+            JOBS_FINISHED.inc(status='failed')
+            logger.warning("Failed job %s without running it: %s", job_id, reason)
+
+    def _charge(self, candidate):
+        self._virtual_time[candidate['config_id']] = candidate['finish_time']
+        self._in_flight[candidate['id']] = {
+            'encode_seconds': candidate['cost'].encode_seconds,
+            'project': candidate['project']
+        }
+
+def requeue_stale_jobs():
+    """Return jobs orphaned in 'processing' by a crashed worker to the queue as retries."""
+    from app import db
+    from models import ConversionJob
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=QUEUE_STALE_AFTER)
+    result = db.session.execute(
+        db.update(ConversionJob)
+        .where(ConversionJob.status == 'processing', ConversionJob.started_at < cutoff)
+        .values(status='pending', started_at=None, priority=PRIORITY_RETRY)
+    )
+    db.session.commit()
+
+    if result.rowcount:
+        logger.warning("Requeued %s stale processing jobs", result.rowcount)
+    return result.rowcount
+
+_queue = None
+
+def init_job_queue(app):
+    """Create and start the process-wide job queue."""
+    global _queue
+
+    if _queue is None:
+        with app.app_context():
+            requeue_stale_jobs()
+        _queue = JobQueue(app)
+        _queue.start()
+    return _queue
+
+def get_job_queue():
+    """Return the process-wide job queue, or None if it hasn't been started."""
+    return _queue
+
+def wake_job_queue():
+    """Wake the job queue's workers if the queue is running in this process."""
+    if _queue:
+        _queue.wake()
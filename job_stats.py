@@ -0,0 +1,162 @@
+import math
+import time
+import logging
+import datetime
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in the order a job passes through them
+STAGES = ['queue', 'download', 'encode', 'upload', 'cleanup']
+
+# Selectable aggregation windows for the history and dashboard views
+WINDOWS = {
+    '24h': datetime.timedelta(hours=24),
+    '7d': datetime.timedelta(days=7),
+    '30d': datetime.timedelta(days=30)
+}
+DEFAULT_WINDOW = '24h'
+
+class StageTimer:
+    """Handle yielded by record_stage so the caller can attach a byte count."""
+
+    def __init__(self):
+        self.bytes = None
+
+def record_queue_wait(job):
+    """Record the time a job spent waiting to start.
+
+    The wait runs from when the job last became ready: its creation, the
+    end of its previous attempt, or the time it was held until, whichever
+    is latest. Each attempt's wait is then its own row, and retries don't
+    count the same time twice.
+    """
+    from app import db
+    from models import JobStage
+
+    if not job.created_at or not job.started_at:
+        return
+
+    previous_end = db.session.query(db.func.max(JobStage.completed_at)).filter(JobStage.job_id == job.id).scalar()
+    ready_at = max(t for t in (job.created_at, previous_end, job.not_before) if t is not None)
+    ready_at = min(ready_at, job.started_at)
+
+    db.session.add(JobStage(
+        job_id=job.id,
+        stage='queue',
+        started_at=ready_at,
+        completed_at=job.started_at,
+        duration_seconds=(job.started_at - ready_at).total_seconds(),
+        succeeded=True
+    ))
+    db.session.commit()
+
+def record_stage_span(job, stage, started_at, duration_seconds, nbytes=None, succeeded=True):
+    """Store a stage timed by the caller, for stages that overlap others."""
+    from app import db
+    from models import JobStage
+
+    try:
+        db.session.add(JobStage(
+            job_id=job.id,
+            stage=stage,
+            started_at=started_at,
+            completed_at=started_at + datetime.timedelta(seconds=duration_seconds),
+            duration_seconds=duration_seconds,
+            bytes=nbytes,
+            succeeded=succeeded
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Failed to record %s stage for job %s: %s", stage, job.id, e)
+
+@contextmanager
+def record_stage(job, stage):
+    """Time a pipeline stage and store it for the job, whether it succeeds or fails."""
+    from app import db
+    from models import JobStage
+
+    timer = StageTimer()
+    started_at = datetime.datetime.utcnow()
+    start = time.monotonic()
+    succeeded = False
+    try:
+        yield timer
+        succeeded = True
+    finally:
+        try:
+            db.session.add(JobStage(
+                job_id=job.id,
+                stage=stage,
+                started_at=started_at,
+                completed_at=datetime.datetime.utcnow(),
+                duration_seconds=time.monotonic() - start,
+                bytes=timer.bytes,
+                succeeded=succeeded
+            ))
+            db.session.commit()
+        except Exception as e:
+            # Timing is diagnostic only; never let it mask the stage's own outcome
+            db.session.rollback()
+            logger.warning("Failed to record %s stage for job %s: %s", stage, job.id, e)
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+def window_start(window):
+    """Return the start of an aggregation window, falling back to the default window."""
+    return datetime.datetime.utcnow() - WINDOWS.get(window, WINDOWS[DEFAULT_WINDOW])
+
+def stage_rows(user_id, since):
+    """Return (job, stage) pairs for a user's jobs with stages started since a time."""
+    from models import ConversionJob, JobStage
+
+    return (
+        ConversionJob.query
+        .join(JobStage, JobStage.job_id == ConversionJob.id)
+        .filter(ConversionJob.user_id == user_id, JobStage.started_at >= since)
+        .with_entities(ConversionJob, JobStage)
+        .order_by(JobStage.started_at)
+        .all()
+    )
+
+def stage_summary(user_id, window=DEFAULT_WINDOW):
+    """Return p50/p95 duration and mean bytes per stage over a window."""
+    from app import db
+    from models import ConversionJob, JobStage
+
+    rows = (
+        db.session.query(JobStage.stage, JobStage.duration_seconds, JobStage.bytes)
+        .join(ConversionJob, JobStage.job_id == ConversionJob.id)
+        .filter(
+            ConversionJob.user_id == user_id,
+            JobStage.started_at >= window_start(window),
+            JobStage.succeeded.is_(True)
+        )
+        .all()
+    )
+
+    durations = {stage: [] for stage in STAGES}
+    byte_counts = {stage: [] for stage in STAGES}
+    for stage, duration, nbytes in rows:
+        durations.setdefault(stage, []).append(duration or 0.0)
+        if nbytes is not None:
+            byte_counts.setdefault(stage, []).append(nbytes)
+
+    summary = []
+    for stage in durations:
+        values = sorted(durations[stage])
+        sizes = byte_counts.get(stage) or []
+        summary.append({
+            'stage': stage,
+            'count': len(values),
+            'p50': percentile(values, 0.50),
+            'p95': percentile(values, 0.95),
+            'mean_bytes': sum(sizes) / len(sizes) if sizes else None
+        })
+    return summary
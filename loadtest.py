@@ -0,0 +1,226 @@
+import os
+import time
+import json
+import shutil
+import logging
+import datetime
+import tempfile
+import click
+from fake_services import FakeCatalog, FakeServices, ARTWORK_PATH
+
+logger = logging.getLogger(__name__)
+
+def _isolated_environment(workdir, services, workers, poll_interval):
+    """Point the app at a throwaway database, temp directories and the stand-in services."""
+    environment = {
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        'TEMP_DIRECTORY': os.path.join(workdir, 'temp'),
+        'RAM_SCRATCH_DIRECTORY': os.path.join(workdir, 'scratch'),
+        'RENDER_CACHE_DIRECTORY': os.path.join(workdir, 'renders'),
+        'OUTPUT_CACHE_DIRECTORY': os.path.join(workdir, 'outputs'),
+        'RENDITION_DIRECTORY': os.path.join(workdir, 'renditions'),
+        'WORKER_CONCURRENCY': str(workers),
+        'QUEUE_POLL_INTERVAL': str(poll_interval),
+        # Quota accounting still runs, but the test measures the pipeline, not the daily limit
+        'YOUTUBE_DAILY_QUOTA': str(10 ** 9),
+        'SESSION_SECRET': 'loadtest'
+    }
+    environment.update(services.environment())
+    os.environ.update(environment)
+
+def _create_shows(catalog, base_url):
+    """Create one user and show per catalog show, so the per-user cap doesn't serialize them."""
+    from app import db
+    from models import User, PodcastConfig
+
+    config_ids = []
+    for index, show_id in enumerate(catalog.show_ids):
+        user = User(username=f"loadtest{index}", email=f"loadtest{index}@example.com", password_hash='!')
+        db.session.add(user)
+        db.session.flush()
+        config = PodcastConfig(
+            user_id=user.id,
+            name=f"Load test {index}",
+            spotify_client_id='loadtest',
+            spotify_client_secret='loadtest',
+            spotify_podcast_id=show_id,
+            youtube_api_key='loadtest',
+            youtube_client_id=f"loadtest-{index}",
+            youtube_client_secret='loadtest',
+            youtube_refresh_token='loadtest',
+            logo_url=f"{base_url}{ARTWORK_PATH}",
+            rss_feed_url=f"{base_url}/feeds/{show_id}.xml"
+        )
+        db.session.add(config)
+        db.session.flush()
+        config_ids.append(config.id)
+    db.session.commit()
+    return config_ids
+
+def _outstanding_jobs():
+    from models import ConversionJob
+
+    return ConversionJob.query.filter(ConversionJob.status.in_(('pending', 'processing'))).count()
+
+def _seconds(start, end):
+    return (end - start).total_seconds() if start and end else None
+
+def _distribution(values):
+    from job_stats import percentile
+
+    values = sorted(value for value in values if value is not None)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.50),
+        'p90': percentile(values, 0.90),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else None
+    }
+
+def build_report(catalog, services, elapsed, discovery):
+    """Summarize the run from the jobs in the database and the stand-ins' counters."""
+    from models import ConversionJob, JobStage
+
+    jobs = ConversionJob.query.all()
+    by_status = {}
+    for job in jobs:
+        by_status[job.status] = by_status.get(job.status, 0) + 1
+
+    completed = [job for job in jobs if job.status == 'completed']
+    finished = len(completed) + by_status.get('failed', 0)
+
+    # Release-to-upload latency is measured from the catalog's release time, so it
+    # includes the wait for the next discovery check
+    release_latency = []
+    for job in completed:
+        released = catalog.release_time(job.episode_id or '')
+        if released and job.completed_at:
+            completed_at = job.completed_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+            release_latency.append(completed_at - released)
+
+    stages = {}
+    for stage, duration in (
+        JobStage.query.filter(JobStage.succeeded.is_(True))
+        .with_entities(JobStage.stage, JobStage.duration_seconds)
+    ):
+        stages.setdefault(stage, []).append(duration)
+
+    return {
+        'elapsed_seconds': elapsed,
+        'shows': len(catalog.show_ids),
+        'episodes_released': catalog.total_released(),
+        'jobs': by_status,
+        'throughput_per_hour': len(completed) * 3600 / elapsed if elapsed else None,
+        'job_failure_rate': by_status.get('failed', 0) / finished if finished else None,
+        'discovery_checks': discovery['checks'],
+        'discovery_failure_rate': discovery['failures'] / discovery['checks'] if discovery['checks'] else None,
+        'release_to_upload_seconds': _distribution(release_latency),
+        'job_seconds': _distribution(_seconds(job.started_at, job.completed_at) for job in completed),
+        'stage_seconds': {stage: _distribution(values) for stage, values in stages.items()},
+        'services': dict(services.stats)
+    }
+
+def print_report(report):
+    def fmt(value):
+        return '-' if value is None else f"{value:.2f}"
+
+    def fmt_distribution(d):
+        return f"n={d['count']} p50={fmt(d['p50'])} p90={fmt(d['p90'])} p99={fmt(d['p99'])} max={fmt(d['max'])}"
+
+    click.echo(f"Ran {report['elapsed_seconds']:.0f}s with {report['shows']} shows; "
+               f"{report['episodes_released']} episodes released")
+    click.echo(f"Jobs: {', '.join(f'{status}={count}' for status, count in sorted(report['jobs'].items())) or 'none'}")
+    click.echo(f"Throughput: {fmt(report['throughput_per_hour'])} episodes/hour")
+    click.echo(f"Job failure rate: {fmt(report['job_failure_rate'])}; "
+               f"discovery failure rate: {fmt(report['discovery_failure_rate'])} over {report['discovery_checks']} checks")
+    click.echo(f"Release to upload (s): {fmt_distribution(report['release_to_upload_seconds'])}")
+    click.echo(f"Job run time (s): {fmt_distribution(report['job_seconds'])}")
+    for stage, distribution in sorted(report['stage_seconds'].items()):
+        click.echo(f"  {stage:<8} {fmt_distribution(distribution)}")
+    stats = report['services']
+    click.echo(f"Service requests: {stats['requests']} ({stats['injected_failures']} failed on purpose), "
+               f"{stats['uploads']} uploads, {stats['upload_bytes']} bytes, "
+               f"{stats['feeds_served']} feeds served and {stats['feeds_not_modified']} not modified")
+
+@click.command()
+@click.option('--shows', type=int, default=5, show_default=True, help='Shows to simulate.')
+@click.option('--releases-per-hour', type=float, default=60, show_default=True, help='New episodes per hour across all shows.')
+@click.option('--backlog', type=int, default=1, show_default=True, help='Episodes each show has already released at the start.')
+@click.option('--duration', type=float, default=300, show_default=True, help='Seconds to keep releasing and discovering episodes.')
+@click.option('--drain-timeout', type=float, default=600, show_default=True, help='Seconds to wait for queued jobs after the run.')
+@click.option('--check-interval', type=float, default=15, show_default=True, help='Seconds between discovery checks of each show.')
+@click.option('--episode-seconds', type=float, default=30, show_default=True, help='Length of the generated episode audio.')
+@click.option('--workers', type=int, default=2, show_default=True, help='Job queue worker threads.')
+@click.option('--latency', type=float, default=0.0, show_default=True, help='Seconds added to every service request.')
+@click.option('--failure-rate', type=float, default=0.0, show_default=True, help='Share of service requests failed with a 503.')
+@click.option('--seed', type=int, default=None, help='Seed for injected failures.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+@click.option('--keep', is_flag=True, help='Keep the database and temp files for inspection.')
+def main(shows, releases_per_hour, backlog, duration, drain_timeout, check_interval, episode_seconds,
+         workers, latency, failure_rate, seed, as_json, keep):
+    """Load test discovery and conversion end to end against local Spotify and YouTube stand-ins.
+
+    The real scheduler, job queue, converter and API clients run against
+    fake_services.py with a throwaway database, so nothing leaves the machine.
+    """
+    workdir = tempfile.mkdtemp(prefix='podcast-loadtest-')
+    catalog = FakeCatalog(shows, releases_per_hour, backlog=backlog, episode_seconds=episode_seconds)
+    services = FakeServices(catalog, latency=latency, failure_rate=failure_rate, seed=seed)
+
+    # The app reads its settings at import, so the environment must be in place first
+    _isolated_environment(workdir, services, workers, poll_interval=1)
+    services.start()
+
+    from app import app
+    import scheduler
+    from discovery import get_discovery_engine
+    from job_queue import get_job_queue
+
+    try:
+        with app.app_context():
+            config_ids = _create_shows(catalog, services.base_url)
+
+        engine = get_discovery_engine()
+        discovery = {'checks': 0, 'failures': 0}
+        start = time.monotonic()
+        next_check = start
+        while time.monotonic() - start < duration:
+            # Check every show at once, as the scheduler would when their intervals line up
+            futures = {config_id: engine.submit(config_id) for config_id in config_ids}
+            for config_id, future in futures.items():
+                discovery['checks'] += 1
+                try:
+                    future.result()
+                except Exception as e:
+                    discovery['failures'] += 1
+                    logger.warning("Discovery check for config %s failed: %s", config_id, e)
+            next_check += check_interval
+            time.sleep(max(min(next_check, start + duration) - time.monotonic(), 0))
+
+        # Let the queue finish what was discovered
+        drain_until = time.monotonic() + drain_timeout
+        with app.app_context():
+            while _outstanding_jobs() and time.monotonic() < drain_until:
+                time.sleep(1)
+        elapsed = time.monotonic() - start
+
+        with app.app_context():
+            report = build_report(catalog, services, elapsed, discovery)
+        if as_json:
+            click.echo(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+    finally:
+        # Stop background work before its database is removed
+        if get_job_queue():
+            get_job_queue().stop()
+        if scheduler.scheduler and scheduler.scheduler.running:
+            scheduler.scheduler.shutdown(wait=False)
+        services.stop()
+        if keep:
+            click.echo(f"Database and temp files kept in {workdir}", err=True)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import json
+import uuid
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config import LOG_LEVEL, LOG_FORMAT, LOG_LEVELS, LOG_SAMPLE_EVERY
+
+# Correlation fields attached to every log record emitted in the current context
+_correlation = ContextVar('log_correlation', default={})
+
+# Attributes present on every LogRecord; anything else was passed through `extra`
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def new_correlation_id():
+    """Return a short random ID for a request or scheduler tick."""
+    return uuid.uuid4().hex[:16]
+
+def get_correlation():
+    """Return the correlation fields of the current context."""
+    return dict(_correlation.get())
+
+@contextmanager
+def correlation_context(**fields):
+    """Attach correlation fields (e.g. correlation_id, job_id) to logs inside the block.
+
+    Fields are merged with those already set, so a job processed inside a
+    scheduler tick keeps the tick's correlation ID.
+    """
+    merged = dict(_correlation.get())
+    merged.update({key: value for key, value in fields.items() if value is not None})
+    if 'correlation_id' not in merged:
+        merged['correlation_id'] = new_correlation_id()
+
+    token = _correlation.set(merged)
+    try:
+        yield merged
+    finally:
+        _correlation.reset(token)
+
+class CorrelationFilter(logging.Filter):
+    """Copy the current correlation fields onto each record."""
+
+    def filter(self, record):
+        for key, value in _correlation.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Let through one in every N records logged with extra={'sampled': True}.
+
+    Records are counted per logger and message template, so different
+    high-volume lines are sampled independently. Warnings and above are never
+    dropped.
+    """
+
+    def __init__(self, every=None):
+        super().__init__()
+        self.every = max(int(every or LOG_SAMPLE_EVERY), 1)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % self.every == 0
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and key != 'sampled':
+                entry[key] = value
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Plain-text format that appends the correlation ID when there is one."""
+
+    def format(self, record):
+        message = super().format(record)
+        correlation_id = getattr(record, 'correlation_id', None)
+        if correlation_id:
+            message = f"{message} [correlation_id={correlation_id}]"
+        return message
+
+def parse_levels(spec):
+    """Parse 'module=LEVEL,other=LEVEL' into a dict of logger names to levels."""
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging():
+    """Install the structured log handler on the root logger."""
+    handler = logging.StreamHandler()
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(SamplingFilter())
+
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(TextFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
@@ -0,0 +1,266 @@
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def clear(self):
+        """Drop all recorded label combinations."""
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """Return (suffix, labels string, value) tuples for exposition."""
+        with self._lock:
+            items = list(self._values.items())
+        return [('', self._format_labels(key), value) for key, value in items]
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter for a label combination."""
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the gauge for a label combination."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        """Increase the gauge for a label combination."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """Decrease the gauge for a label combination."""
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        """Record one observation for a label combination."""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of a block, including blocks that raise."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, dict(state, buckets=list(state['buckets']))) for key, state in self._values.items()]
+
+        samples = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state['buckets']):
+                samples.append(('_bucket', self._format_labels(key, ('le', _format_value(bound))), count))
+            samples.append(('_bucket', self._format_labels(key, ('le', '+Inf')), state['count']))
+            samples.append(('_sum', self._format_labels(key), state['sum']))
+            samples.append(('_count', self._format_labels(key), state['count']))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric):
+        """Add a metric to the registry."""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def add_collector(self, collector):
+        """Register a callable run before each scrape to refresh gauges."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", getattr(collector, '__name__', collector), e)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+REGISTRY = Registry()
+
+# Spotify API
+SPOTIFY_REQUEST_DURATION = Histogram(
+    'spotify_api_request_duration_seconds', 'Latency of Spotify API requests.', ['endpoint'])
+SPOTIFY_REQUEST_ERRORS = Counter(
+    'spotify_api_errors_total', 'Failed Spotify API requests by HTTP status.', ['endpoint', 'status'])
+
+# Podcast feeds
+FEED_POLLS = Counter(
+    'feed_polls_total', 'Podcast feed polls by result (modified, not_modified or error).', ['result'])
+FEED_ITEMS_PARSED = Counter(
+    'feed_items_parsed_total', 'Items parsed from podcast feeds.')
+
+# Downloads
+DOWNLOAD_BYTES = Counter(
+    'download_bytes_total', 'Bytes downloaded for episodes.', ['kind'])
+DOWNLOAD_DURATION = Histogram(
+    'download_duration_seconds', 'Time spent downloading episode inputs.', ['kind'])
+
+# FFmpeg encoding
+ENCODE_DURATION = Histogram(
+    'ffmpeg_encode_duration_seconds', 'Wall-clock time of FFmpeg encodes.', ['status'])
+ENCODE_SPEED = Histogram(
+    'ffmpeg_encode_speed_ratio', 'Seconds of media encoded per second of wall-clock time.', [],
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+# YouTube API
+YOUTUBE_UPLOAD_DURATION = Histogram(
+    'youtube_upload_duration_seconds', 'Time spent uploading videos to YouTube.', ['status'])
+YOUTUBE_UPLOAD_BYTES = Counter(
+    'youtube_upload_bytes_total', 'Bytes of video uploaded to YouTube.')
+YOUTUBE_UPLOAD_RETRY_COUNT = Counter(
+    'youtube_upload_retries_total', 'Upload chunks resent after a transient YouTube failure.')
+YOUTUBE_API_ERRORS = Counter(
+    'youtube_api_errors_total', 'Failed YouTube API calls.', ['call'])
+YOUTUBE_QUOTA_UNITS = Counter(
+    'youtube_quota_units_total', 'YouTube Data API quota units spent.', ['call'])
+
+# Spotify and YouTube resilience
+CIRCUIT_BREAKER_STATE = Gauge(
+    'circuit_breaker_state', 'Worst circuit breaker state per dependency (0 closed, 1 half-open, 2 open).', ['dependency'])
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    'circuit_breaker_transitions_total', 'Circuit breaker state changes, by the state entered.', ['dependency', 'state'])
+DEPENDENCY_RETRIES = Counter(
+    'dependency_retries_total', 'Calls to Spotify or YouTube retried after a transient failure.', ['dependency'])
+
+# Scheduler and jobs
+SCHEDULER_TICK_DURATION = Histogram(
+    'scheduler_tick_duration_seconds', 'Duration of scheduled podcast checks, including processing.', ['status'])
+DISCOVERY_CHECKS_IN_FLIGHT = Gauge(
+    'discovery_checks_in_flight', 'Show checks currently polling Spotify.')
+EPISODES_DISCOVERED = Counter(
+    'episodes_discovered_total', 'New episodes found by podcast checks.')
+JOBS_FINISHED = Counter(
+    'jobs_finished_total', 'Episode jobs that finished processing, by outcome.', ['status'])
+JOB_DURATION = Histogram(
+    'job_duration_seconds', 'End-to-end processing time of episode jobs.', ['status'])
+JOBS_BY_STATUS = Gauge(
+    'conversion_jobs', 'Conversion jobs currently in the database, by status.', ['status'])
+
+# Title cards
+RENDER_CACHE_LOOKUPS = Counter(
+    'title_card_cache_lookups_total', 'Title card and thumbnail cache lookups.', ['result'])
+RENDER_DURATION = Histogram(
+    'title_card_render_duration_seconds', 'Time spent rendering title cards and thumbnails.')
+
+# Audio processing
+AUDIO_MEASUREMENT_LOOKUPS = Counter(
+    'audio_measurement_cache_lookups_total', 'Loudness and silence measurement cache lookups.', ['result'])
+
+# Encoded video cache
+OUTPUT_CACHE_LOOKUPS = Counter(
+    'output_cache_lookups_total', 'Encoded video cache lookups.', ['result'])
+OUTPUT_CACHE_SAVED_SECONDS = Counter(
+    'output_cache_saved_encode_seconds_total', 'Encode seconds avoided by reusing cached videos.')
+
+# Temporary storage
+TEMP_BYTES = Gauge(
+    'temp_bytes', 'Temporary storage in bytes, by medium and kind.', ['medium', 'kind'])
+TEMP_ACTIVE_WORKSPACES = Gauge(
+    'temp_active_workspaces', 'Job workspaces currently allocated, by medium.', ['medium'])
+TEMP_WORKSPACE_ALLOCATIONS = Counter(
+    'temp_workspace_allocations_total', 'Job workspaces allocated, by medium.', ['medium'])
+
+def collect_workspace_usage():
+    """Refresh temp storage gauges from the workspace manager."""
+    from workspace import get_workspace_manager, MEDIUM_DISK, MEDIUM_RAM
+
+    usage = get_workspace_manager().usage()
+
+    for kind in ('reserved', 'used', 'available'):
+        TEMP_BYTES.set(usage[f'{kind}_bytes'], medium=MEDIUM_DISK, kind=kind)
+        TEMP_BYTES.set(usage[f'ram_{kind}_bytes'], medium=MEDIUM_RAM, kind=kind)
+    TEMP_BYTES.set(usage['quota_bytes'], medium=MEDIUM_DISK, kind='quota')
+    TEMP_BYTES.set(usage['disk_free_bytes'], medium=MEDIUM_DISK, kind='free')
+    TEMP_BYTES.set(usage['ram_budget_bytes'], medium=MEDIUM_RAM, kind='quota')
+
+    TEMP_ACTIVE_WORKSPACES.set(usage['active_workspaces'], medium=MEDIUM_DISK)
+    TEMP_ACTIVE_WORKSPACES.set(usage['ram_active_workspaces'], medium=MEDIUM_RAM)
+
+REGISTRY.add_collector(collect_workspace_usage)
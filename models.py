@@ -1,6 +1,7 @@
 import datetime
 from app import db
 from flask_login import UserMixin
+from config import PRIORITY_RELEASE
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,18 +11,24 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
     # Relationships
-    podcast_config = db.relationship('PodcastConfig', backref='user', lazy=True, uselist=False)
+    podcast_configs = db.relationship('PodcastConfig', backref='user', lazy=True, order_by='PodcastConfig.id')
     conversion_jobs = db.relationship('ConversionJob', backref='user', lazy=True)
 
 class PodcastConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    
+    # Show name, shown on the dashboard to tell a user's shows apart
+    name = db.Column(db.String(256))
     
     # Spotify settings
     spotify_client_id = db.Column(db.String(128))
     spotify_client_secret = db.Column(db.String(128))
     spotify_podcast_id = db.Column(db.String(128))
     
+    # Podcast RSS/Atom feed, used for full-length episode audio
+    rss_feed_url = db.Column(db.String(1024))
+    
     # YouTube settings
     youtube_api_key = db.Column(db.String(128))
     youtube_client_id = db.Column(db.String(128))
@@ -34,6 +41,13 @@ class PodcastConfig(db.Model):
     video_height = db.Column(db.Integer, default=720)
     video_bitrate = db.Column(db.String(20), default='1M')
     logo_url = db.Column(db.String(512))
+    visualization = db.Column(db.String(20), default='none', server_default='none')  # none, waveform or spectrum
+    normalize_audio = db.Column(db.Boolean, default=False, server_default='0')  # EBU R128 loudness normalization
+    trim_silence = db.Column(db.Boolean, default=False, server_default='0')  # Cut leading and trailing silence
+    renditions = db.Column(db.String(255))  # Extra aspect ratios rendered with the main video, e.g. "square,vertical"
+    
+    # Share of worker time relative to the user's other shows
+    queue_weight = db.Column(db.Integer, default=1, server_default=db.text('1'))
     
     # Scheduler settings
     check_interval = db.Column(db.Integer, default=60)  # In minutes
@@ -41,6 +55,10 @@ class PodcastConfig(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    @property
+    def display_name(self):
+        return self.name or self.spotify_podcast_id or f"Show {self.id}"
 
 class ProcessedEpisode(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,11 +77,25 @@ class ProcessedEpisode(db.Model):
 class ConversionJob(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    config_id = db.Column(db.Integer, db.ForeignKey('podcast_config.id'), index=True)
     episode_id = db.Column(db.String(128))
     
+    # Set when the job's show was deleted and config_id cleared; unset on jobs from
+    # before shows were linked to jobs
+    show_deleted = db.Column(db.Boolean, default=False, server_default='0')
+    
     # Status: pending, processing, completed, failed
     status = db.Column(db.String(20), default='pending')
     
+    # Scheduling: source is 'release' or 'backfill'; higher priority runs first,
+    # and the job isn't started before not_before
+    source = db.Column(db.String(20), default='release', server_default='release')
+    priority = db.Column(db.Integer, default=PRIORITY_RELEASE, server_default=db.text(str(PRIORITY_RELEASE)), index=True)
+    not_before = db.Column(db.DateTime)
+    
+    # Times the job was put back for lack of temp space, which lengthens its next wait
+    deferrals = db.Column(db.Integer, default=0, server_default='0')
+    
     # Job details
     episode_title = db.Column(db.String(512))
     audio_url = db.Column(db.String(512))
@@ -71,6 +103,11 @@ class ConversionJob(db.Model):
     youtube_video_id = db.Column(db.String(32))
     youtube_video_url = db.Column(db.String(512))
     
+    # Cost model inputs: episode length in seconds (from Spotify, replaced by the
+    # probed length of the downloaded audio) and the run time estimated at dispatch
+    duration_seconds = db.Column(db.Float)
+    estimated_seconds = db.Column(db.Float)
+    
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     started_at = db.Column(db.DateTime)
@@ -78,3 +115,122 @@ class ConversionJob(db.Model):
     
     # Error information
     error_message = db.Column(db.Text)
+    
+    # Profile the next run (set with "flask profile-job")
+    profile = db.Column(db.Boolean, default=False, server_default='0')
+    
+    # Relationships
+    config = db.relationship('PodcastConfig', backref='conversion_jobs', lazy=True)
+    
+    __table_args__ = (db.Index('ix_conversion_job_user_created', 'user_id', 'created_at'),)
+
+class JobStage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('conversion_job.id'), nullable=False, index=True)
+    
+    # Stage: queue, download, encode, upload, cleanup
+    stage = db.Column(db.String(20), nullable=False, index=True)
+    
+    # Timing and size
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    completed_at = db.Column(db.DateTime)
+    duration_seconds = db.Column(db.Float)
+    bytes = db.Column(db.BigInteger)
+    succeeded = db.Column(db.Boolean, default=True)
+    
+    # Relationships
+    job = db.relationship('ConversionJob', backref=db.backref('stages', lazy=True, order_by='JobStage.started_at'), lazy=True)
+
+class JobRendition(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('conversion_job.id'), nullable=False, index=True)
+    
+    # Rendition name (e.g. square, vertical) and frame size
+    name = db.Column(db.String(20), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    
+    # Where the video is kept, and its size
+    path = db.Column(db.String(512), nullable=False)
+    bytes = db.Column(db.BigInteger)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    # Relationships
+    job = db.relationship('ConversionJob', backref=db.backref('renditions', lazy=True, order_by='JobRendition.id'), lazy=True)
+
+class JobDailySummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # UTC day the archived jobs were created, and whose they were
+    day = db.Column(db.Date, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    config_id = db.Column(db.Integer, db.ForeignKey('podcast_config.id'))
+    source = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    
+    # Totals over the jobs rolled into this row
+    jobs = db.Column(db.Integer, nullable=False, default=0)
+    episode_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    run_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    encode_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    upload_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    __table_args__ = (db.Index('ix_job_daily_summary_user_day', 'user_id', 'day'),)
+
+class YouTubeQuotaUsage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # Quota is tracked per API project, keyed by its OAuth client ID
+    project = db.Column(db.String(255), nullable=False)
+    
+    # Pacific-time date the units count against (YouTube resets quota at midnight PT)
+    quota_day = db.Column(db.Date, nullable=False)
+    
+    # API call (e.g. videos.insert) and the units it cost
+    call = db.Column(db.String(64), nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_youtube_quota_usage_project_day', 'project', 'quota_day'),)
+
+class ServerSession(db.Model):
+    # SHA-256 of the session ID in the cookie, so the table alone can't be used to hijack sessions
+    id = db.Column(db.String(64), primary_key=True)
+    
+    # Session contents, serialized like Flask's cookie sessions
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class AudioMeasurement(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # Hash of the source audio and the loudness target it was measured against
+    audio_sha256 = db.Column(db.String(64), nullable=False)
+    target = db.Column(db.String(64), nullable=False)
+    
+    # loudnorm's first-pass measurements
+    input_i = db.Column(db.Float, nullable=False)
+    input_tp = db.Column(db.Float, nullable=False)
+    input_lra = db.Column(db.Float, nullable=False)
+    input_thresh = db.Column(db.Float, nullable=False)
+    target_offset = db.Column(db.Float, nullable=False)
+    
+    # Source length and the span left after trimming silence (trim_end is None when nothing is cut from the end)
+    duration = db.Column(db.Float)
+    trim_start = db.Column(db.Float, default=0.0)
+    trim_end = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('audio_sha256', 'target', name='uq_audio_measurement_audio_target'),)
+    
+    def as_dict(self):
+        return {
+            'input_i': self.input_i,
+            'input_tp': self.input_tp,
+            'input_lra': self.input_lra,
+            'input_thresh': self.input_thresh,
+            'target_offset': self.target_offset,
+            'duration': self.duration,
+            'trim_start': self.trim_start or 0.0,
+            'trim_end': self.trim_end
+        }
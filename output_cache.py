@@ -0,0 +1,208 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from config import (
+    OUTPUT_CACHE_DIRECTORY,
+    OUTPUT_CACHE_MAX_BYTES,
+    TITLE_FONT_FILE,
+    SILENCE_THRESHOLD_DB,
+    SILENCE_MIN_SECONDS
+)
+from converter import AUDIO_BITRATE
+from title_cards import RENDER_VERSION, file_digest
+from audio_processing import loudness_target
+from metrics import OUTPUT_CACHE_LOOKUPS, OUTPUT_CACHE_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the encode pipeline changes in a way that alters its output
+OUTPUT_VERSION = 2
+
+def link_or_copy(source, destination):
+    """Hard-link a file when both paths share a filesystem, otherwise copy it."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+class OutputCache:
+    """Encoded videos kept by a hash of everything that determines their content.
+
+    The key covers the source audio, the artwork, the episode title (which
+    is drawn on the title card) and the show's encode and audio settings, so
+    shows that cross-post the same episode with the same settings, and
+    retries of a job whose upload failed, reuse one encode. Each video is
+    stored with the seconds its encode took, which a hit reports as saved.
+    Jobs in this process that want the same video wait for the first
+    encode instead of repeating it. The cache is pruned oldest-first once it
+    grows past OUTPUT_CACHE_MAX_BYTES; a limit of 0 disables it.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or OUTPUT_CACHE_DIRECTORY
+        self.max_bytes = OUTPUT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def cache_keys(self, audio_path, image_path, title, config, sizes):
+        """Return {(width, height): key} identifying each frame size of a show's video of an episode."""
+        audio_digest = file_digest(audio_path)
+        image_digest = file_digest(image_path)
+        keys = {}
+        for width, height in sizes:
+            parts = [
+                str(OUTPUT_VERSION),
+                str(RENDER_VERSION),
+                audio_digest,
+                image_digest,
+                title or '',
+                TITLE_FONT_FILE or '',
+                str(width),
+                str(height),
+                config.video_bitrate or '',
+                config.visualization or 'none',
+                AUDIO_BITRATE,
+                loudness_target() if config.normalize_audio else '',
+                f"{SILENCE_THRESHOLD_DB}:{SILENCE_MIN_SECONDS}" if config.trim_silence else ''
+            ]
+            keys[(width, height)] = hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+        return keys
+
+    def cache_key(self, audio_path, image_path, title, config):
+        """Return the content hash identifying a show's main video of an episode."""
+        size = (config.video_width, config.video_height)
+        return self.cache_keys(audio_path, image_path, title, config, [size])[size]
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp4"), os.path.join(self.cache_dir, f"{key}.json")
+
+    @contextmanager
+    def claim(self, key):
+        """Hold a key while looking it up and encoding, so concurrent jobs for the same video encode it once.
+
+        Yields a CacheClaim; releasing it early (e.g. once the video is
+        stored) lets waiting jobs in before the block ends.
+        """
+        if key is None:
+            yield CacheClaim(self, None, None)
+            return
+
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+        claim = CacheClaim(self, key, entry)
+        try:
+            yield claim
+        finally:
+            claim.release()
+
+    def lookup(self, key):
+        """Return the path of the cached video for a key, or None."""
+        if not self.enabled or key is None:
+            return None
+
+        video_path, meta_path = self._paths(key)
+        if not os.path.exists(video_path):
+            OUTPUT_CACHE_LOOKUPS.inc(result='miss')
+            return None
+
+        # Touch the video so pruning keeps recently used ones
+        os.utime(video_path)
+        OUTPUT_CACHE_LOOKUPS.inc(result='hit')
+        try:
+            with open(meta_path) as f:
+                saved = json.load(f).get('encode_seconds') or 0
+        except (OSError, ValueError):
+            saved = 0
+        OUTPUT_CACHE_SAVED_SECONDS.inc(saved)
+        logger.info("Reusing cached video %s (saves about %.0fs of encoding)", video_path, saved)
+        return video_path
+
+    def store(self, key, video_path, encode_seconds):
+        """Add an encoded video to the cache; failures are logged and otherwise ignored."""
+        if not self.enabled or key is None:
+            return
+
+        cached_path, meta_path = self._paths(key)
+        partial_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex[:8]}.mp4")
+        try:
+            with open(meta_path, 'w') as f:
+                json.dump({'encode_seconds': encode_seconds}, f)
+
+            # The video appears under its final name all at once
+            link_or_copy(video_path, partial_path)
+            os.replace(partial_path, cached_path)
+        except OSError as e:
+            logger.warning("Could not cache video %s: %s", video_path, e)
+            return
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        self.prune()
+
+    def prune(self):
+        """Delete the least recently used videos until the cache fits its size limit."""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.startswith('.') or not entry.name.endswith('.mp4') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    os.remove(os.path.splitext(path)[0] + '.json')
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Failed to prune cached video %s: %s", path, e)
+
+class CacheClaim:
+    """A held cache key. release() may be called from any thread, and more than once."""
+
+    def __init__(self, cache, key, entry):
+        self._cache = cache
+        self._key = key
+        self._entry = entry
+        self._released = entry is None
+
+    def release(self):
+        with self._cache._lock:
+            if self._released:
+                return
+            self._released = True
+            self._entry[0].release()
+            self._entry[1] -= 1
+            if not self._entry[1]:
+                del self._cache._key_locks[self._key]
+
+_output_cache = None
+
+def get_output_cache():
+    """Return the process-wide encoded video cache."""
+    global _output_cache
+
+    if _output_cache is None:
+        _output_cache = OutputCache()
+    return _output_cache
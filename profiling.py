@@ -0,0 +1,262 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import pstats
+import random
+import cProfile
+import logging
+import datetime
+import threading
+import collections
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import (
+    PROFILE_DIRECTORY,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_MODE,
+    PROFILE_SAMPLE_INTERVAL,
+    PROFILE_KEEP
+)
+
+logger = logging.getLogger(__name__)
+
+# Statements and functions listed in a profile's summary
+SUMMARY_TOP = 25
+
+_local = threading.local()
+
+def should_profile(forced=False):
+    """Decide whether to profile a unit of work: always when asked to, otherwise at PROFILE_SAMPLE_RATE."""
+    return forced or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+class _SQLListeners:
+    """SQLAlchemy cursor hooks, attached only while at least one profile is running."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+
+    def acquire(self):
+        with self._lock:
+            if not self._users:
+                event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+                event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if not self._users:
+                event.remove(Engine, 'before_cursor_execute', _before_cursor_execute)
+                event.remove(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+_sql_listeners = _SQLListeners()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'sql', None) is not None:
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = getattr(_local, 'sql', None)
+    starts = conn.info.get('profile_query_start')
+    if stats is None or not starts:
+        return
+
+    entry = stats.setdefault(statement, [0, 0.0])
+    entry[0] += 1
+    entry[1] += time.perf_counter() - starts.pop()
+
+class StackSampler:
+    """Samples one thread's Python stack at an interval.
+
+    Costs almost nothing in the profiled thread, so it suits long jobs, and
+    produces collapsed stacks that flame graph tools read directly.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+    def top(self, limit=SUMMARY_TOP):
+        """Return the functions seen in the most samples, counting each once per sample."""
+        functions = collections.Counter()
+        for stack, count in self.counts.items():
+            for function in set(stack.split(';')):
+                functions[function] += count
+        return [{'function': function, 'samples': count} for function, count in functions.most_common(limit)]
+
+class ProfileSession:
+    """Profile of one job, dispatch tick or request, written to PROFILE_DIRECTORY when stopped.
+
+    Runs cProfile (or the stack sampler when PROFILE_MODE is 'sampling')
+    in the calling thread and counts the SQL statements that thread runs.
+    A thread runs one profile at a time; nested work is part of the outer
+    profile. Each profile is stored as <id>.json, a summary with the
+    slowest statements, plus <id>.prof (cProfile stats) or <id>.folded
+    (sampled stacks).
+    """
+
+    def __init__(self, kind, name, mode=None):
+        self.kind = kind
+        self.name = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(name))[:64] or 'unnamed'
+        self.mode = mode or PROFILE_MODE
+        self.started_at = datetime.datetime.utcnow()
+        self.profile_id = f"{self.started_at:%Y%m%dT%H%M%S}-{kind}-{self.name}-{uuid.uuid4().hex[:8]}"
+        self._profiler = None
+        self._sampler = None
+        self._start = None
+
+    def start(self):
+        _local.active = True
+        _local.sql = self.sql = {}
+        _sql_listeners.acquire()
+        self._start = time.monotonic()
+
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another profiler owns the interpreter (Python 3.12+ allows only one)
+                self._profiler = None
+                self.mode = 'sampling'
+        if self.mode == 'sampling':
+            self._sampler = StackSampler(threading.get_ident()).start()
+        return self
+
+    def stop(self):
+        """Stop profiling, store the results and return the profile ID."""
+        if self._profiler:
+            self._profiler.disable()
+        if self._sampler:
+            self._sampler.stop()
+        duration = time.monotonic() - self._start
+        _sql_listeners.release()
+        _local.sql = None
+        _local.active = False
+
+        try:
+            self._write(duration)
+        except OSError as e:
+            logger.warning("Could not store profile %s: %s", self.profile_id, e)
+            return None
+        prune_profiles()
+        logger.info("Stored %s profile %s (%.2fs, %s queries)", self.kind, self.profile_id, duration,
+                    sum(count for count, _ in self.sql.values()))
+        return self.profile_id
+
+    def _write(self, duration):
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        base = os.path.join(PROFILE_DIRECTORY, self.profile_id)
+
+        statements = sorted(self.sql.items(), key=lambda item: item[1][1], reverse=True)
+        summary = {
+            'id': self.profile_id,
+            'kind': self.kind,
+            'name': self.name,
+            'mode': self.mode,
+            'started_at': self.started_at.isoformat(),
+            'duration_seconds': duration,
+            'sql': {
+                'queries': sum(count for count, _ in self.sql.values()),
+                'seconds': sum(seconds for _, seconds in self.sql.values()),
+                'statements': [
+                    {'statement': statement, 'count': count, 'seconds': seconds}
+                    for statement, (count, seconds) in statements[:SUMMARY_TOP]
+                ]
+            }
+        }
+
+        if self._profiler:
+            self._profiler.dump_stats(f"{base}.prof")
+            report = io.StringIO()
+            pstats.Stats(self._profiler, stream=report).sort_stats('cumulative').print_stats(SUMMARY_TOP)
+            summary['artifact'] = f"{self.profile_id}.prof"
+            summary['report'] = report.getvalue()
+        else:
+            with open(f"{base}.folded", 'w') as f:
+                f.write(self._sampler.folded())
+            summary['artifact'] = f"{self.profile_id}.folded"
+            summary['samples'] = sum(self._sampler.counts.values())
+            summary['top'] = self._sampler.top()
+
+        # The summary is written last; listings only show profiles that have one
+        with open(f"{base}.json", 'w') as f:
+            json.dump(summary, f, indent=2)
+
+@contextmanager
+def profiled(kind, name, enabled):
+    """Profile the block when enabled; otherwise, or inside another profile, do nothing."""
+    if not enabled or getattr(_local, 'active', False):
+        yield None
+        return
+
+    session = ProfileSession(kind, name).start()
+    try:
+        yield session
+    finally:
+        session.stop()
+
+def _summary_paths():
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIRECTORY) if entry.name.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    return sorted(entries, key=lambda entry: entry.name, reverse=True)
+
+def list_profiles():
+    """Return the stored profiles' summaries, newest first, without their reports."""
+    profiles = []
+    for entry in _summary_paths():
+        try:
+            with open(entry.path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summary.pop('report', None)
+        summary.pop('top', None)
+        summary['sql'].pop('statements', None)
+        profiles.append(summary)
+    return profiles
+
+def prune_profiles():
+    """Delete all but the newest PROFILE_KEEP profiles."""
+    for entry in _summary_paths()[PROFILE_KEEP:]:
+        profile_id = entry.name[:-len('.json')]
+        for suffix in ('.json', '.prof', '.folded'):
+            try:
+                os.remove(os.path.join(PROFILE_DIRECTORY, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Failed to prune profile %s: %s", profile_id, e)
@@ -0,0 +1,293 @@
+import ssl
+import time
+import random
+import asyncio
+import logging
+import datetime
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+import httplib2
+from config import (
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    API_RETRIES,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS
+)
+from metrics import CIRCUIT_BREAKER_STATE, CIRCUIT_BREAKER_TRANSITIONS, DEPENDENCY_RETRIES
+
+try:
+    from google.auth.exceptions import TransportError as GoogleAuthTransportError
+except ImportError:  # Only installed alongside the YouTube client libraries
+    GoogleAuthTransportError = None
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: timeouts, rate limiting and server errors
+TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# Failures to get any response at all
+NETWORK_ERRORS = tuple(error for error in (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    httplib2.HttpLib2Error,
+    ConnectionError,
+    TimeoutError,
+    ssl.SSLError,
+    GoogleAuthTransportError
+) if error is not None)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# Gauge values for each state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, message, dependency, retry_at):
+        super().__init__(message)
+        self.dependency = dependency
+        self.retry_at = retry_at
+
+def parse_retry_after(value):
+    """Return the seconds a Retry-After header asks to wait (delta-seconds or HTTP date), or None."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+def classify_error(error):
+    """Return (transient, status, retry_after) for a failed call.
+
+    Understands requests and googleapiclient errors and plain network
+    errors; other errors can describe themselves with `transient` and
+    `retry_after` attributes. status is None when no response was received.
+    """
+    if hasattr(error, 'transient'):
+        return error.transient, getattr(error, 'status', None), getattr(error, 'retry_after', None)
+
+    response = getattr(error, 'response', None)  # requests
+    if response is not None and hasattr(response, 'status_code'):
+        status, retry_after = response.status_code, response.headers.get('Retry-After')
+    else:
+        resp = getattr(error, 'resp', None)  # googleapiclient, whose httplib2 headers are lower-case
+        if resp is None or not hasattr(resp, 'status'):
+            return isinstance(error, NETWORK_ERRORS), None, None
+        status, retry_after = resp.status, resp.get('retry-after')
+
+    return status in TRANSIENT_STATUSES, status, parse_retry_after(retry_after)
+
+def backoff_delay(attempt, retry_after=None):
+    """Return the seconds to wait before retrying, or None if the wait is too long to sleep through.
+
+    Without a Retry-After, the wait doubles per attempt from RETRY_BASE_DELAY
+    up to RETRY_MAX_DELAY, with jitter so clients that failed together
+    don't retry together.
+    """
+    if retry_after is not None:
+        if retry_after > RETRY_MAX_DELAY:
+            return None
+        return retry_after + random.uniform(0, RETRY_BASE_DELAY)
+
+    ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+class CircuitBreaker:
+    """Stops calls to a dependency that keeps failing, so work that needs it can wait instead.
+
+    After BREAKER_FAILURE_THRESHOLD consecutive transient failures, or a
+    Retry-After too long to wait out, the breaker opens: calls fail fast with
+    CircuitOpenError for BREAKER_RESET_SECONDS, or until the Retry-After
+    ends if that is later. It then goes half-open and lets one trial call
+    through. Success closes it, and failure opens it again. Breakers are
+    per process, and a dependency may have one per credential (key), so one
+    account being throttled doesn't hold back the others.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_seconds=None, key=None):
+        self.name = name
+        self.key = key
+        self.failure_threshold = failure_threshold or BREAKER_FAILURE_THRESHOLD
+        self.reset_seconds = BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        if key is None:
+            CIRCUIT_BREAKER_STATE.set(STATE_VALUES[CLOSED], dependency=name)
+
+    def __str__(self):
+        return self.name if self.key is None else f"{self.name} ({self.key})"
+
+    def _transition(self, state):
+        # Called with the lock held
+        if state == self._state:
+            return
+        self._state = state
+        _publish_state(self.name)
+        CIRCUIT_BREAKER_TRANSITIONS.inc(dependency=self.name, state=state)
+        if state == OPEN:
+            logger.warning("Circuit breaker for %s opened for %.0fs after %s failures",
+                           self, self._open_until - time.time(), self._failures)
+        else:
+            logger.info("Circuit breaker for %s is %s", self, state.replace('_', '-'))
+
+    def _current_state(self):
+        # Called with the lock held
+        if self._state == OPEN and time.time() >= self._open_until:
+            self._trial_in_flight = False
+            self._transition(HALF_OPEN)
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def is_open(self):
+        return self.state == OPEN
+
+    def open_error(self):
+        """Return the CircuitOpenError for this breaker, with when it will let a trial call through."""
+        retry_at = datetime.datetime.utcfromtimestamp(max(self._open_until, time.time()))
+        return CircuitOpenError(
+            f"{self.name} is unavailable; retrying after {retry_at.strftime('%Y-%m-%d %H:%M:%S')} UTC",
+            self.name, retry_at
+        )
+
+    def raise_if_open(self):
+        """Raise CircuitOpenError while the breaker is open, without using up a half-open trial."""
+        with self._lock:
+            if self._current_state() == OPEN:
+                raise self.open_error()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._trial_in_flight):
+                raise self.open_error()
+            if state == HALF_OPEN:
+                self._trial_in_flight = True
+
+    def record_success(self):
+        """Record that the dependency answered, even if only with a non-transient error."""
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            self._transition(CLOSED)
+
+    def record_failure(self, retry_after=None):
+        """Record a transient failure, opening the breaker if it's one too many."""
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            long_wait = retry_after is not None and retry_after > RETRY_MAX_DELAY
+            if long_wait or self._failures >= self.failure_threshold or self._state == HALF_OPEN:
+                self._open_until = time.time() + max(self.reset_seconds, retry_after or 0)
+                self._transition(OPEN)
+                return True
+            return False
+
+    def cancel(self):
+        """Record a call that failed before reaching the dependency."""
+        with self._lock:
+            self._trial_in_flight = False
+
+BREAKERS = {(name, None): CircuitBreaker(name) for name in ('spotify', 'youtube')}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name, key=None):
+    """Return the circuit breaker of a dependency ('spotify' or 'youtube') for a credential.
+
+    Without a key this is the dependency's shared breaker. Keyed breakers are
+    created on first use and last for the life of the process.
+    """
+    with _breakers_lock:
+        breaker = BREAKERS.get((name, key))
+        if breaker is None:
+            if (name, None) not in BREAKERS:
+                raise KeyError(name)
+            breaker = BREAKERS[(name, key)] = CircuitBreaker(name, key=key)
+        return breaker
+
+def _publish_state(name):
+    """Report the worst state among a dependency's breakers as its gauge value."""
+    with _breakers_lock:
+        breakers = [breaker for (dependency, _), breaker in BREAKERS.items() if dependency == name]
+    CIRCUIT_BREAKER_STATE.set(max(STATE_VALUES[breaker._state] for breaker in breakers), dependency=name)
+
+def _after_failure(breaker, error, attempt, retries, on_retry=None):
+    """Record a failed call and return the delay before retrying it, or None to give up."""
+    transient, status, retry_after = classify_error(error)
+    if not transient:
+        if status is None:
+            breaker.cancel()
+        else:
+            breaker.record_success()
+        return None
+
+    if breaker.record_failure(retry_after):
+        raise breaker.open_error() from error
+    if attempt >= retries:
+        return None
+
+    delay = backoff_delay(attempt, retry_after)
+    if delay is not None:
+        DEPENDENCY_RETRIES.inc(dependency=breaker.name)
+        if on_retry:
+            on_retry()
+        logger.warning("Call to %s failed (%s); retry %s of %s in %.1fs", breaker, error, attempt + 1, retries, delay)
+    return delay
+
+def call_with_retries(breaker, call, retries=API_RETRIES, on_retry=None):
+    """Call a dependency through its circuit breaker, retrying transient failures with backoff.
+
+    on_retry, if given, is called before each retry.
+    """
+    for attempt in itertools.count():
+        breaker.before_call()
+        try:
+            result = call()
+        except Exception as e:
+            delay = _after_failure(breaker, e, attempt, retries, on_retry)
+            if delay is None:
+                raise
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+async def call_with_retries_async(breaker, call, retries=API_RETRIES, on_retry=None):
+    """Like call_with_retries, for a coroutine function; waits without blocking the event loop."""
+    for attempt in itertools.count():
+        breaker.before_call()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            breaker.cancel()
+            raise
+        except Exception as e:
+            delay = _after_failure(breaker, e, attempt, retries, on_retry)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
@@ -0,0 +1,224 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import logging
+import datetime
+from config import (
+    JOB_RETENTION_DAYS,
+    JOB_ARCHIVE_DIRECTORY,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_PAUSE,
+    ERROR_MESSAGE_MAX_CHARS
+)
+from job_stats import WINDOWS
+
+logger = logging.getLogger(__name__)
+
+# Only jobs that can no longer change are archived
+FINISHED_STATUSES = ('completed', 'failed')
+
+def truncate_error(message, limit=ERROR_MESSAGE_MAX_CHARS):
+    """Shorten a job's error message to at most limit characters.
+
+    The start says what failed and the end holds the cause (FFmpeg reports
+    its error last), so the middle is dropped. The full text is still in
+    the log line written when the job failed.
+    """
+    if message is None or len(message) <= limit:
+        return message
+
+    marker = f"\n[... {len(message) - limit} characters truncated ...]\n"
+    keep = max(limit - len(marker), 0)
+    head = keep // 4
+    return message[:head] + marker + message[len(message) - (keep - head):]
+
+def retention_cutoff(now=None):
+    """Return the creation time before which finished jobs are archived, or None to keep them all."""
+    if JOB_RETENTION_DAYS <= 0:
+        return None
+
+    # Jobs inside the longest stats window stay, so its percentiles remain exact
+    keep = max(datetime.timedelta(days=JOB_RETENTION_DAYS), max(WINDOWS.values()))
+    return (now or datetime.datetime.utcnow()) - keep
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+def _row_record(row):
+    return {column.name: _json_value(getattr(row, column.key)) for column in row.__table__.columns}
+
+def _job_record(job):
+    record = _row_record(job)
+    record['stages'] = [_row_record(stage) for stage in job.stages]
+    record['renditions'] = [_row_record(rendition) for rendition in job.renditions]
+    return record
+
+def _summary_totals(jobs):
+    """Return {(day, user_id, config_id, source, status): totals} for a batch of jobs."""
+    totals = {}
+    for job in jobs:
+        key = (job.created_at.date(), job.user_id, job.config_id, job.source or 'release', job.status)
+        entry = totals.setdefault(key, {
+            'jobs': 0, 'episode_seconds': 0.0, 'run_seconds': 0.0, 'encode_seconds': 0.0, 'upload_bytes': 0
+        })
+        entry['jobs'] += 1
+        entry['episode_seconds'] += job.duration_seconds or 0.0
+        if job.started_at and job.completed_at:
+            entry['run_seconds'] += max((job.completed_at - job.started_at).total_seconds(), 0.0)
+        for stage in job.stages:
+            if not stage.succeeded:
+                continue
+            if stage.stage == 'encode':
+                entry['encode_seconds'] += stage.duration_seconds or 0.0
+            elif stage.stage == 'upload':
+                entry['upload_bytes'] += stage.bytes or 0
+    return totals
+
+def _add_to_summaries(totals):
+    from app import db
+    from models import JobDailySummary
+
+    for (day, user_id, config_id, source, status), entry in totals.items():
+        summary = JobDailySummary.query.filter(
+            JobDailySummary.day == day,
+            JobDailySummary.user_id == user_id,
+            JobDailySummary.config_id.is_(None) if config_id is None else JobDailySummary.config_id == config_id,
+            JobDailySummary.source == source,
+            JobDailySummary.status == status
+        ).first()
+        if summary is None:
+            summary = JobDailySummary(day=day, user_id=user_id, config_id=config_id, source=source, status=status,
+                                      jobs=0, episode_seconds=0.0, run_seconds=0.0, encode_seconds=0.0, upload_bytes=0)
+            db.session.add(summary)
+        for field, value in entry.items():
+            setattr(summary, field, getattr(summary, field) + value)
+
+def _write_archive(jobs):
+    """Write a batch of jobs, with their stages and renditions, to a gzipped JSON-lines file."""
+    os.makedirs(JOB_ARCHIVE_DIRECTORY, exist_ok=True)
+    path = os.path.join(
+        JOB_ARCHIVE_DIRECTORY,
+        f"jobs-{datetime.datetime.utcnow():%Y%m%d}-{jobs[0].id}-{jobs[-1].id}.jsonl.gz"
+    )
+    partial_path = f"{path}.partial"
+    try:
+        with gzip.open(partial_path, 'wt', encoding='utf-8') as f:
+            for job in jobs:
+                f.write(json.dumps(_job_record(job)) + '\n')
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return path
+
+def archive_job_batch(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    """Archive up to batch_size finished jobs created before cutoff and return how many were archived.
+
+    The archive file is written first; the jobs are then rolled into their
+    daily summaries and deleted in one transaction. If that transaction
+    fails, or another process archived some of the same jobs first, it is
+    rolled back and the file removed, so every job is counted exactly once.
+    """
+    from app import db
+    from models import ConversionJob, JobStage, JobRendition
+
+    jobs = ConversionJob.query.filter(
+        ConversionJob.status.in_(FINISHED_STATUSES),
+        ConversionJob.created_at < cutoff
+    ).options(
+        db.selectinload(ConversionJob.stages), db.selectinload(ConversionJob.renditions)
+    ).order_by(ConversionJob.id).limit(batch_size).all()
+    if not jobs:
+        return 0
+
+    job_ids = [job.id for job in jobs]
+    rendition_dirs = {os.path.dirname(rendition.path) for job in jobs for rendition in job.renditions}
+    path = _write_archive(jobs)
+    try:
+        _add_to_summaries(_summary_totals(jobs))
+        JobStage.query.filter(JobStage.job_id.in_(job_ids)).delete(synchronize_session=False)
+        JobRendition.query.filter(JobRendition.job_id.in_(job_ids)).delete(synchronize_session=False)
+        deleted = ConversionJob.query.filter(ConversionJob.id.in_(job_ids)).delete(synchronize_session=False)
+        if deleted != len(job_ids):
+            raise RuntimeError(f"{len(job_ids) - deleted} of the jobs were already archived elsewhere")
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        os.remove(path)
+        logger.error("Error archiving jobs %s to %s: %s", job_ids[0], job_ids[-1], e)
+        raise
+
+    # Kept renditions go with their jobs
+    for rendition_dir in rendition_dirs:
+        shutil.rmtree(rendition_dir, ignore_errors=True)
+
+    logger.info("Archived %s jobs to %s", len(job_ids), path)
+    return len(job_ids)
+
+def compact_error_batch(batch_size=RETENTION_BATCH_SIZE):
+    """Truncate up to batch_size oversized job error messages and return how many were changed."""
+    from app import db
+    from models import ConversionJob
+
+    rows = (
+        db.session.query(ConversionJob.id, ConversionJob.error_message)
+        .filter(db.func.length(ConversionJob.error_message) > ERROR_MESSAGE_MAX_CHARS)
+        .order_by(ConversionJob.id)
+        .limit(batch_size)
+        .all()
+    )
+    for job_id, message in rows:
+        ConversionJob.query.filter_by(id=job_id).update(
+            {'error_message': truncate_error(message)}, synchronize_session=False)
+    db.session.commit()
+    return len(rows)
+
+def run_retention(batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_BATCH_PAUSE):
+    """Compact oversized error messages, then archive finished jobs past retention.
+
+    Work is done in batches of batch_size rows, each in its own short
+    transaction, with a pause between batches so request handling and the
+    job queue are never held up behind it. Returns (compacted, archived).
+    """
+    compacted = archived = 0
+
+    while True:
+        count = compact_error_batch(batch_size)
+        compacted += count
+        if count < batch_size:
+            break
+        time.sleep(pause)
+
+    cutoff = retention_cutoff()
+    while cutoff is not None:
+        count = archive_job_batch(cutoff, batch_size)
+        archived += count
+        if count < batch_size:
+            break
+        time.sleep(pause)
+
+    return compacted, archived
+
+def archived_job_counts(user_id=None, config_ids=None, source=None):
+    """Return {(config_id, status): jobs} from the daily summaries of archived jobs."""
+    from app import db
+    from models import JobDailySummary
+
+    query = db.session.query(
+        JobDailySummary.config_id, JobDailySummary.status, db.func.sum(JobDailySummary.jobs)
+    )
+    if user_id is not None:
+        query = query.filter(JobDailySummary.user_id == user_id)
+    if config_ids is not None:
+        query = query.filter(JobDailySummary.config_id.in_(config_ids))
+    if source is not None:
+        query = query.filter(JobDailySummary.source == source)
+
+    return {
+        (config_id, status): int(count)
+        for config_id, status, count in query.group_by(JobDailySummary.config_id, JobDailySummary.status)
+    }
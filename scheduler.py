@@ -1,12 +1,29 @@
+import os
+import time
 import logging
 import datetime
+import threading
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.base import JobLookupError
 from spotify_client import SpotifyClient
+from feed_client import in_feed_grace_period
 from youtube_client import YouTubeClient
-from converter import AudioToVideoConverter
-from config import DEFAULT_CHECK_INTERVAL
+from converter import AudioToVideoConverter, probe_duration, rendition_sizes
+from cost_model import get_cost_model
+from output_cache import get_output_cache, link_or_copy
+from workspace import get_workspace_manager, QuotaExceededError, MEDIUM_RAM, MEDIUM_DISK
+from youtube_quota import YouTubeQuotaExceededError, UPLOAD_COST
+from config import DEFAULT_CHECK_INTERVAL, TEMP_SWEEP_INTERVAL, TEMP_DEFER_BASE_DELAY, TEMP_DEFER_MAX_DELAY, SESSION_PURGE_INTERVAL, RETENTION_INTERVAL, PRIORITY_RETRY, STREAMING_UPLOAD, RENDITION_DIRECTORY
+from logging_config import correlation_context
+from job_stats import record_stage, record_stage_span, record_queue_wait
+from job_queue import init_job_queue, wake_job_queue
+from discovery import init_discovery_engine, get_discovery_engine
+from retention import run_retention, truncate_error
+from profiling import profiled, should_profile
+from resilience import CircuitOpenError
+from metrics import EPISODES_DISCOVERED, JOBS_FINISHED, JOB_DURATION
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +31,7 @@ scheduler = None
 
 def init_scheduler(app):
     """Initialize the APScheduler for background tasks."""
-    global scheduler
+    global scheduler, registry
     
     try:
         logger.info("Initializing scheduler...")
@@ -28,110 +45,317 @@ def init_scheduler(app):
         scheduler.start()
         logger.info("Scheduler started successfully.")
         
-        # Schedule jobs for all active podcast configurations
+        # Clear out anything left in the temp directory by a previous crash,
+        # then keep sweeping periodically
+        sweep_temp_directory()
+        scheduler.add_job(
+            sweep_temp_directory,
+            IntervalTrigger(minutes=TEMP_SWEEP_INTERVAL),
+            id="temp_directory_sweep",
+            replace_existing=True
+        )
+        scheduler.add_job(
+            purge_sessions,
+            IntervalTrigger(minutes=SESSION_PURGE_INTERVAL),
+            id="session_purge",
+            replace_existing=True
+        )
+        scheduler.add_job(
+            archive_old_jobs,
+            IntervalTrigger(minutes=RETENTION_INTERVAL),
+            id="job_retention",
+            replace_existing=True
+        )
+        
+        # Start the workers that run queued episode jobs, and the engine that finds new episodes
+        job_queue = init_job_queue(app)
+        discovery_engine = init_discovery_engine(app)
+        
+        # Bring the stored podcast check jobs in line with the configured shows
+        registry = ScheduleRegistry(scheduler)
         with app.app_context():
+            from app import db
             from models import PodcastConfig
-            configs = PodcastConfig.query.all()
-            
-            for config in configs:
-                schedule_podcast_check(config)
+            intervals = {
+                config_id: check_interval or DEFAULT_CHECK_INTERVAL
+                for config_id, check_interval in db.session.query(PodcastConfig.id, PodcastConfig.check_interval)
+            }
+            added, rescheduled, removed = registry.reconcile(intervals)
+            logger.info("Podcast checks reconciled: %s added, %s rescheduled, %s removed, %s unchanged",
+                        added, rescheduled, removed, len(intervals) - added - rescheduled)
         
         # Register shutdown handler
         import atexit
         
         @atexit.register
         def shutdown_scheduler():
+            job_queue.stop()
+            discovery_engine.stop()
             if scheduler and scheduler.running:
                 logger.info("Shutting down scheduler...")
                 scheduler.shutdown()
     except Exception as e:
-        logger.error(f"Error initializing scheduler: {str(e)}")
+        logger.error("Error initializing scheduler: %s", e)
         raise
 
-def schedule_podcast_check(config):
-    """Schedule a regular check for new podcast episodes."""
-    global scheduler
+def podcast_check_job_id(config_id):
+    """Return the scheduler job ID of a show's podcast check."""
+    return f"podcast_check_{config_id}"
+
+class ScheduleRegistry:
+    """Keeps each show's podcast check job in step with its configuration.
+    
+    The registry remembers the interval every show is scheduled at, keyed by
+    config ID, so jobs are added, rescheduled and removed by ID without
+    reading the job store. Only reconcile() reads it, once, at startup.
+    """
+    
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._intervals = {}
+        self._lock = threading.Lock()
+    
+    def _add(self, config_id, interval_minutes):
+        self.scheduler.add_job(
+            queue_podcast_check,
+            IntervalTrigger(minutes=interval_minutes),
+            id=podcast_check_job_id(config_id),
+            args=[config_id],
+            replace_existing=True
+        )
     
-    if not scheduler:
+    def schedule(self, config_id, interval_minutes):
+        """Schedule a show's check, or move it to a new interval. Returns False if nothing changed."""
+        with self._lock:
+            current = self._intervals.get(config_id)
+            if current == interval_minutes:
+                return False
+            
+            if current is None:
+                self._add(config_id, interval_minutes)
+            else:
+                try:
+                    self.scheduler.reschedule_job(podcast_check_job_id(config_id),
+                                                  trigger=IntervalTrigger(minutes=interval_minutes))
+                except JobLookupError:
+                    # Removed behind the registry's back; put it back
+                    self._add(config_id, interval_minutes)
+            self._intervals[config_id] = interval_minutes
+            return True
+    
+    def unschedule(self, config_id):
+        """Stop checking a show."""
+        with self._lock:
+            self._intervals.pop(config_id, None)
+            try:
+                self.scheduler.remove_job(podcast_check_job_id(config_id))
+            except JobLookupError:
+                pass
+    
+    def reconcile(self, intervals):
+        """Make the job store match {config_id: interval_minutes} in one pass over its jobs.
+        
+        Jobs for deleted shows are removed, missing ones are added and jobs
+        whose interval changed are rescheduled. Jobs that already match keep
+        their next run time, so a restart doesn't delay or bunch up checks.
+        Returns (added, rescheduled, removed) counts.
+        """
+        with self._lock:
+            existing = {}
+            for job in self.scheduler.get_jobs():
+                if job.id.startswith('podcast_check_'):
+                    existing[job.id] = job
+            
+            added = rescheduled = removed = 0
+            for config_id, interval_minutes in intervals.items():
+                job = existing.pop(podcast_check_job_id(config_id), None)
+                if job is None or job.func is not queue_podcast_check:
+                    self._add(config_id, interval_minutes)
+                    added += 1
+                elif not isinstance(job.trigger, IntervalTrigger) or \
+                        job.trigger.interval != datetime.timedelta(minutes=interval_minutes):
+                    job.reschedule(IntervalTrigger(minutes=interval_minutes))
+                    rescheduled += 1
+            
+            # Whatever is left belongs to shows that no longer exist
+            for job in existing.values():
+                job.remove()
+                removed += 1
+            
+            self._intervals = dict(intervals)
+            return added, rescheduled, removed
+
+registry = None
+
+def schedule_podcast_check(config):
+    """Schedule a regular check for new podcast episodes, or update it after a settings change."""
+    if not registry:
         logger.error("Scheduler not initialized.")
         return False
     
-    # Remove any existing jobs for this config
-    for job in scheduler.get_jobs():
-        if job.id == f"podcast_check_{config.id}":
-            job.remove()
-    
-    # Schedule a new job
     interval_minutes = config.check_interval or DEFAULT_CHECK_INTERVAL
+    if registry.schedule(config.id, interval_minutes):
+        logger.info("Scheduled podcast check for config %s every %s minutes", config.id, interval_minutes)
+    return True
+
+def unschedule_podcast_check(config_id):
+    """Stop the regular check of a deleted show."""
+    if not registry:
+        logger.error("Scheduler not initialized.")
+        return False
     
-    scheduler.add_job(
-        check_and_process_new_episodes,
-        IntervalTrigger(minutes=interval_minutes),
-        id=f"podcast_check_{config.id}",
-        args=[config.id],
-        replace_existing=True
-    )
-    
-    logger.info(f"Scheduled podcast check for config {config.id} every {interval_minutes} minutes")
+    registry.unschedule(config_id)
+    logger.info("Unscheduled podcast check for config %s", config_id)
     return True
 
+def sweep_temp_directory():
+    """Remove orphaned job workspaces from the temp directory."""
+    try:
+        removed = get_workspace_manager().sweep_orphans()
+        if removed:
+            logger.info("Temp directory sweep removed %s orphaned entries", removed)
+        return removed
+    except Exception as e:
+        logger.error("Error sweeping temp directory: %s", e)
+        return 0
+
+def purge_sessions():
+    """Delete expired server-side sessions."""
+    from app import app
+    from session_store import purge_expired_sessions
+    
+    try:
+        with app.app_context():
+            removed = purge_expired_sessions()
+        if removed:
+            logger.info("Purged %s expired sessions", removed)
+        return removed
+    except Exception as e:
+        logger.error("Error purging expired sessions: %s", e)
+        return 0
+
+def archive_old_jobs():
+    """Compact job error messages and archive finished jobs past retention."""
+    from app import app
+    
+    try:
+        with app.app_context():
+            compacted, archived = run_retention()
+        if compacted or archived:
+            logger.info("Retention truncated %s error messages and archived %s jobs", compacted, archived)
+        return archived
+    except Exception as e:
+        logger.error("Error running job retention: %s", e)
+        return 0
+
+def queue_podcast_check(config_id):
+    """Scheduled job: hand a show's check to the discovery engine without waiting for it."""
+    get_discovery_engine().submit(config_id)
+
 def check_and_process_new_episodes(config_id):
-    """Check for new podcast episodes and process them."""
-    from app import app, db
+    """Check for new podcast episodes and queue them; returns how many were found."""
+    return get_discovery_engine().check(config_id)
+
+def begin_discovery(config_id):
+    """Stamp a show's check time and return what's needed to poll Spotify, or None if it can't be polled."""
+    from app import db
+    from models import PodcastConfig
+    
+    # Get the podcast configuration
+    config = PodcastConfig.query.get(config_id)
+    
+    if not config or not config.spotify_podcast_id:
+        logger.warning("Invalid podcast configuration for ID %s", config_id)
+        return None
+    
+    # Update last check timestamp
+    config.last_check = datetime.datetime.utcnow()
+    db.session.commit()
+    
+    # Check if we have Spotify credentials
+    if not config.spotify_client_id or not config.spotify_client_secret:
+        logger.warning("Spotify API credentials not configured for config ID %s", config_id)
+        return None
+    
+    return {
+        'spotify_podcast_id': config.spotify_podcast_id,
+        'spotify_client_id': config.spotify_client_id,
+        'spotify_client_secret': config.spotify_client_secret,
+        'rss_feed_url': config.rss_feed_url
+    }
+
+def _unprocessed_episodes(config_id, episodes_data):
+    """Return the listed episodes that haven't been processed for a show yet."""
+    from app import db
+    from models import ProcessedEpisode
+    
+    episodes = [episode for episode in (episodes_data or {}).get('items') or [] if episode]
+    if not episodes:
+        return []
+    
+    # Look up which of the listed episodes were already processed in one query
+    processed_ids = {
+        episode_id for (episode_id,) in
+        db.session.query(ProcessedEpisode.episode_id).filter(
+            ProcessedEpisode.config_id == config_id,
+            ProcessedEpisode.episode_id.in_([episode['id'] for episode in episodes])
+        )
+    }
+    return [episode for episode in episodes if episode['id'] not in processed_ids]
+
+def has_new_episodes(config_id, episodes_data):
+    """Return True if any listed episode hasn't been processed yet, so the show's feed is worth polling."""
+    return bool(_unprocessed_episodes(config_id, episodes_data))
+
+def record_new_episodes(config_id, episodes_data, feed_index=None):
+    """Create jobs for episodes not seen before and wake the job queue; returns how many were new.
+    
+    Full-length audio is taken from feed_index, the show's feed as already
+    fetched by the caller, so no network request is made here.
+    """
+    from app import db
     from models import PodcastConfig, ProcessedEpisode, ConversionJob
     
-    with app.app_context():
+    with correlation_context(config_id=config_id):
         try:
-            # Get the podcast configuration
             config = PodcastConfig.query.get(config_id)
-            
-            if not config or not config.spotify_podcast_id:
-                logger.warning(f"Invalid podcast configuration for ID {config_id}")
-                return 0
-            
-            # Update last check timestamp
-            config.last_check = datetime.datetime.utcnow()
-            db.session.commit()
-            
-            # Check if we have Spotify credentials
-            if not config.spotify_client_id or not config.spotify_client_secret:
-                logger.warning(f"Spotify API credentials not configured for config ID {config_id}")
+            if not config:
                 return 0
-                
-            # Initialize clients with credentials from the database
-            spotify_client = SpotifyClient(
-                client_id=config.spotify_client_id,
-                client_secret=config.spotify_client_secret
-            )
-            
-            # Get latest episodes
-            episodes_data = spotify_client.get_podcast_episodes(config.spotify_podcast_id)
             
             if not episodes_data or 'items' not in episodes_data:
-                logger.warning(f"No episodes found for podcast {config.spotify_podcast_id}")
+                logger.warning("No episodes found for podcast %s", config.spotify_podcast_id)
                 return 0
             
             # Process new episodes
             new_episodes_count = 0
+            seen_ids = set()
             
-            for episode in episodes_data['items']:
-                # Check if we've already processed this episode
-                existing = ProcessedEpisode.query.filter_by(
-                    config_id=config.id, 
-                    episode_id=episode['id']
-                ).first()
-                
-                if existing:
-                    # Episode already processed
+            for episode in _unprocessed_episodes(config.id, episodes_data):
+                if episode['id'] in seen_ids:
                     continue
+                seen_ids.add(episode['id'])
+                
+                # Spotify only offers a preview clip; take the full audio from the show's feed
+                audio_url = episode.get('audio_preview_url', '')
+                if config.rss_feed_url:
+                    item = feed_index.match(episode) if feed_index else None
+                    if item:
+                        audio_url = item.enclosure_url
+                    elif in_feed_grace_period(episode):
+                        logger.info("Episode %s is not in the feed yet; checking again next time", episode['id'])
+                        continue
+                    else:
+                        logger.warning("Episode %s not found in the feed; using Spotify's preview audio", episode['id'])
                 
                 # Create a new job for this episode
                 job = ConversionJob(
                     user_id=config.user_id,
+                    config_id=config.id,
                     episode_id=episode['id'],
                     status='pending',
                     episode_title=episode['name'],
-                    audio_url=episode.get('audio_preview_url', '')
+                    audio_url=audio_url,
+                    duration_seconds=episode['duration_ms'] / 1000 if episode.get('duration_ms') else None
                 )
                 
                 db.session.add(job)
@@ -148,51 +372,284 @@ def check_and_process_new_episodes(config_id):
                 db.session.add(processed)
                 db.session.commit()
                 
-                # Process the episode asynchronously
-                process_episode_job(job.id)
-                
+                EPISODES_DISCOVERED.inc()
                 new_episodes_count += 1
             
+            # Hand the new jobs to the queue workers; releases run ahead of retries and backfill
+            if new_episodes_count:
+                wake_job_queue()
+            
             return new_episodes_count
         except Exception as e:
-            logger.error(f"Error checking for new episodes: {str(e)}")
+            logger.error("Error recording new episodes: %s", e)
             raise
 
+def _record_job_outcome(job, status):
+    """Count a finished job attempt and how long it took."""
+    JOBS_FINISHED.inc(status=status)
+    if job.started_at:
+        elapsed = (datetime.datetime.utcnow() - job.started_at).total_seconds()
+        JOB_DURATION.observe(elapsed, status=status)
+
+def _keep_renditions(job, renditions, paths):
+    """Copy a job's extra renditions out of its workspace and record them for download."""
+    from app import db
+    from models import JobRendition
+    
+    # A retry replaces what an earlier attempt kept
+    for rendition in JobRendition.query.filter_by(job_id=job.id).all():
+        if os.path.exists(rendition.path):
+            os.remove(rendition.path)
+        db.session.delete(rendition)
+    
+    if renditions:
+        job_directory = os.path.join(RENDITION_DIRECTORY, f"job-{job.id}")
+        os.makedirs(job_directory, exist_ok=True)
+    for name, width, height in renditions:
+        path = os.path.join(job_directory, f"{name}.mp4")
+        link_or_copy(paths[name], path)
+        db.session.add(JobRendition(job_id=job.id, name=name, width=width, height=height,
+                                    path=path, bytes=os.path.getsize(path)))
+    db.session.commit()
+
+def _set_thumbnail(youtube_client, video_id, thumbnail_path):
+    """Set an uploaded video's thumbnail; a missing one (e.g. an unverified channel) doesn't fail the job."""
+    if not thumbnail_path:
+        return
+    try:
+        youtube_client.update_video_thumbnail(video_id, thumbnail_path)
+    except Exception as e:
+        logger.warning("Could not set thumbnail for video %s: %s", video_id, e)
+
+def _stream_encode_and_upload(job, config, converter, youtube_client, audio_path, image_path, description, thumbnail_path,
+                              on_encoded=None):
+    """Encode to fragmented MP4 while uploading it, returning (video_path, upload_result, encode_seconds).
+    
+    The encode and upload stages overlap, so each is recorded with its own
+    start time. The upload's bytes aren't recorded: it's paced by the
+    encoder, so its rate says nothing about the uplink. If either side
+    fails the other is stopped, and a failed encode never completes the
+    upload. on_encoded(video_path, encode_seconds) is called from the
+    encoder's thread as soon as the video is final, before the upload ends.
+    """
+    encode_started_at = datetime.datetime.utcnow()
+    encode_start = time.monotonic()
+    audio_seconds = 0.0
+    encode = upload_started_at = None
+    uploaded = False
+    try:
+        # Loudness and silence are applied in one audio pass ahead of the video encode
+        processed_path = converter.process_audio(
+            audio_path,
+            normalize=config.normalize_audio,
+            trim=config.trim_silence
+        )
+        audio_seconds = time.monotonic() - encode_start
+        encode = converter.start_streaming_encode(
+            processed_path,
+            image_path,
+            width=config.video_width,
+            height=config.video_height,
+            bitrate=config.video_bitrate,
+            title=job.episode_title,
+            copy_audio=processed_path != audio_path,
+            on_success=on_encoded and (lambda encode: on_encoded(encode.output_path, audio_seconds + encode.elapsed))
+        )
+        
+        upload_started_at = datetime.datetime.utcnow()
+        upload_start = time.monotonic()
+        upload_result = youtube_client.upload_video(
+            video_path=encode.output_path,
+            title=job.episode_title,
+            description=description,
+            tags=["podcast", "audio"],
+            privacy_status="public",
+            stream=encode
+        )
+        _set_thumbnail(youtube_client, upload_result['id'], thumbnail_path)
+        uploaded = True
+        
+        encode.wait()
+        return encode.output_path, upload_result, audio_seconds + encode.elapsed
+    finally:
+        if encode:
+            encode.abort()
+        encode_seconds = audio_seconds + encode.elapsed if encode else time.monotonic() - encode_start
+        record_stage_span(job, 'encode', encode_started_at, encode_seconds,
+                          nbytes=encode.bytes_written if encode else None,
+                          succeeded=bool(encode and encode.done and not encode.error))
+        if upload_started_at:
+            record_stage_span(job, 'upload', upload_started_at, time.monotonic() - upload_start, succeeded=uploaded)
+
+def _convert_and_upload(job, config, youtube_client, workspace, logo_url):
+    """Download, encode and upload a job's episode inside its workspace, returning the upload result."""
+    from app import db
+    
+    converter = AudioToVideoConverter(workspace=workspace)
+    
+    # Each stage is timed and stored on the job for the history breakdown
+    with record_stage(job, 'download') as stage:
+        audio_path = converter.download_audio(job.audio_url)
+        image_path = converter.download_image(logo_url)
+        stage.bytes = os.path.getsize(audio_path) + os.path.getsize(image_path)
+
+    # Record the length of the audio actually being converted, which the
+    # cost model relates to encode time
+    probed = probe_duration(audio_path)
+    if probed:
+        job.duration_seconds = probed
+        db.session.commit()
+    
+    thumbnail_path = converter.render_thumbnail(image_path, job.episode_title)
+    video_description = f"Listen to the full podcast at {config.spotify_podcast_id}"
+    upload_result = None
+    
+    # The main video plus any extra aspect ratios the show publishes (not drawn for visualizations)
+    main_size = (config.video_width, config.video_height)
+    renditions = [('main', *main_size)]
+    if config.visualization in (None, 'none'):
+        renditions += rendition_sizes(config.renditions, exclude=main_size)
+    
+    # Identical inputs and settings (a cross-posted episode, or a retry) reuse an earlier encode
+    output_cache = get_output_cache()
+    cache_keys = output_cache.cache_keys(audio_path, image_path, job.episode_title, config,
+                                         [(width, height) for _, width, height in renditions]) \
+        if output_cache.enabled else {}
+    with output_cache.claim(cache_keys.get(main_size)) as claim:
+        paths = {name: output_cache.lookup(cache_keys.get((width, height)))
+                 for name, width, height in renditions}
+        missing = [rendition for rendition in renditions if not paths[rendition[0]]]
+        
+        if any(name != 'main' for name, _, _ in missing):
+            # Every missing rendition comes out of one FFmpeg process
+            encode_start = time.monotonic()
+            with record_stage(job, 'encode') as stage:
+                processed_path = converter.process_audio(
+                    audio_path,
+                    normalize=config.normalize_audio,
+                    trim=config.trim_silence
+                )
+                paths.update(converter.convert_audio_to_renditions(
+                    audio_path=processed_path,
+                    image_path=image_path,
+                    renditions=missing,
+                    bitrate=config.video_bitrate,
+                    title=job.episode_title,
+                    copy_audio=processed_path != audio_path
+                ))
+                stage.bytes = sum(os.path.getsize(paths[name]) for name, _, _ in missing)
+            encode_seconds = (time.monotonic() - encode_start) / len(missing)
+            for name, width, height in missing:
+                output_cache.store(cache_keys.get((width, height)), paths[name], encode_seconds)
+        elif missing and STREAMING_UPLOAD and config.visualization in (None, 'none'):
+            # Upload behind the encoder instead of after it. The video is cached, and jobs
+            # waiting for it let in, as soon as the encode is final rather than after the upload.
+            def publish(video_path, encode_seconds):
+                output_cache.store(cache_keys.get(main_size), video_path, encode_seconds)
+                claim.release()
+            
+            paths['main'], upload_result, _ = _stream_encode_and_upload(
+                job, config, converter, youtube_client, audio_path, image_path,
+                video_description, thumbnail_path, on_encoded=publish)
+        elif missing:
+            encode_start = time.monotonic()
+            with record_stage(job, 'encode') as stage:
+                # Loudness and silence are applied in one audio pass ahead of the video encode
+                processed_path = converter.process_audio(
+                    audio_path,
+                    normalize=config.normalize_audio,
+                    trim=config.trim_silence
+                )
+                paths['main'] = converter.convert_audio_to_video(
+                    audio_path=processed_path,
+                    image_path=image_path,
+                    width=config.video_width,
+                    height=config.video_height,
+                    bitrate=config.video_bitrate,
+                    title=job.episode_title,
+                    visualization=config.visualization,
+                    copy_audio=processed_path != audio_path
+                )
+                stage.bytes = os.path.getsize(paths['main'])
+            output_cache.store(cache_keys.get(main_size), paths['main'], time.monotonic() - encode_start)
+    
+    video_path = paths['main']
+    _keep_renditions(job, renditions[1:], paths)
+    
+    # Save the video path
+    job.video_path = video_path
+    db.session.commit()
+    
+    # Upload to YouTube
+    if upload_result is None:
+        with record_stage(job, 'upload') as stage:
+            upload_result = youtube_client.upload_video(
+                video_path=video_path,
+                title=job.episode_title,
+                description=video_description,
+                tags=["podcast", "audio"],
+                privacy_status="public"
+            )
+            stage.bytes = os.path.getsize(video_path)
+            _set_thumbnail(youtube_client, upload_result['id'], thumbnail_path)
+    
+    return upload_result
+
 def process_episode_job(job_id):
-    """Process a single episode conversion job."""
+    """Process a single episode conversion job, profiling it if it was marked for profiling."""
+    from app import app, db
+    from models import ConversionJob
+    
+    with app.app_context(), correlation_context(job_id=job_id):
+        forced = bool(db.session.query(ConversionJob.profile).filter_by(id=job_id).scalar())
+        if forced:
+            # One profile per request to profile a job
+            ConversionJob.query.filter_by(id=job_id).update({'profile': False}, synchronize_session=False)
+            db.session.commit()
+        
+        with profiled('job', f"job-{job_id}", should_profile(forced)):
+            return _run_episode_job(job_id)
+
+def _run_episode_job(job_id):
     from app import app, db
     from models import ConversionJob, PodcastConfig
     
-    with app.app_context():
+    with app.app_context(), correlation_context(job_id=job_id):
         try:
             # Get the job
             job = ConversionJob.query.get(job_id)
             
             if not job:
-                logger.warning(f"Job {job_id} not found")
+                logger.warning("Job %s not found", job_id)
                 return False
             
-            # Update job status
-            job.status = 'processing'
-            job.started_at = datetime.datetime.utcnow()
-            db.session.commit()
+            # Update job status (jobs dispatched by the queue have already been claimed)
+            if job.status != 'processing' or not job.started_at:
+                job.status = 'processing'
+                job.started_at = datetime.datetime.utcnow()
+                db.session.commit()
+            record_queue_wait(job)
             
-            # Get podcast configuration
-            config = PodcastConfig.query.filter_by(user_id=job.user_id).first()
+            # Get podcast configuration; only jobs created before shows were linked
+            # to jobs fall back to the user's first show
+            if job.show_deleted:
+                raise ValueError("Show deleted")
+            if job.config_id:
+                config = PodcastConfig.query.get(job.config_id)
+            else:
+                config = PodcastConfig.query.filter_by(user_id=job.user_id).order_by(PodcastConfig.id).first()
             
             if not config:
-                raise ValueError(f"No podcast configuration found for user {job.user_id}")
-            
-            # Initialize clients
-            converter = AudioToVideoConverter()
+                raise ValueError(f"No podcast configuration found for job {job.id}")
             
             # Check if we have YouTube credentials
             if not config.youtube_api_key or not config.youtube_refresh_token:
-                logger.warning(f"YouTube API credentials not configured for user {job.user_id}")
+                logger.warning("YouTube API credentials not configured for config %s", config.id)
                 job.status = 'failed'
                 job.error_message = "YouTube API credentials not configured"
                 job.completed_at = datetime.datetime.utcnow()
                 db.session.commit()
+                _record_job_outcome(job, 'failed')
                 return False
                 
             # Initialize YouTube client with credentials from the database
@@ -203,15 +660,21 @@ def process_episode_job(job_id):
                 refresh_token=config.youtube_refresh_token
             )
             
+            # Don't download and encode an episode that can't be uploaded before the quota resets,
+            # or while YouTube is failing
+            youtube_client.quota.check(UPLOAD_COST)
+            youtube_client.breaker.raise_if_open()
+            
             # If audio_url is missing, get detailed episode info
             if not job.audio_url:
                 # Check if we have Spotify credentials
                 if not config.spotify_client_id or not config.spotify_client_secret:
-                    logger.warning(f"Spotify API credentials not configured for user {job.user_id}")
+                    logger.warning("Spotify API credentials not configured for config %s", config.id)
                     job.status = 'failed'
                     job.error_message = "Spotify API credentials not configured"
                     job.completed_at = datetime.datetime.utcnow()
                     db.session.commit()
+                    _record_job_outcome(job, 'failed')
                     return False
                     
                 # Initialize Spotify client with credentials from the database
@@ -230,29 +693,28 @@ def process_episode_job(job_id):
             # Process the podcast episode
             logo_url = config.logo_url or "https://via.placeholder.com/1280x720.png?text=Podcast+Episode"
             
-            conversion_result = converter.process_podcast_episode(
-                audio_url=job.audio_url,
-                image_url=logo_url,
-                title=job.episode_title,
-                width=config.video_width,
-                height=config.video_height,
-                bitrate=config.video_bitrate
-            )
-            
-            # Save the video path
-            job.video_path = conversion_result['video_path']
-            db.session.commit()
+            # All temporary files live in a per-job workspace that is removed even if the job fails.
+            # Small jobs are placed in RAM-backed scratch when there's room for them.
+            expected_bytes = AudioToVideoConverter().estimate_job_bytes(job.audio_url, config.video_bitrate)
+            if expected_bytes is None and job.duration_seconds:
+                expected_bytes = get_cost_model().estimate(job.duration_seconds, config.video_bitrate).workspace_bytes
             
-            # Upload to YouTube
-            video_description = f"Listen to the full podcast at {config.spotify_podcast_id}"
+            workspace_manager = get_workspace_manager()
+            workspace = workspace_manager.allocate(job.id, expected_bytes)
             
-            upload_result = youtube_client.upload_video(
-                video_path=conversion_result['video_path'],
-                title=job.episode_title,
-                description=video_description,
-                tags=["podcast", "audio"],
-                privacy_status="public"
-            )
+            while True:
+                try:
+                    upload_result = _convert_and_upload(job, config, youtube_client, workspace, logo_url)
+                    break
+                except QuotaExceededError as e:
+                    # A job that outgrows RAM scratch starts over on disk instead of being deferred
+                    if workspace.medium != MEDIUM_RAM:
+                        raise
+                    logger.info("Job %s outgrew RAM scratch, moving it to disk: %s", job.id, e)
+                finally:
+                    with record_stage(job, 'cleanup'):
+                        workspace_manager.release(workspace)
+                workspace = workspace_manager.allocate(job.id, expected_bytes, medium=MEDIUM_DISK)
             
             # Update job with YouTube details
             job.status = 'completed'
@@ -260,23 +722,45 @@ def process_episode_job(job_id):
             job.youtube_video_url = upload_result['url']
             job.completed_at = datetime.datetime.utcnow()
             db.session.commit()
+            _record_job_outcome(job, 'completed')
             
-            # Clean up temporary files
-            converter.cleanup_files(
-                conversion_result['audio_path'],
-                conversion_result['image_path'],
-                conversion_result['video_path']
-            )
-            
-            logger.info(f"Successfully processed and uploaded episode: {job.episode_title}")
+            logger.info("Successfully processed and uploaded episode: %s", job.episode_title)
             return True
+        except QuotaExceededError as e:
+            # Not enough temp space right now; hold the job back, longer each time it happens,
+            # so it isn't downloaded again until space may have been freed
+            _record_job_outcome(job, 'deferred')
+            job.deferrals = (job.deferrals or 0) + 1
+            delay = min(TEMP_DEFER_BASE_DELAY * 2 ** (job.deferrals - 1), TEMP_DEFER_MAX_DELAY)
+            job.status = 'pending'
+            job.priority = PRIORITY_RETRY
+            job.started_at = None
+            job.not_before = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+            job.error_message = f"Deferred: {str(e)}"
+            db.session.commit()
+            
+            logger.warning("Deferred episode job %s for %ss: %s", job_id, delay, e)
+            return False
+        except (YouTubeQuotaExceededError, CircuitOpenError) as e:
+            # Out of YouTube quota, or Spotify or YouTube is down; hold the job until
+            # then instead of failing it
+            _record_job_outcome(job, 'deferred')
+            job.status = 'pending'
+            job.started_at = None
+            job.not_before = e.retry_at
+            job.error_message = f"Deferred: {str(e)}"
+            db.session.commit()
+            
+            logger.warning("Deferred episode job %s until %s: %s", job_id, e.retry_at, e)
+            return False
         except Exception as e:
             # Update job with error
             if 'job' in locals() and job:
                 job.status = 'failed'
-                job.error_message = str(e)
+                job.error_message = truncate_error(str(e))
                 job.completed_at = datetime.datetime.utcnow()
                 db.session.commit()
+                _record_job_outcome(job, 'failed')
             
-            logger.error(f"Error processing episode job {job_id}: {str(e)}")
+            logger.error("Error processing episode job %s: %s", job_id, e)
             return False
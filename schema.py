@@ -0,0 +1,54 @@
+import logging
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+def _default_clause(column):
+    """Render a column's server default for ALTER TABLE, so existing rows get a value."""
+    if column.server_default is None:
+        return ''
+
+    default = column.server_default.arg
+    if isinstance(default, str):
+        return " DEFAULT '" + default.replace("'", "''") + "'"
+    return f" DEFAULT {default.text}"
+
+def upgrade_schema(db):
+    """Add columns and indexes introduced after a table was first created.
+
+    db.create_all() only creates missing tables, so existing databases would
+    otherwise never receive new columns or indexes. Only nullable columns (or
+    ones with a server default) can be added this way; anything else needs a
+    manual migration.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                if not column.nullable and column.server_default is None:
+                    logger.warning("Cannot add non-nullable column %s.%s automatically", table.name, column.name)
+                    continue
+
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+                    f"{_default_clause(column)}"
+                ))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    logger.info("Added index %s", index.name)
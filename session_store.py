@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import datetime
+import secrets
+from flask.sessions import SessionInterface, SecureCookieSession
+from flask.json.tag import TaggedJSONSerializer
+from config import SESSION_TOUCH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+def _record_id(sid):
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+class DatabaseSession(SecureCookieSession):
+    """A session whose contents live in the ServerSession table, keyed by an opaque ID."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.retired_sid = None
+
+    def regenerate(self):
+        """Move the contents to a fresh session ID and drop the old record when saved.
+
+        Call this whenever the session's privilege changes, such as on login, so
+        an ID planted or observed beforehand is worthless afterwards.
+        """
+        if self.sid:
+            self.retired_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+class DatabaseSessionInterface(SessionInterface):
+    """Keeps session data in the database and only a random session ID in the cookie.
+
+    Contents are serialized with Flask's tagged JSON, as cookie sessions are,
+    so nothing read back is ever unpickled. A record is written only when the
+    session changes, or at most every SESSION_TOUCH_INTERVAL seconds to push
+    back its expiry; other requests cost one primary-key read. Records expire
+    after PERMANENT_SESSION_LIFETIME without use. Writes go through their own
+    connection, so they never commit a request's unfinished database work.
+    """
+
+    serializer = TaggedJSONSerializer()
+    session_class = DatabaseSession
+
+    def open_session(self, app, request):
+        from app import db
+        from models import ServerSession
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self.session_class()
+
+        table = ServerSession.__table__
+        try:
+            with db.engine.connect() as connection:
+                row = connection.execute(
+                    db.select(table.c.data, table.c.expires_at).where(
+                        table.c.id == _record_id(sid),
+                        table.c.expires_at > datetime.datetime.utcnow()
+                    )
+                ).first()
+        except Exception as e:
+            logger.error("Error loading session: %s", e)
+            raise
+
+        if row is None:
+            return self.session_class()
+        try:
+            data = self.serializer.loads(row.data)
+        except ValueError:
+            logger.warning("Discarding unreadable session record")
+            return self.session_class()
+        return self.session_class(data, sid=sid, expires_at=row.expires_at)
+
+    def save_session(self, app, session, response):
+        from app import db
+        from models import ServerSession
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        table = ServerSession.__table__
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # An emptied session is deleted outright
+        if not session:
+            stale_sids = [sid for sid in (session.sid, session.retired_sid) if sid]
+            if session.modified and stale_sids:
+                with db.engine.begin() as connection:
+                    connection.execute(db.delete(table).where(table.c.id.in_([_record_id(sid) for sid in stale_sids])))
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       partitioned=self.get_cookie_partitioned(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        now = datetime.datetime.utcnow()
+        expires_at = now + app.permanent_session_lifetime
+        stale = session.expires_at is not None and \
+            session.expires_at - now < app.permanent_session_lifetime - datetime.timedelta(seconds=SESSION_TOUCH_INTERVAL)
+        if not session.modified and not stale:
+            return
+
+        try:
+            with db.engine.begin() as connection:
+                if session.retired_sid:
+                    connection.execute(db.delete(table).where(table.c.id == _record_id(session.retired_sid)))
+                if session.modified:
+                    values = {'data': self.serializer.dumps(dict(session)), 'expires_at': expires_at}
+                else:
+                    values = {'expires_at': expires_at}
+
+                updated = 0
+                if session.sid:
+                    updated = connection.execute(
+                        db.update(table).where(table.c.id == _record_id(session.sid)).values(**values)
+                    ).rowcount
+                if not updated:
+                    # New session, or one purged since it was loaded
+                    session.sid = session.sid or secrets.token_urlsafe(32)
+                    values['data'] = self.serializer.dumps(dict(session))
+                    connection.execute(db.insert(table).values(id=_record_id(session.sid), **values))
+        except Exception as e:
+            logger.error("Error saving session: %s", e)
+            raise
+        session.expires_at = expires_at
+        session.retired_sid = None
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            partitioned=self.get_cookie_partitioned(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+def purge_expired_sessions():
+    """Delete expired session records and return how many were removed."""
+    from app import db
+    from models import ServerSession
+
+    table = ServerSession.__table__
+    with db.engine.begin() as connection:
+        return connection.execute(
+            db.delete(table).where(table.c.expires_at <= datetime.datetime.utcnow())
+        ).rowcount
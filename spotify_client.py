@@ -1,120 +1,86 @@
-import os
 import logging
-import requests
-import base64
-import json
-import time
 from config import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
+from resilience import get_breaker, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
 class SpotifyClient:
+    """Blocking Spotify Web API client for code outside the discovery engine.
+    
+    Requests are made by the engine's AsyncSpotifyClient for the same
+    credentials, so both share one access token, circuit breaker and
+    connection pool. Don't use it on the engine's own loop.
+    """
+    
     def __init__(self, client_id=None, client_secret=None):
         # Use provided credentials if available, otherwise fall back to environment variables
         self.client_id = client_id or SPOTIFY_CLIENT_ID
         self.client_secret = client_secret or SPOTIFY_CLIENT_SECRET
-        self.access_token = None
-        self.token_expiry = 0
+        # Rate limits are per app, so each set of credentials trips its own breaker
+        self.breaker = get_breaker('spotify', self.client_id)
         
         if not self.client_id or not self.client_secret:
             logger.warning("Spotify API credentials not found in parameters or environment variables.")
-        
-        # Get access token immediately upon initialization if credentials are available
-        if self.client_id and self.client_secret:
-            self._get_access_token()
     
-    def _get_access_token(self):
-        """Get a new access token from Spotify API."""
+    def _call(self, request):
+        """Run request(client) on the discovery engine with this client's credentials."""
+        from discovery import get_discovery_engine
+        
         if not self.client_id or not self.client_secret:
             raise ValueError("Spotify API credentials not configured.")
-            
-        if self.access_token and time.time() < self.token_expiry:
-            return self.access_token
-            
-        # Prepare authorization string
-        auth_str = f"{self.client_id}:{self.client_secret}"
-        b64_auth = base64.b64encode(auth_str.encode()).decode()
-        
-        headers = {
-            "Authorization": f"Basic {b64_auth}",
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        
-        payload = {"grant_type": "client_credentials"}
-        
-        try:
-            response = requests.post(
-                "https://accounts.spotify.com/api/token",
-                headers=headers,
-                data=payload
-            )
-            response.raise_for_status()
-            
-            token_data = response.json()
-            self.access_token = token_data["access_token"]
-            self.token_expiry = time.time() + token_data["expires_in"] - 60  # Expire 1 minute early to be safe
-            
-            return self.access_token
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error getting Spotify access token: {str(e)}")
-            raise
-    
-    def _make_api_request(self, endpoint, params=None):
-        """Make a request to the Spotify API."""
-        # Ensure we have a valid token
-        token = self._get_access_token()
-        
-        headers = {
-            "Authorization": f"Bearer {token}"
-        }
-        
-        try:
-            url = f"https://api.spotify.com/v1/{endpoint}"
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 401:
-                # Token expired, get new one and retry
-                self.access_token = None
-                token = self._get_access_token()
-                headers["Authorization"] = f"Bearer {token}"
-                response = requests.get(url, headers=headers, params=params)
-                response.raise_for_status()
-                return response.json()
-            else:
-                logger.error(f"HTTP error from Spotify API: {str(e)}")
-                raise
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error making Spotify API request: {str(e)}")
-            raise
+        return get_discovery_engine().call_spotify(self.client_id, self.client_secret, request)
     
     def get_podcast_info(self, podcast_id):
         """Get information about a specific podcast."""
         try:
-            return self._make_api_request(f"shows/{podcast_id}")
+            return self._call(lambda client: client.get_podcast_info(podcast_id))
+        except CircuitOpenError:
+            # An open breaker passes through unwrapped, so callers can wait for Spotify
+            raise
         except Exception as e:
-            logger.error(f"Error getting podcast info: {str(e)}")
+            logger.error("Error getting podcast info: %s", e)
             raise ValueError(f"Could not retrieve podcast information: {str(e)}")
     
     def get_podcast_episodes(self, podcast_id, limit=10):
         """Get episodes for a specific podcast."""
         try:
-            params = {
-                "limit": limit,
-                "market": "US"  # Default market
-            }
-            return self._make_api_request(f"shows/{podcast_id}/episodes", params)
+            return self._call(lambda client: client.get_podcast_episodes(podcast_id, limit))
+        except CircuitOpenError:
+            raise
         except Exception as e:
-            logger.error(f"Error getting podcast episodes: {str(e)}")
+            logger.error("Error getting podcast episodes: %s", e)
             raise ValueError(f"Could not retrieve podcast episodes: {str(e)}")
     
+    def iter_podcast_episodes(self, podcast_id, page_size=50):
+        """Yield every episode of a podcast, newest first, fetching one page at a time."""
+        offset = 0
+        while True:
+            try:
+                page = self._call(lambda client: client.get_podcast_episodes(podcast_id, page_size, offset))
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                logger.error("Error paging podcast episodes at offset %s: %s", offset, e)
+                raise ValueError(f"Could not retrieve podcast episodes: {str(e)}")
+            
+            items = page.get('items') or []
+            for episode in items:
+                # Spotify returns null entries for episodes unavailable in the market
+                if episode:
+                    yield episode
+            
+            if not page.get('next') or not items:
+                return
+            offset += len(items)
+    
     def get_episode_info(self, episode_id):
         """Get detailed information about a specific episode."""
         try:
-            return self._make_api_request(f"episodes/{episode_id}")
+            return self._call(lambda client: client.get_episode_info(episode_id))
+        except CircuitOpenError:
+            raise
         except Exception as e:
-            logger.error(f"Error getting episode info: {str(e)}")
+            logger.error("Error getting episode info: %s", e)
             raise ValueError(f"Could not retrieve episode information: {str(e)}")
     
     def get_episode_audio_url(self, episode_info):
@@ -130,5 +96,5 @@ class SpotifyClient:
             # or implement a more complex solution to get the actual audio
             raise NotImplementedError("Direct audio download not supported by Spotify API. Consider using a third-party tool.")
         except Exception as e:
-            logger.error(f"Error getting episode audio URL: {str(e)}")
+            logger.error("Error getting episode audio URL: %s", e)
             raise
@@ -0,0 +1,173 @@
+import os
+import uuid
+import hashlib
+import logging
+import textwrap
+import threading
+import subprocess
+from config import FFMPEG_PATH, RENDER_CACHE_DIRECTORY, RENDER_CACHE_MAX_BYTES, TITLE_FONT_FILE
+from metrics import RENDER_CACHE_LOOKUPS, RENDER_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Bump when the card layout changes so cached cards are re-rendered
+RENDER_VERSION = 1
+
+# Where the title can sit on a card; visualizations draw their bars over the bottom
+TITLE_POSITIONS = ('bottom', 'top')
+
+# YouTube's recommended thumbnail size
+THUMBNAIL_WIDTH = 1280
+THUMBNAIL_HEIGHT = 720
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def escape_filter_value(value):
+    """Escape a value for use inside an FFmpeg filter option."""
+    return str(value).replace('\\', '\\\\').replace("'", "\\'").replace(':', '\\:')
+
+def wrap_title(title, width, font_size):
+    """Wrap a title to the card width, assuming an average glyph is 0.55 em wide."""
+    chars_per_line = max(int(width * 0.85 / (font_size * 0.55)), 10)
+    lines = textwrap.wrap(' '.join(title.split()), chars_per_line)
+    if len(lines) > 3:
+        lines = lines[:3]
+        lines[-1] = lines[-1][:chars_per_line - 1].rstrip() + '…'
+    return '\n'.join(lines)
+
+class TitleCardRenderer:
+    """Composes artwork and an episode title into a still image, once per episode.
+
+    Cards are cached by a hash of the artwork, title, size, title position
+    and layout version, so re-encodes and thumbnails reuse the same render.
+    The cache is pruned oldest-first once it grows past
+    RENDER_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, ffmpeg_path=None, cache_dir=None, max_bytes=None, font_file=None):
+        self.ffmpeg_path = ffmpeg_path or FFMPEG_PATH
+        self.cache_dir = cache_dir or RENDER_CACHE_DIRECTORY
+        self.max_bytes = RENDER_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.font_file = font_file if font_file is not None else TITLE_FONT_FILE
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_key(self, image_path, title, width, height, position='bottom'):
+        """Return the content hash identifying a card."""
+        parts = [str(RENDER_VERSION), file_digest(image_path), title or '', str(width), str(height), self.font_file or '',
+                 position]
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def render(self, image_path, title, width, height, position='bottom'):
+        """Return the path of a JPEG card for the artwork and title at the given size and title position."""
+        if position not in TITLE_POSITIONS:
+            raise ValueError(f"Unknown title position: {position}")
+
+        key = self.cache_key(image_path, title, width, height, position)
+        card_path = os.path.join(self.cache_dir, f"{key}.jpg")
+
+        if os.path.exists(card_path):
+            RENDER_CACHE_LOOKUPS.inc(result='hit')
+            # Touch the card so pruning keeps recently used ones
+            os.utime(card_path)
+            return card_path
+        RENDER_CACHE_LOOKUPS.inc(result='miss')
+
+        # Render to a private name and rename, so concurrent renders of the same card are safe
+        partial_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex[:8]}.jpg")
+        text_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex[:8]}.txt")
+        try:
+            command = [
+                self.ffmpeg_path,
+                "-hide_banner",
+                "-i", image_path,
+                "-vf", self._card_filter(title, width, height, text_path, position),
+                "-frames:v", "1",
+                "-q:v", "2",
+                "-y",
+                partial_path
+            ]
+            with RENDER_DURATION.time():
+                result = subprocess.run(command, capture_output=True, text=True, timeout=120)
+            if result.returncode != 0:
+                tail = '\n'.join(result.stderr.strip().splitlines()[-5:])
+                raise Exception(f"Title card render failed: {tail}")
+
+            os.replace(partial_path, card_path)
+            logger.info("Rendered title card %s", card_path)
+        finally:
+            for path in (partial_path, text_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.prune()
+        return card_path
+
+    def render_thumbnail(self, image_path, title):
+        """Return the path of a YouTube-sized thumbnail for the episode."""
+        return self.render(image_path, title, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+
+    def _card_filter(self, title, width, height, text_path, position='bottom'):
+        """Build the filter that fits the artwork to the frame and draws the title once."""
+        card_filter = f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
+        if not title:
+            return card_filter
+
+        # The title is read from a file so quotes, colons and percent signs need no escaping
+        font_size = max(height // 18, 12)
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(wrap_title(title, width, font_size))
+
+        options = [
+            f"textfile='{escape_filter_value(text_path)}'",
+            "expansion=none",
+            f"fontsize={font_size}",
+            "fontcolor=white",
+            "box=1",
+            "boxcolor=black@0.6",
+            f"boxborderw={font_size // 2}",
+            f"line_spacing={font_size // 4}",
+            "x=(w-text_w)/2",
+            f"y={font_size * 2}" if position == 'top' else f"y=h-text_h-{font_size * 2}"
+        ]
+        if self.font_file:
+            options.insert(0, f"fontfile='{escape_filter_value(self.font_file)}'")
+        return card_filter + ",drawtext=" + ":".join(options)
+
+    def prune(self):
+        """Delete the least recently used cards until the cache fits its size limit."""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError as e:
+                    logger.warning("Failed to prune title card %s: %s", path, e)
+
+_renderer = None
+
+def get_title_card_renderer():
+    """Return the process-wide title card renderer."""
+    global _renderer
+
+    if _renderer is None:
+        _renderer = TitleCardRenderer()
+    return _renderer
@@ -0,0 +1,308 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+from config import FFMPEG_PATH, VISUALIZATION_FRAME_RATE
+
+try:
+    import numpy as np
+except ImportError:  # A dependency, but without it the visualization is still drawn by FFmpeg's own filters
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Output styles a show can choose; 'none' is the plain still image
+VISUALIZATION_MODES = ('none', 'waveform', 'spectrum')
+
+# Audio is analysed as mono at this rate; plenty for drawing and cheap to decode
+ANALYSIS_SAMPLE_RATE = 8000
+
+# Frames analysed per block while streaming decoded audio
+ANALYSIS_BLOCK_FRAMES = 256
+
+# Bars drawn across the frame, and the share of the frame height they may use
+BAR_COUNT = 48
+BAR_AREA_FRACTION = 0.3
+BAR_COLOR = (255, 255, 255)
+
+# Spectrum levels are shown over this range below the loudest band
+SPECTRUM_RANGE_DB = 60.0
+
+def _stderr_tail(stderr_file, lines=20):
+    stderr_file.seek(0)
+    text = stderr_file.read().decode(errors='replace')
+    return '\n'.join(text.strip().splitlines()[-lines:])
+
+def _audio_codec_args(audio_bitrate):
+    """Encode the audio as AAC at the given bitrate, or copy it as is when the bitrate is None."""
+    if audio_bitrate is None:
+        return ["-c:a", "copy"]
+    return ["-c:a", "aac", "-b:a", audio_bitrate]
+
+def analyze_audio(audio_path, mode, fps=None, ffmpeg_path=None):
+    """Return a (frames, BAR_COUNT) array of bar levels between 0 and 1.
+
+    The audio is decoded once, streamed through in blocks, and each block's
+    frames are analysed together with vectorized NumPy: RMS over slices of
+    the frame's samples for 'waveform', log-spaced FFT bands for 'spectrum'.
+    """
+    fps = fps or VISUALIZATION_FRAME_RATE
+    samples_per_frame = ANALYSIS_SAMPLE_RATE // fps
+    block_bytes = samples_per_frame * ANALYSIS_BLOCK_FRAMES * 2
+
+    command = [
+        ffmpeg_path or FFMPEG_PATH,
+        "-hide_banner",
+        "-v", "error",
+        "-i", audio_path,
+        "-ac", "1",
+        "-ar", str(ANALYSIS_SAMPLE_RATE),
+        "-f", "s16le",
+        "-"
+    ]
+
+    if mode == 'spectrum':
+        window = np.hanning(samples_per_frame).astype(np.float32)
+        bins = samples_per_frame // 2 + 1
+        # Log-spaced band edges up to Nyquist, at least one FFT bin wide at the low end
+        edges = np.maximum(np.geomspace(1, bins - 1, BAR_COUNT + 1).astype(int), np.arange(1, BAR_COUNT + 2))
+        edges = np.unique(np.minimum(edges, bins - 1))
+        band_starts = edges[:-1]
+    else:
+        bar_samples = samples_per_frame // BAR_COUNT
+
+    levels = []
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            remainder = b''
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                data = remainder + data
+                frames = len(data) // (samples_per_frame * 2)
+                remainder = data[frames * samples_per_frame * 2:]
+                if not frames:
+                    continue
+
+                samples = np.frombuffer(data[:frames * samples_per_frame * 2], dtype='<i2')
+                samples = samples.astype(np.float32).reshape(frames, samples_per_frame) / 32768.0
+
+                if mode == 'spectrum':
+                    magnitudes = np.abs(np.fft.rfft(samples * window, axis=1))
+                    bands = np.add.reduceat(magnitudes, band_starts, axis=1)[:, :BAR_COUNT]
+                    levels.append(20 * np.log10(bands + 1e-9))
+                else:
+                    slices = samples[:, :bar_samples * BAR_COUNT].reshape(frames, BAR_COUNT, bar_samples)
+                    levels.append(np.sqrt(np.mean(slices ** 2, axis=2)))
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+
+        if returncode != 0:
+            raise Exception(f"Audio analysis failed: {_stderr_tail(stderr_file)}")
+
+    if not levels:
+        return np.zeros((0, BAR_COUNT), dtype=np.float32)
+    levels = np.concatenate(levels)
+
+    if mode == 'spectrum':
+        # Show the top SPECTRUM_RANGE_DB below the loudest band of the episode
+        levels = np.clip((levels - (levels.max() - SPECTRUM_RANGE_DB)) / SPECTRUM_RANGE_DB, 0, 1)
+    else:
+        peak = levels.max()
+        levels = np.sqrt(levels / peak) if peak > 0 else levels
+
+    # Pad if a very low frame rate's window left fewer bins than bars
+    if levels.shape[1] < BAR_COUNT:
+        levels = np.pad(levels, ((0, 0), (BAR_COUNT - levels.shape[1], 0)), mode='edge')
+    return levels.astype(np.float32)
+
+def _load_background(image_path, width, height, ffmpeg_path):
+    """Decode the still image to an RGB array of the output size."""
+    command = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-v", "error",
+        "-i", image_path,
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+        "-frames:v", "1",
+        "-pix_fmt", "rgb24",
+        "-f", "rawvideo",
+        "-"
+    ]
+    result = subprocess.run(command, capture_output=True, timeout=120)
+    if result.returncode != 0:
+        raise Exception(f"Could not decode background image: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape(height, width, 3)
+
+def iter_frames(background, levels):
+    """Yield raw RGB frames with the bars drawn over the bottom of the background.
+
+    Only the bar area is redrawn for each frame; the rest of the frame is
+    the same bytes every time.
+    """
+    height, width, _ = background.shape
+    area_height = max(int(height * BAR_AREA_FRACTION), 1)
+    top = background[:height - area_height].tobytes()
+    area = background[height - area_height:]
+
+    # Map each pixel column to its bar, leaving a gap between bars
+    bar_width = width / BAR_COUNT
+    columns = np.arange(width)
+    bar_of_column = np.minimum((columns / bar_width).astype(int), BAR_COUNT - 1)
+    in_bar = (columns - bar_of_column * bar_width) < bar_width * 0.75
+
+    # Distance of each row from the bottom of the frame
+    rows_from_bottom = np.arange(area_height)[::-1][:, None]
+    color = np.array(BAR_COLOR, dtype=np.uint8)
+
+    for frame_levels in levels:
+        column_heights = np.where(in_bar, (frame_levels * area_height)[bar_of_column], 0)
+        mask = rows_from_bottom < column_heights[None, :]
+        yield top + np.where(mask[:, :, None], color, area).tobytes()
+
+def _encode_frames(audio_path, image_path, output_path, width, height, bitrate, mode, fps, ffmpeg_path, audio_bitrate):
+    """Analyse the audio with NumPy and stream rendered frames into the encoder."""
+    levels = analyze_audio(audio_path, mode, fps, ffmpeg_path)
+    background = _load_background(image_path, width, height, ffmpeg_path)
+
+    command = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "-s", f"{width}x{height}",
+        "-framerate", str(fps),
+        "-i", "-",
+        "-i", audio_path,
+        "-map", "0:v",
+        "-map", "1:a",
+        "-c:v", "libx264",
+        "-b:v", bitrate,
+        "-pix_fmt", "yuv420p",
+        *_audio_codec_args(audio_bitrate),
+        "-shortest",
+        "-y",
+        output_path
+    ]
+
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        try:
+            for frame in iter_frames(background, levels):
+                process.stdin.write(frame)
+            process.stdin.close()
+        except BrokenPipeError:
+            # FFmpeg exited early; its stderr says why
+            pass
+        except BaseException:
+            # Don't leave the encoder running after a failure on our side
+            process.kill()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            process.wait()
+            raise
+        returncode = process.wait()
+        if returncode != 0:
+            raise Exception(f"FFmpeg conversion failed: {_stderr_tail(stderr_file)}")
+
+    return len(levels) / fps
+
+def _encode_filtered(audio_path, image_path, output_path, width, height, bitrate, mode, fps, ffmpeg_path, audio_bitrate):
+    """Draw the visualization with FFmpeg's showwaves/showfreqs filters when NumPy isn't available."""
+    area_height = max(int(height * BAR_AREA_FRACTION), 2) // 2 * 2
+    if mode == 'spectrum':
+        visual = f"showfreqs=s={width}x{area_height}:mode=bar:ascale=log:fscale=log:colors=white:rate={fps}"
+    else:
+        visual = f"showwaves=s={width}x{area_height}:mode=cline:scale=sqrt:colors=white:rate={fps}"
+
+    filter_graph = (
+        f"[0:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={fps}[background];"
+        f"[1:a]aformat=channel_layouts=mono,{visual}[bars];"
+        f"[background][bars]overlay=0:{height - area_height}:shortest=1,format=yuv420p[video]"
+    )
+    command = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loop", "1",
+        "-framerate", str(fps),
+        "-i", image_path,
+        "-i", audio_path,
+        "-filter_complex", filter_graph,
+        "-map", "[video]",
+        "-map", "1:a",
+        "-c:v", "libx264",
+        "-b:v", bitrate,
+        *_audio_codec_args(audio_bitrate),
+        "-shortest",
+        "-y",
+        output_path
+    ]
+
+    with tempfile.TemporaryFile() as stderr_file:
+        returncode = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=stderr_file).returncode
+        if returncode != 0:
+            raise Exception(f"FFmpeg conversion failed: {_stderr_tail(stderr_file)}")
+    return None
+
+def encode_visualization(audio_path, image_path, output_path, width, height, bitrate, mode,
+                         audio_bitrate="192k", fps=None, ffmpeg_path=None):
+    """Encode a video with animated waveform or spectrum bars over the still image.
+
+    Frames are rendered at a low frame rate and streamed to the encoder one at
+    a time, so memory use doesn't grow with episode length. Pass
+    audio_bitrate=None to copy already-encoded AAC audio. Returns the media
+    seconds encoded, or None if unknown.
+    """
+    if mode not in VISUALIZATION_MODES or mode == 'none':
+        raise ValueError(f"Unknown visualization mode: {mode}")
+
+    fps = fps or VISUALIZATION_FRAME_RATE
+    ffmpeg_path = ffmpeg_path or FFMPEG_PATH
+    encode = _encode_frames if np is not None else _encode_filtered
+    return encode(audio_path, image_path, output_path, width, height, bitrate, mode, fps, ffmpeg_path, audio_bitrate)
+
+def benchmark(audio_path, image_path, mode, width=1280, height=720, bitrate="1M", seconds=None, fps=None):
+    """Render a visualization to a scratch file and report its speed as a multiple of realtime."""
+    from converter import probe_duration
+
+    fps = fps or VISUALIZATION_FRAME_RATE
+    scratch = tempfile.mkdtemp(prefix='visualizer-benchmark-')
+    try:
+        if seconds:
+            # Benchmark a clip of the episode
+            clip_path = os.path.join(scratch, 'clip' + os.path.splitext(audio_path)[1])
+            subprocess.run(
+                [FFMPEG_PATH, "-hide_banner", "-v", "error", "-i", audio_path, "-t", str(seconds), "-c", "copy", "-y", clip_path],
+                check=True
+            )
+            audio_path = clip_path
+
+        media_seconds = probe_duration(audio_path)
+        result = {
+            'mode': mode,
+            'engine': 'numpy' if np is not None else 'ffmpeg',
+            'fps': fps,
+            'media_seconds': media_seconds
+        }
+
+        if np is not None:
+            start = time.monotonic()
+            analyze_audio(audio_path, mode, fps)
+            result['analysis_seconds'] = time.monotonic() - start
+
+        start = time.monotonic()
+        encode_visualization(audio_path, image_path, os.path.join(scratch, 'output.mp4'),
+                             width, height, bitrate, mode, fps=fps)
+        result['elapsed_seconds'] = time.monotonic() - start
+        result['realtime_multiple'] = (media_seconds / result['elapsed_seconds']) if media_seconds else None
+        return result
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
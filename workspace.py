@@ -0,0 +1,325 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from config import (
+    TEMP_DIRECTORY,
+    TEMP_QUOTA_BYTES,
+    TEMP_MIN_FREE_BYTES,
+    TEMP_ORPHAN_MAX_AGE,
+    RAM_SCRATCH_DIRECTORY,
+    RAM_SCRATCH_THRESHOLD_BYTES,
+    RAM_SCRATCH_BUDGET_BYTES
+)
+from metrics import TEMP_WORKSPACE_ALLOCATIONS
+
+logger = logging.getLogger(__name__)
+
+# File written into every job directory so other processes can tell who owns it
+OWNER_FILENAME = '.owner'
+
+# Storage media a workspace can live on
+MEDIUM_DISK = 'disk'
+MEDIUM_RAM = 'ram'
+
+class QuotaExceededError(Exception):
+    """Raised when a reservation would exceed the temp disk quota."""
+    pass
+
+class WorkspaceTooLargeError(Exception):
+    """Raised when a job needs more temp space than the disk could ever give it."""
+    pass
+
+class JobWorkspace:
+    def __init__(self, manager, job_id, path, medium=MEDIUM_DISK):
+        self.manager = manager
+        self.job_id = job_id
+        self.path = path
+        self.medium = medium
+        self.reserved_bytes = 0
+
+    def reserve(self, nbytes):
+        """Reserve space for a file about to be written into this workspace."""
+        self.manager.reserve(self, nbytes)
+
+    def file_path(self, filename):
+        """Return the full path of a file inside this workspace."""
+        return os.path.join(self.path, filename)
+
+    def used_bytes(self):
+        """Return the number of bytes currently written to this workspace."""
+        return _directory_size(self.path)
+
+class WorkspaceManager:
+    def __init__(self, root=None, quota_bytes=None, min_free_bytes=None, orphan_max_age=None,
+                 ram_root=None, ram_threshold_bytes=None, ram_budget_bytes=None):
+        self.root = root or TEMP_DIRECTORY
+        self.quota_bytes = TEMP_QUOTA_BYTES if quota_bytes is None else quota_bytes
+        self.min_free_bytes = TEMP_MIN_FREE_BYTES if min_free_bytes is None else min_free_bytes
+        self.orphan_max_age = TEMP_ORPHAN_MAX_AGE if orphan_max_age is None else orphan_max_age
+        self.ram_root = ram_root or RAM_SCRATCH_DIRECTORY
+        self.ram_threshold_bytes = RAM_SCRATCH_THRESHOLD_BYTES if ram_threshold_bytes is None else ram_threshold_bytes
+        self.ram_budget_bytes = RAM_SCRATCH_BUDGET_BYTES if ram_budget_bytes is None else ram_budget_bytes
+        self._lock = threading.Lock()
+        self._active = {}
+
+        # Create temp directory if it doesn't exist
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+        self.ram_enabled = self._init_ram_root()
+
+    def _init_ram_root(self):
+        """Create the RAM scratch directory if RAM scratch is enabled and available."""
+        if not self.ram_budget_bytes or not self.ram_threshold_bytes:
+            return False
+
+        # Only use RAM scratch when the parent is an existing mount such as /dev/shm
+        if not os.path.isdir(os.path.dirname(self.ram_root.rstrip(os.sep))):
+            logger.info("RAM scratch directory %s not available, using disk only", self.ram_root)
+            return False
+
+        try:
+            os.makedirs(self.ram_root, exist_ok=True)
+            return True
+        except OSError as e:
+            logger.warning("Could not create RAM scratch directory %s: %s", self.ram_root, e)
+            return False
+
+    def choose_medium(self, expected_bytes):
+        """Pick RAM for jobs known to be small enough to fit the RAM budget, disk otherwise."""
+        if not self.ram_enabled or not expected_bytes or expected_bytes > self.ram_threshold_bytes:
+            return MEDIUM_DISK
+
+        with self._lock:
+            if expected_bytes > self._available_bytes(MEDIUM_RAM):
+                return MEDIUM_DISK
+        return MEDIUM_RAM
+
+    def allocate(self, job_id, expected_bytes=None, medium=None):
+        """Create a private directory for a job, in RAM if it is expected to be small.
+
+        medium forces RAM or disk; a job that outgrows its RAM workspace
+        starts over in one allocated on disk.
+        """
+        if expected_bytes and expected_bytes > self.capacity_bytes():
+            raise WorkspaceTooLargeError(
+                f"Job {job_id} needs about {expected_bytes} bytes of temp space, "
+                f"more than the {self.capacity_bytes()} bytes available to all jobs"
+            )
+
+        medium = medium or self.choose_medium(expected_bytes)
+        root = self.ram_root if medium == MEDIUM_RAM else self.root
+
+        name = f"job-{job_id}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(root, name)
+        staging_path = os.path.join(root, f".{name}")
+        workspace = JobWorkspace(self, job_id, path, medium)
+
+        # The directory only appears under its final name once it has an owner,
+        # and is tracked as active before a sweep in this process can see it
+        with self._lock:
+            os.makedirs(staging_path)
+            try:
+                with open(os.path.join(staging_path, OWNER_FILENAME), 'w') as f:
+                    f.write(str(os.getpid()))
+                os.rename(staging_path, path)
+            except OSError:
+                shutil.rmtree(staging_path, ignore_errors=True)
+                raise
+            self._active[path] = workspace
+        TEMP_WORKSPACE_ALLOCATIONS.inc(medium=medium)
+
+        logger.info("Allocated %s workspace %s for job %s", medium, path, job_id)
+        return workspace
+
+    def release(self, workspace):
+        """Remove a job directory and return its reservation to the pool."""
+        with self._lock:
+            self._active.pop(workspace.path, None)
+            workspace.reserved_bytes = 0
+
+        try:
+            shutil.rmtree(workspace.path)
+            logger.info("Released workspace %s", workspace.path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Failed to remove workspace %s: %s", workspace.path, e)
+
+    @contextmanager
+    def workspace(self, job_id, expected_bytes=None):
+        """Allocate a workspace that is always removed, whether the job succeeds or fails."""
+        workspace = self.allocate(job_id, expected_bytes)
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    def reserve(self, workspace, nbytes):
+        """Reserve bytes for a workspace, raising QuotaExceededError if they don't fit."""
+        nbytes = max(int(nbytes or 0), 0)
+
+        if workspace.medium == MEDIUM_DISK and workspace.reserved_bytes + nbytes > self.capacity_bytes():
+            raise WorkspaceTooLargeError(
+                f"Job {workspace.job_id} needs more than {self.capacity_bytes()} bytes of temp space, "
+                f"the most available to all jobs"
+            )
+
+        with self._lock:
+            available = self._available_bytes(workspace.medium)
+            if nbytes > available:
+                raise QuotaExceededError(
+                    f"Cannot reserve {nbytes} bytes for job {workspace.job_id}: "
+                    f"only {available} bytes available in {workspace.medium} scratch"
+                )
+            workspace.reserved_bytes += nbytes
+
+    def capacity_bytes(self):
+        """Return the most disk space a single job could ever reserve: the quota, or the disk less its reserve."""
+        disk_bytes = shutil.disk_usage(self.root).total - self.min_free_bytes
+        return max(min(self.quota_bytes, disk_bytes) if self.quota_bytes else disk_bytes, 0)
+
+    def available_bytes(self):
+        """Return the bytes that can still be reserved, on disk and in RAM scratch together."""
+        with self._lock:
+            available = self._available_bytes(MEDIUM_DISK)
+            if self.ram_enabled:
+                available += self._available_bytes(MEDIUM_RAM)
+        return available
+
+    def reserved_bytes(self, medium=MEDIUM_DISK):
+        """Return the total bytes reserved by active workspaces on a medium."""
+        with self._lock:
+            return self._reserved_bytes(medium)
+
+    def _reserved_bytes(self, medium):
+        # Caller must hold the lock
+        return sum(w.reserved_bytes for w in self._active.values() if w.medium == medium)
+
+    def _available_bytes(self, medium=MEDIUM_DISK):
+        # Caller must hold the lock
+        reserved = self._reserved_bytes(medium)
+        if medium == MEDIUM_RAM:
+            budget_left = self.ram_budget_bytes - reserved
+            fs_left = shutil.disk_usage(self.ram_root).free
+        else:
+            budget_left = self.quota_bytes - reserved if self.quota_bytes else float('inf')
+            fs_left = shutil.disk_usage(self.root).free - self.min_free_bytes
+        return max(int(min(budget_left, fs_left)), 0)
+
+    def usage(self):
+        """Return a snapshot of reserved, used and available temp space."""
+        with self._lock:
+            reserved = self._reserved_bytes(MEDIUM_DISK)
+            available = self._available_bytes(MEDIUM_DISK)
+            active = sum(1 for w in self._active.values() if w.medium == MEDIUM_DISK)
+            ram_reserved = self._reserved_bytes(MEDIUM_RAM)
+            ram_available = self._available_bytes(MEDIUM_RAM) if self.ram_enabled else 0
+            ram_active = sum(1 for w in self._active.values() if w.medium == MEDIUM_RAM)
+
+        return {
+            'root': self.root,
+            'active_workspaces': active,
+            'reserved_bytes': reserved,
+            'used_bytes': _directory_size(self.root),
+            'available_bytes': available,
+            'quota_bytes': self.quota_bytes,
+            'disk_free_bytes': shutil.disk_usage(self.root).free,
+            'ram_enabled': self.ram_enabled,
+            'ram_root': self.ram_root,
+            'ram_active_workspaces': ram_active,
+            'ram_reserved_bytes': ram_reserved,
+            'ram_used_bytes': _directory_size(self.ram_root) if self.ram_enabled else 0,
+            'ram_available_bytes': ram_available,
+            'ram_budget_bytes': self.ram_budget_bytes if self.ram_enabled else 0,
+            'ram_threshold_bytes': self.ram_threshold_bytes
+        }
+
+    def sweep_orphans(self, max_age=None):
+        """Remove job directories and stray files left behind by crashed or failed jobs."""
+        max_age = self.orphan_max_age if max_age is None else max_age
+        now = time.time()
+        removed = 0
+
+        roots = [self.root]
+        if self.ram_enabled:
+            roots.append(self.ram_root)
+
+        for entry in (e for root in roots for e in os.scandir(root)):
+            # Checked per entry, since jobs may allocate workspaces while the sweep runs
+            with self._lock:
+                if entry.path in self._active:
+                    continue
+
+            try:
+                age = now - entry.stat().st_mtime
+
+                if entry.is_dir():
+                    # A directory is orphaned if its owning process is gone or it is too old
+                    if _owner_alive(entry.path) and age < max_age:
+                        continue
+                    shutil.rmtree(entry.path)
+                else:
+                    # Loose files predate per-job directories; only remove stale ones
+                    if age < max_age:
+                        continue
+                    os.remove(entry.path)
+
+                removed += 1
+                logger.info("Removed orphaned temp entry: %s", entry.path)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.warning("Failed to remove orphaned temp entry %s: %s", entry.path, e)
+
+        return removed
+
+def _owner_alive(path):
+    """Check whether the process that allocated a job directory may still be running.
+
+    Directories without a readable owner, and those of this process, count
+    as alive; they are only removed once they pass the maximum age.
+    """
+    try:
+        with open(os.path.join(path, OWNER_FILENAME)) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return True
+
+    if pid == os.getpid():
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _directory_size(path):
+    """Return the total size of all files under a directory."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+    return total
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_workspace_manager():
+    """Return the process-wide workspace manager."""
+    global _manager
+
+    with _manager_lock:
+        if _manager is None:
+            _manager = WorkspaceManager()
+        return _manager
@@ -3,25 +3,81 @@ import logging
 import json
 import time
 import requests
-import pickle
+from contextlib import contextmanager
 from flask import url_for, redirect, session, request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow, Flow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaUpload
+from googleapiclient.errors import HttpError
 from config import (
     YOUTUBE_API_KEY,
     YOUTUBE_CLIENT_ID,
     YOUTUBE_CLIENT_SECRET,
-    YOUTUBE_REFRESH_TOKEN
+    YOUTUBE_REFRESH_TOKEN,
+    YOUTUBE_TOKEN_URI,
+    YOUTUBE_DISCOVERY_URL,
+    YOUTUBE_UPLOAD_RETRIES,
+    STREAMING_UPLOAD_CHUNK_BYTES
 )
+from metrics import YOUTUBE_UPLOAD_DURATION, YOUTUBE_UPLOAD_BYTES, YOUTUBE_UPLOAD_RETRY_COUNT, YOUTUBE_API_ERRORS
+from resilience import get_breaker, call_with_retries
+from youtube_quota import QuotaLedger, QUOTA_COSTS, YouTubeQuotaExceededError, project_key, is_quota_error, next_reset
 
 logger = logging.getLogger(__name__)
 
 # OAuth scopes needed for YouTube upload
 SCOPES = ['https://www.googleapis.com/auth/youtube.upload', 'https://www.googleapis.com/auth/youtube.readonly']
 
+def build_youtube_service(**kwargs):
+    """Build the YouTube API service, from YOUTUBE_DISCOVERY_URL when a stand-in is configured."""
+    if YOUTUBE_DISCOVERY_URL:
+        return build('youtube', 'v3', discoveryServiceUrl=YOUTUBE_DISCOVERY_URL,
+                     static_discovery=False, cache_discovery=False, **kwargs)
+    return build('youtube', 'v3', **kwargs)
+
+class ProgressiveMediaUpload(MediaUpload):
+    """Resumable upload of a file that is still being written by a StreamingEncode.
+    
+    Until the encode finishes the size is reported as unknown, so chunks go
+    up with an open-ended Content-Range as soon as a full chunk, plus one
+    byte to prove it isn't the last, has been written. The chunk that
+    completes the upload is only sent once the encode has succeeded. If the
+    encoder fails, next_chunk() raises and the upload session is abandoned
+    unfinished, so no partial video is ever published.
+    """
+    
+    def __init__(self, source, mimetype='application/octet-stream', chunksize=STREAMING_UPLOAD_CHUNK_BYTES):
+        if chunksize % (256 * 1024):
+            raise ValueError("Chunk size must be a multiple of 256 KiB")
+        self._source = source
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._next_offset = 0
+    
+    def chunksize(self):
+        return self._chunksize
+    
+    def mimetype(self):
+        return self._mimetype
+    
+    def resumable(self):
+        return True
+    
+    def size(self):
+        # Asked before each chunk: wait until it's known whether the next chunk is the last one
+        self._source.wait_for(self._next_offset + self._chunksize)
+        return self._source.bytes_written if self._source.done else None
+    
+    def getbytes(self, begin, length):
+        data = self._source.read(begin, length)
+        self._next_offset = begin + len(data)
+        return data
+    
+    def has_stream(self):
+        return False
+
 class YouTubeClient:
     def __init__(self, api_key=None, client_id=None, client_secret=None, refresh_token=None):
         # Use provided credentials if available, otherwise fall back to environment variables
@@ -29,8 +85,32 @@ class YouTubeClient:
         self.client_id = client_id or YOUTUBE_CLIENT_ID
         self.client_secret = client_secret or YOUTUBE_CLIENT_SECRET
         self.refresh_token = refresh_token or YOUTUBE_REFRESH_TOKEN
+        self.quota = QuotaLedger(project_key(self.client_id, self.api_key))
+        # A 429 or long Retry-After on one project shouldn't hold back uploads to the others
+        self.breaker = get_breaker('youtube', self.quota.project)
         self.youtube = self._authenticate()
     
+    @contextmanager
+    def _spend_quota(self, call):
+        """Check and record the quota cost of an API call made inside the block."""
+        self.quota.check(QUOTA_COSTS[call])
+        try:
+            yield
+        except Exception as e:
+            if is_quota_error(e):
+                self.quota.mark_exhausted()
+                retry_at = next_reset()
+                raise YouTubeQuotaExceededError(
+                    f"YouTube rejected {call} for quota; retrying after {retry_at.strftime('%Y-%m-%d %H:%M')} UTC",
+                    retry_at
+                ) from e
+            # Requests YouTube rejected still cost quota; ones that never got an answer
+            # (network errors, an open breaker, a failed encoder) didn't reach it
+            if isinstance(e, HttpError) and e.resp is not None:
+                self.quota.record(call)
+            raise
+        self.quota.record(call)
+    
     def _authenticate(self):
         """Authenticate with YouTube API using OAuth2."""
         if not self.client_id or not self.client_secret:
@@ -38,7 +118,7 @@ class YouTubeClient:
             if self.api_key:
                 # Fall back to API key for read-only operations
                 logger.info("Using YouTube API key for read-only operations.")
-                return build('youtube', 'v3', developerKey=self.api_key)
+                return build_youtube_service(developerKey=self.api_key)
             else:
                 raise ValueError("No YouTube API credentials configured.")
         
@@ -48,7 +128,7 @@ class YouTubeClient:
                 credentials = Credentials(
                     token=None,
                     refresh_token=self.refresh_token,
-                    token_uri="https://oauth2.googleapis.com/token",
+                    token_uri=YOUTUBE_TOKEN_URI,
                     client_id=self.client_id,
                     client_secret=self.client_secret,
                     scopes=SCOPES
@@ -59,60 +139,72 @@ class YouTubeClient:
                     credentials.refresh(Request())
                 
                 # Build the YouTube API client
-                return build('youtube', 'v3', credentials=credentials)
+                return build_youtube_service(credentials=credentials)
             else:
                 # For read-only operations without a refresh token
                 if self.api_key:
-                    return build('youtube', 'v3', developerKey=self.api_key)
+                    return build_youtube_service(developerKey=self.api_key)
                 else:
                     # If we have no tokens at all, return None and require authorization
                     logger.warning("No refresh token available, authorization required.")
                     return None
         except Exception as e:
-            logger.error(f"Error authenticating with YouTube: {str(e)}")
+            logger.error("Error authenticating with YouTube: %s", e)
             raise
     
-    def generate_authorization_url(self, redirect_uri):
+    def _auth_flow(self, redirect_uri, state=None, code_verifier=None):
+        flow = Flow.from_client_config(
+            {
+                "web": {
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                    "token_uri": YOUTUBE_TOKEN_URI,
+                    "redirect_uris": [redirect_uri]
+                }
+            },
+            scopes=SCOPES,
+            state=state,
+            code_verifier=code_verifier
+        )
+        flow.redirect_uri = redirect_uri
+        return flow
+    
+    def generate_authorization_url(self, redirect_uri, config_id=None):
         """Generate the authorization URL for YouTube OAuth."""
         try:
-            flow = Flow.from_client_config(
-                {
-                    "web": {
-                        "client_id": self.client_id,
-                        "client_secret": self.client_secret,
-                        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                        "token_uri": "https://oauth2.googleapis.com/token",
-                        "redirect_uris": [redirect_uri]
-                    }
-                },
-                scopes=SCOPES
-            )
-            
-            flow.redirect_uri = redirect_uri
+            flow = self._auth_flow(redirect_uri)
             
             # Generate the authorization URL
-            auth_url, _ = flow.authorization_url(
+            auth_url, state = flow.authorization_url(
                 access_type='offline',
                 include_granted_scopes='true',
                 prompt='consent'  # Force prompt to ensure refresh token is returned
             )
             
-            # Store the flow state in the session or a cache
-            # This is important to be able to complete the flow later
-            pickled_flow = pickle.dumps(flow)
-            session['youtube_auth_flow'] = pickled_flow.hex()
+            # Remember just enough to rebuild the flow in the callback: the CSRF
+            # state, the PKCE verifier and which show is being authorized
+            session['youtube_auth'] = {
+                'state': state,
+                'code_verifier': flow.code_verifier,
+                'redirect_uri': redirect_uri,
+                'config_id': config_id
+            }
             
             return auth_url
         except Exception as e:
-            logger.error(f"Error generating YouTube authorization URL: {str(e)}")
+            logger.error("Error generating YouTube authorization URL: %s", e)
             raise
     
     def handle_authorization_response(self, authorization_response):
         """Handle the authorization response and get tokens."""
         try:
-            # Retrieve the flow from the session or cache
-            pickled_flow = bytes.fromhex(session.get('youtube_auth_flow', ''))
-            flow = pickle.loads(pickled_flow)
+            # Rebuild the flow from the pending authorization; a state mismatch fails in fetch_token
+            pending = session.get('youtube_auth')
+            if not pending:
+                raise ValueError("No YouTube authorization is in progress.")
+            flow = self._auth_flow(pending['redirect_uri'], state=pending['state'],
+                                   code_verifier=pending['code_verifier'])
             
             # Process the authorization response
             flow.fetch_token(authorization_response=authorization_response)
@@ -126,15 +218,14 @@ class YouTubeClient:
                 
                 # You might want to store this in a more permanent location like a database
                 # For now, we'll log it for the user to see
-                logger.info(f"YouTube refresh token obtained: {credentials.refresh_token}")
+                logger.info("YouTube refresh token obtained: %s", credentials.refresh_token)
                 logger.info("Please set this as the YOUTUBE_REFRESH_TOKEN environment variable.")
                 
                 # Build the YouTube API client with the new credentials
-                self.youtube = build('youtube', 'v3', credentials=credentials)
+                self.youtube = build_youtube_service(credentials=credentials)
                 
                 # Clean up the session
-                if 'youtube_auth_flow' in session:
-                    del session['youtube_auth_flow']
+                session.pop('youtube_auth', None)
                 
                 return {
                     'success': True,
@@ -147,7 +238,7 @@ class YouTubeClient:
                     'error': 'No refresh token received. Please try again and ensure you approve all permissions.'
                 }
         except Exception as e:
-            logger.error(f"Error handling YouTube authorization response: {str(e)}")
+            logger.error("Error handling YouTube authorization response: %s", e)
             return {
                 'success': False,
                 'error': str(e)
@@ -157,10 +248,12 @@ class YouTubeClient:
         """Get information about the authenticated user's channel."""
         try:
             # Get the authenticated user's channel
-            response = self.youtube.channels().list(
-                part="snippet,contentDetails,statistics",
-                mine=True
-            ).execute()
+            with self._spend_quota('channels.list'):
+                request = self.youtube.channels().list(
+                    part="snippet,contentDetails,statistics",
+                    mine=True
+                )
+                response = call_with_retries(self.breaker, request.execute)
             
             if not response.get('items'):
                 raise ValueError("No channel found for the authenticated user.")
@@ -174,13 +267,19 @@ class YouTubeClient:
                 'videos': channel['statistics'].get('videoCount', '0')
             }
         except Exception as e:
-            logger.error(f"Error getting channel info: {str(e)}")
+            YOUTUBE_API_ERRORS.inc(call='channels.list')
+            logger.error("Error getting channel info: %s", e)
             raise
     
-    def upload_video(self, video_path, title, description, tags=None, category_id="22", privacy_status="public"):
-        """Upload a video to YouTube."""
-        if not os.path.exists(video_path):
+    def upload_video(self, video_path, title, description, tags=None, category_id="22", privacy_status="public", stream=None):
+        """Upload a video to YouTube.
+        
+        Pass the StreamingEncode writing video_path as stream to upload the
+        video while it's still being encoded.
+        """
+        if stream is None and not os.path.exists(video_path):
             raise FileNotFoundError(f"Video file not found: {video_path}")
+        self.breaker.raise_if_open()
         
         try:
             # Create video metadata
@@ -197,28 +296,36 @@ class YouTubeClient:
             }
             
             # Create an upload request
-            media = MediaFileUpload(
-                video_path,
-                mimetype='video/mp4',
-                resumable=True
-            )
+            if stream is not None:
+                media = ProgressiveMediaUpload(stream, mimetype='video/mp4')
+            else:
+                media = MediaFileUpload(
+                    video_path,
+                    mimetype='video/mp4',
+                    resumable=True
+                )
             
             # Execute the upload
-            logger.info(f"Starting upload of video: {title}")
-            request = self.youtube.videos().insert(
-                part=','.join(body.keys()),
-                body=body,
-                media_body=media
-            )
-            
-            # Upload the video
-            response = None
-            while response is None:
-                status, response = request.next_chunk()
-                if status:
-                    logger.info(f"Uploaded {int(status.progress() * 100)}%")
+            logger.info("Starting upload of video: %s", title)
+            start = time.monotonic()
+            with self._spend_quota('videos.insert'):
+                request = self.youtube.videos().insert(
+                    part=','.join(body.keys()),
+                    body=body,
+                    media_body=media
+                )
+                
+                # Upload the video; a chunk that fails transiently is resumed from what YouTube received
+                response = None
+                while response is None:
+                    status, response = call_with_retries(self.breaker, request.next_chunk, retries=YOUTUBE_UPLOAD_RETRIES,
+                                                         on_retry=YOUTUBE_UPLOAD_RETRY_COUNT.inc)
+                    if status:
+                        logger.info("Uploaded %d%%", int(status.progress() * 100), extra={'sampled': True})
             
-            logger.info(f"Video upload complete: {response['id']}")
+            YOUTUBE_UPLOAD_DURATION.observe(time.monotonic() - start, status='completed')
+            YOUTUBE_UPLOAD_BYTES.inc(os.path.getsize(video_path))
+            logger.info("Video upload complete: %s", response['id'])
             
             # Return the uploaded video details
             return {
@@ -227,7 +334,10 @@ class YouTubeClient:
                 'title': response['snippet']['title']
             }
         except Exception as e:
-            logger.error(f"Error uploading video: {str(e)}")
+            if 'start' in locals():
+                YOUTUBE_UPLOAD_DURATION.observe(time.monotonic() - start, status='failed')
+            YOUTUBE_API_ERRORS.inc(call='videos.insert')
+            logger.error("Error uploading video: %s", e)
             raise
     
     def update_video_thumbnail(self, video_id, thumbnail_path):
@@ -244,13 +354,16 @@ class YouTubeClient:
             )
             
             # Set the thumbnail
-            self.youtube.thumbnails().set(
-                videoId=video_id,
-                media_body=media
-            ).execute()
+            with self._spend_quota('thumbnails.set'):
+                request = self.youtube.thumbnails().set(
+                    videoId=video_id,
+                    media_body=media
+                )
+                call_with_retries(self.breaker, request.execute)
             
-            logger.info(f"Thumbnail updated for video {video_id}")
+            logger.info("Thumbnail updated for video %s", video_id)
             return True
         except Exception as e:
-            logger.error(f"Error updating video thumbnail: {str(e)}")
+            YOUTUBE_API_ERRORS.inc(call='thumbnails.set')
+            logger.error("Error updating video thumbnail: %s", e)
             raise
@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import datetime
+from zoneinfo import ZoneInfo
+from config import YOUTUBE_DAILY_QUOTA
+from metrics import YOUTUBE_QUOTA_UNITS
+
+logger = logging.getLogger(__name__)
+
+# YouTube Data API quota resets at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+# Unit cost of each API call we make
+QUOTA_COSTS = {
+    'videos.insert': 1600,
+    'thumbnails.set': 50,
+    'channels.list': 1
+}
+
+# Units a full upload spends: the video itself plus its thumbnail
+UPLOAD_COST = QUOTA_COSTS['videos.insert'] + QUOTA_COSTS['thumbnails.set']
+
+# Error reasons YouTube returns when a daily limit has been hit
+QUOTA_ERROR_REASONS = ('quotaExceeded', 'dailyLimitExceeded', 'uploadLimitExceeded')
+
+class YouTubeQuotaExceededError(Exception):
+    """Raised when a call would exceed the project's daily YouTube quota."""
+
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+def quota_day(now=None):
+    """Return the Pacific-time date that quota spent at `now` (UTC) counts against."""
+    now = now or datetime.datetime.utcnow()
+    return now.replace(tzinfo=datetime.timezone.utc).astimezone(QUOTA_TIMEZONE).date()
+
+def next_reset(now=None):
+    """Return the next quota reset as a naive UTC datetime."""
+    day = quota_day(now) + datetime.timedelta(days=1)
+    midnight = datetime.datetime.combine(day, datetime.time(), tzinfo=QUOTA_TIMEZONE)
+    return midnight.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def project_key(client_id=None, api_key=None):
+    """Identify the API project whose quota a set of credentials spends.
+
+    The OAuth client ID names the project; API keys are secrets, so they are
+    only ever stored hashed.
+    """
+    if client_id:
+        return client_id
+    if api_key:
+        return 'key-' + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return None
+
+def is_quota_error(error):
+    """Return True if an API error means the daily quota has run out."""
+    resp = getattr(error, 'resp', None)
+    if getattr(resp, 'status', None) != 403:
+        return False
+
+    # Other 403s (e.g. forbidden) carry different reasons in the error body
+    content = getattr(error, 'content', b'') or b''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', 'replace')
+    return any(reason in content for reason in QUOTA_ERROR_REASONS)
+
+class QuotaLedger:
+    """Records the quota units spent by one API project and predicts what's left today."""
+
+    def __init__(self, project, daily_quota=None):
+        self.project = project
+        self.daily_quota = YOUTUBE_DAILY_QUOTA if daily_quota is None else daily_quota
+
+    def used(self, day=None):
+        """Return the units spent on a quota day (today by default)."""
+        from app import db
+        from models import YouTubeQuotaUsage
+
+        if not self.project:
+            return 0
+        total = (
+            db.session.query(db.func.sum(YouTubeQuotaUsage.units))
+            .filter_by(project=self.project, quota_day=day or quota_day())
+            .scalar()
+        )
+        return total or 0
+
+    def remaining(self):
+        """Return the units left until the next reset."""
+        return max(self.daily_quota - self.used(), 0)
+
+    def record(self, call, units=None):
+        """Add a call's cost to today's ledger."""
+        from app import db
+        from models import YouTubeQuotaUsage
+
+        if not self.project:
+            return
+        units = QUOTA_COSTS.get(call, 1) if units is None else units
+        try:
+            db.session.add(YouTubeQuotaUsage(project=self.project, quota_day=quota_day(), call=call, units=units))
+            db.session.commit()
+            YOUTUBE_QUOTA_UNITS.inc(units, call=call)
+        except Exception as e:
+            # Accounting is advisory; never let it fail the API call itself
+            db.session.rollback()
+            logger.warning("Failed to record YouTube quota usage for %s: %s", call, e)
+
+    def check(self, units):
+        """Raise YouTubeQuotaExceededError if `units` won't fit in today's remaining budget."""
+        remaining = self.remaining()
+        if units > remaining:
+            retry_at = next_reset()
+            raise YouTubeQuotaExceededError(
+                f"YouTube quota exhausted ({remaining} of {self.daily_quota} units left, need {units}); "
+                f"retrying after {retry_at.strftime('%Y-%m-%d %H:%M')} UTC",
+                retry_at
+            )
+
+    def mark_exhausted(self):
+        """Record that YouTube rejected a call for quota, so nothing else is tried until the reset."""
+        remaining = self.remaining()
+        if remaining:
+            self.record('quota.exhausted', remaining)
+        logger.warning("YouTube quota exhausted for project %s until %s UTC", self.project, next_reset())
+
+    def summary(self, pending_uploads=0):
+        """Return today's usage and a forecast for the dashboard."""
+        used = self.used()
+        remaining = max(self.daily_quota - used, 0)
+        uploads_left = remaining // UPLOAD_COST
+        return {
+            'project': self.project,
+            'limit': self.daily_quota,
+            'used': used,
+            'remaining': remaining,
+            'percent': min(int(100 * used / self.daily_quota), 100) if self.daily_quota else 100,
+            'uploads_left': uploads_left,
+            'pending_uploads': pending_uploads,
+            'will_defer': max(pending_uploads - uploads_left, 0),
+            'reset_at': next_reset()
+        }
+
+def quota_summaries(configs):
+    """Return each show's quota summary, keyed by config ID.
+
+    Shows that share an API project share its budget, so pending uploads are
+    counted across all of them.
+    """
+    from app import db
+    from models import ConversionJob
+
+    projects = {}
+    for config in configs:
+        key = project_key(config.youtube_client_id, config.youtube_api_key)
+        if key:
+            projects.setdefault(key, []).append(config.id)
+
+    now = datetime.datetime.utcnow()
+    reset = next_reset(now)
+    summaries = {}
+    for key, config_ids in projects.items():
+        # Uploads that could start before the reset: pending jobs already due or due today
+        pending = (
+            db.session.query(db.func.count(ConversionJob.id))
+            .filter(
+                ConversionJob.config_id.in_(config_ids),
+                ConversionJob.status.in_(('pending', 'processing')),
+                db.or_(ConversionJob.not_before.is_(None), ConversionJob.not_before < reset)
+            )
+            .scalar()
+        )
+        summary = QuotaLedger(key).summary(pending or 0)
+        for config_id in config_ids:
+            summaries[config_id] = summary
+    return summaries